@@ -1,3 +1,87 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import Order
+from cart.utils import place_order
+from movies.models import Movie
+from moviesstore.testing import INVALID_CURSORS, QueryPlanTestMixin
+
+
+@override_settings(ORDERS_PAGE_SIZE=5)
+class OrdersViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='secret')
+        self.movies = [
+            Movie.objects.create(name=f'Movie {i}', price=i + 1, description='',
+                                 image='movie_images/test.jpg')
+            for i in range(3)
+        ]
+        self.client.login(username='buyer', password='secret')
+
+    def place_orders(self, count):
+        cart = {str(movie.id): '1' for movie in self.movies}
+        return [place_order(self.user, cart) for _ in range(count)]
+
+    def test_query_count_is_constant_per_page(self):
+        self.place_orders(1)
+        # session, user, orders, items with their movies
+        with self.assertNumQueries(4):
+            self.client.get(reverse('accounts.orders'))
+        self.place_orders(20)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('accounts.orders'))
+
+    def test_pages_walk_back_through_history(self):
+        orders = self.place_orders(7)
+        response = self.client.get(reverse('accounts.orders'))
+        page = response.context['template_data']['orders']
+        self.assertEqual([order.id for order in page], [order.id for order in orders[:1:-1]])
+        response = self.client.get(reverse('accounts.orders'), {'after': page.next_cursor})
+        page = response.context['template_data']['orders']
+        self.assertEqual([order.id for order in page], [orders[1].id, orders[0].id])
+        self.assertFalse(page.has_next)
+        self.assertContains(response, 'Movie 2')
+
+    def test_orders_within_one_millisecond_are_not_skipped(self):
+        orders = self.place_orders(6)
+        base = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        for order, microseconds in zip(orders, [500, 900, 1000, 2000, 3000, 4000]):
+            Order.objects.filter(id=order.id).update(date=base + timedelta(microseconds=microseconds))
+        response = self.client.get(reverse('accounts.orders'))
+        page = response.context['template_data']['orders']
+        self.assertEqual(page.object_list[-1].id, orders[1].id)
+        response = self.client.get(reverse('accounts.orders'), {'after': page.next_cursor})
+        page = response.context['template_data']['orders']
+        self.assertEqual([order.id for order in page], [orders[0].id])
+
+    def test_invalid_cursors_show_the_first_page(self):
+        orders = self.place_orders(7)
+        for cursor in INVALID_CURSORS:
+            for param in ['after', 'before']:
+                with self.subTest(param=param, cursor=cursor):
+                    response = self.client.get(reverse('accounts.orders'), {param: cursor})
+                    self.assertEqual(response.status_code, 200)
+                    page = response.context['template_data']['orders']
+                    self.assertEqual([order.id for order in page],
+                                     [order.id for order in orders[:1:-1]])
+
+
+@override_settings(ORDERS_PAGE_SIZE=5)
+class OrdersQueryPlanTests(QueryPlanTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='secret')
+        movie = Movie.objects.create(name='Movie', price=1, description='',
+                                     image='movie_images/test.jpg')
+        for _ in range(7):
+            place_order(self.user, {str(movie.id): '1'})
+        self.client.login(username='buyer', password='secret')
+
+    def test_order_history(self):
+        response = self.assertNoFullScans(self.client.get, reverse('accounts.orders'))
+        page = response.context['template_data']['orders']
+        self.assertNoFullScans(self.client.get, reverse('accounts.orders'),
+                               {'after': page.next_cursor})
@@ -4,6 +4,10 @@ from .forms import CustomUserCreationForm, CustomErrorList
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.db.models import Prefetch
+from cart.models import Item
+from moviesstore.pagination import keyset_paginate
 
 @login_required
 def logout(request):
@@ -46,9 +50,25 @@ def signup(request):
 
 @login_required
 def orders(request):
+    # Items and their movies are fetched for the whole page in one query,
+    # loading only the columns the template shows
+    items = (
+        Item.objects
+        .select_related('movie')
+        .only('id', 'quantity', 'order_id', 'movie__id', 'movie__name', 'movie__price')
+    )
+    orders = (
+        request.user.order_set
+        .only('id', 'date', 'total', 'user_id')
+        .prefetch_related(Prefetch('item_set', queryset=items))
+    )
     template_data = {}
     template_data['title'] = 'Orders'
-    template_data['orders'] = request.user.order_set.all()
+    template_data['orders'] = keyset_paginate(
+        orders, ['-date', '-id'],
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        page_size=getattr(settings, 'ORDERS_PAGE_SIZE', 10))
     return render(request, 'accounts/orders.html',
         {'template_data': template_data})
 # Create your views here.
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Order, Item
+from .models import Order, Item, GeocodedAddress
 admin.site.register(Order)
 admin.site.register(Item)
+admin.site.register(GeocodedAddress)
 # Register your models here.
@@ -0,0 +1,202 @@
+"""
+Asynchronous geocoding client.
+
+Queries the configured providers concurrently (hedged or raced, see
+cart.geocode_orchestrator) and keeps the first answer, so one slow provider
+no longer holds up a lookup, and resolves many addresses concurrently over
+pooled connections. The provider definitions, endpoints
+and rate limits are shared with the blocking GeocodingService.
+
+httpx is used when it is installed. Without it, each request runs on the
+client's own thread pool through a pooled requests.Session, which still
+lets many lookups wait on the network at the same time.
+
+Blocking callers (GeocodingService) go through run_in_background, which
+keeps one client on a background event loop for the life of the process.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional, Tuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .geocode_orchestrator import call_provider, orchestrate
+from .geocoding import USER_AGENT, configured_providers, get_rate_limiter, provider_url
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_CONNECTIONS = 20
+
+Coordinates = Optional[Tuple[float, float]]
+
+
+class AsyncGeocodingClient:
+    """
+    Pooled async HTTP client for the geocoding providers.
+
+    Use it as an async context manager so the pool is closed with the
+    event loop that created it:
+
+        async with AsyncGeocodingClient() as client:
+            coordinates = await client.geocode('Atlanta, GA, USA')
+    """
+
+    def __init__(self, timeout: float = None, max_connections: int = None):
+        self.timeout = timeout or getattr(settings, 'GEOCODING_TIMEOUT', DEFAULT_TIMEOUT)
+        max_connections = max_connections or getattr(
+            settings, 'GEOCODING_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)
+        if httpx is not None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, headers={'User-Agent': USER_AGENT},
+                limits=httpx.Limits(max_connections=max_connections))
+            self._session = None
+        else:
+            self._client = None
+            # A private pool, so closing the client never waits for the
+            # requests of providers that lost a race
+            self._executor = ThreadPoolExecutor(max_connections,
+                                                thread_name_prefix='geocoding')
+            self._session = requests.Session()
+            self._session.headers.update({'User-Agent': USER_AGENT})
+            adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        else:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._session.close()
+
+    def _get_json(self, url, params):
+        response = self._session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_json(self, url: str, params: dict):
+        """GET a URL and decode its JSON body; raises on HTTP errors."""
+        if self._client is not None:
+            response = await self._client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._get_json, url, params)
+
+    async def lookup(self, provider, address: str, api_key: Optional[str] = None) -> Coordinates:
+        """
+        Geocode with one provider, honouring its rate limit and circuit breaker.
+
+        Args:
+            provider: Entry of cart.geocoding.PROVIDERS
+            address: Full address string to geocode
+            api_key: The provider's API key, if it needs one
+
+        Returns:
+            Tuple of (latitude, longitude) or None if geocoding fails
+        """
+        errors = (requests.RequestException, ValueError, KeyError, asyncio.TimeoutError)
+        if httpx is not None:
+            errors += (httpx.HTTPError,)
+
+        async def fetch():
+            data = await asyncio.wait_for(
+                self.get_json(provider_url(provider.name), provider.params(address, api_key)),
+                self.timeout)
+            return provider.parse(data)
+
+        try:
+            await get_rate_limiter(provider.name).aacquire()
+            return await call_provider(provider.name, fetch)
+        except errors as e:
+            print(f"{provider.label} geocoding error: {e!r}")
+            return None
+
+    async def geocode(self, address: str, strategy: Optional[str] = None) -> Coordinates:
+        """
+        Geocode with every configured provider, scheduled by `orchestrate`.
+
+        Args:
+            address: Full address string to geocode
+            strategy: 'hedge', 'race' or 'sequential' (default: the
+                GEOCODING_STRATEGY setting)
+
+        Returns:
+            Tuple of (latitude, longitude) or None if every provider fails
+        """
+        calls = [partial(self.lookup, provider, address, api_key)
+                 for provider, api_key in configured_providers()]
+        return await orchestrate(calls, strategy)
+
+    async def geocode_many(self, addresses: Dict, concurrency: int = 4) -> Dict:
+        """
+        Geocode many addresses, at most `concurrency` at a time.
+
+        Args:
+            addresses: Dict mapping any key to an address string
+            concurrency: Maximum number of addresses in flight
+
+        Returns:
+            Dict mapping each key to its coordinates or None
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(address):
+            async with semaphore:
+                return await self.geocode(address)
+
+        keys = list(addresses)
+        results = await asyncio.gather(*(one(addresses[key]) for key in keys))
+        return dict(zip(keys, results))
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+def _background_client():
+    """The process's (loop, client) pair, started on first use."""
+    global _background
+    with _background_lock:
+        # A forked worker inherits the object but not the loop's thread
+        if _background is None or _background[0] != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='geocoding', daemon=True).start()
+
+            async def create():
+                return AsyncGeocodingClient()
+            client = asyncio.run_coroutine_threadsafe(create(), loop).result()
+            _background = (os.getpid(), loop, client)
+        return _background[1], _background[2]
+
+
+def run_in_background(call):
+    """
+    Run a client coroutine on the process-wide geocoding event loop.
+
+    Blocking code shares one AsyncGeocodingClient, and so one connection
+    pool, per process instead of building a client per lookup.
+
+    Args:
+        call: Function taking the client and returning a coroutine
+
+    Returns:
+        The coroutine's result, once it has finished
+    """
+    loop, client = _background_client()
+    return asyncio.run_coroutine_threadsafe(call(client), loop).result()
@@ -0,0 +1,302 @@
+"""
+Offline geocoding from a local gazetteer file.
+
+A gazetteer is a list of (city, state, country, latitude, longitude) rows.
+`build` turns a CSV of them into a compact binary file, which `Gazetteer`
+memory-maps, so every worker process shares the same pages and nothing is
+parsed at startup:
+
+    b'GZT1' | count (uint32) | key offsets ((count + 1) x uint32)
+            | coordinates (count x 2 x float32) | keys (UTF-8)
+
+Keys are "country|city|state" in normalized form, sorted, so an address is
+found by binary search and all the cities of a country, or all the states
+sharing a city name, are one contiguous range. Country names and US state
+names are reduced to their codes, so "Atlanta, Georgia, United States"
+matches the row "Atlanta, GA, US". Callers off the request path (the
+geocode worker and the backfill) can also ask for close spellings of the
+city in the same country (and state, if given), found with difflib. That
+scans all of the country's places, so checkout only does exact lookups.
+
+The file is read from GEOCODING_GAZETTEER_PATH (default:
+cart/data/gazetteer.bin). The default file is built from the bundled
+cart/data/gazetteer.csv on first use if it is missing; other files are
+built with the build_gazetteer command. The file is reopened whenever it
+changes, so a rebuilt or newly installed gazetteer is picked up without a
+restart. Without one, lookups simply miss.
+"""
+import csv
+import difflib
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import insort
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from .geocode_cache import normalize_address
+from .geocode_orchestrator import provider_calls
+
+MAGIC = b'GZT1'
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+DEFAULT_PATH = DATA_DIR / 'gazetteer.bin'
+DEFAULT_SOURCE = DATA_DIR / 'gazetteer.csv'
+DEFAULT_FUZZY_CUTOFF = 0.85
+DEFAULT_FUZZY_TIE_MARGIN = 0.01   # closer scores than this are a tie
+DEFAULT_COUNTRY = 'usa'      # Order.country defaults to USA too
+SEPARATOR = '|'
+
+COUNTRY_CODES = {
+    'usa': 'us', 'u.s.': 'us', 'u.s.a.': 'us', 'united states': 'us',
+    'united states of america': 'us', 'america': 'us',
+    'canada': 'ca', 'mexico': 'mx', 'uk': 'gb', 'united kingdom': 'gb',
+    'great britain': 'gb', 'england': 'gb', 'france': 'fr', 'germany': 'de',
+    'spain': 'es', 'italy': 'it', 'japan': 'jp', 'india': 'in',
+    'australia': 'au', 'brazil': 'br', 'china': 'cn',
+}
+
+US_STATE_CODES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar',
+    'california': 'ca', 'colorado': 'co', 'connecticut': 'ct', 'delaware': 'de',
+    'district of columbia': 'dc', 'florida': 'fl', 'georgia': 'ga', 'hawaii': 'hi',
+    'idaho': 'id', 'illinois': 'il', 'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks',
+    'kentucky': 'ky', 'louisiana': 'la', 'maine': 'me', 'maryland': 'md',
+    'massachusetts': 'ma', 'michigan': 'mi', 'minnesota': 'mn', 'mississippi': 'ms',
+    'missouri': 'mo', 'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv',
+    'new hampshire': 'nh', 'new jersey': 'nj', 'new mexico': 'nm', 'new york': 'ny',
+    'north carolina': 'nc', 'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok',
+    'oregon': 'or', 'pennsylvania': 'pa', 'rhode island': 'ri',
+    'south carolina': 'sc', 'south dakota': 'sd', 'tennessee': 'tn', 'texas': 'tx',
+    'utah': 'ut', 'vermont': 'vt', 'virginia': 'va', 'washington': 'wa',
+    'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+}
+
+
+def gazetteer_key(city: Optional[str], state: Optional[str] = None,
+                  country: Optional[str] = None) -> Tuple[str, str, str]:
+    """
+    Normalize an address for the gazetteer.
+
+    Returns:
+        Tuple of (country, city, state), with the country and US state
+        reduced to their codes; a missing country is taken to be
+        GEOCODING_GAZETTEER_DEFAULT_COUNTRY
+    """
+    city, state, country = normalize_address(
+        city, state, country or getattr(settings, 'GEOCODING_GAZETTEER_DEFAULT_COUNTRY',
+                                        DEFAULT_COUNTRY))
+    country = COUNTRY_CODES.get(country, country)
+    if country == 'us':
+        state = US_STATE_CODES.get(state, state)
+    return country, city.replace(SEPARATOR, ' '), state.replace(SEPARATOR, ' ')
+
+
+def build(source, destination) -> int:
+    """
+    Write the binary gazetteer for a CSV file.
+
+    Args:
+        source: CSV with a header row naming the columns city, state,
+            country, latitude and longitude (state may be empty)
+        destination: Path of the binary file to write
+
+    Returns:
+        Number of places written; repeated places keep their first row
+    """
+    places = {}
+    with open(source, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if not row.get('city'):
+                continue
+            key = SEPARATOR.join(gazetteer_key(row['city'], row.get('state'), row.get('country')))
+            places.setdefault(key.encode('utf-8'),
+                              (float(row['latitude']), float(row['longitude'])))
+
+    keys = sorted(places)
+    offsets = array('I', [0])
+    coordinates = array('f')
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+        coordinates.extend(places[key])
+    destination = Path(destination)
+    # Per process, as several workers may build a missing file at once
+    temporary = destination.with_name(f'{destination.name}.{os.getpid()}.tmp')
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(keys)))
+        f.write(offsets.tobytes())
+        f.write(coordinates.tobytes())
+        f.write(b''.join(keys))
+    # Readers keep their mapping of the old file until they reload
+    temporary.replace(destination)
+    return len(keys)
+
+
+class Gazetteer:
+    """Read-only, memory-mapped view of a binary gazetteer file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:4] != MAGIC:
+            raise ValueError(f'{path} is not a gazetteer file')
+        self.count = struct.unpack_from('<I', self._map, 4)[0]
+        start = 8
+        self._offsets = memoryview(self._map)[start:start + 4 * (self.count + 1)].cast('I')
+        start += 4 * (self.count + 1)
+        self._coordinates = memoryview(self._map)[start:start + 8 * self.count].cast('f')
+        self._keys = start + 8 * self.count
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    def __len__(self):
+        return self.count
+
+    def key(self, index: int) -> bytes:
+        return self._map[self._keys + self._offsets[index]:self._keys + self._offsets[index + 1]]
+
+    def coordinates(self, index: int) -> Tuple[float, float]:
+        # float32 keeps about a metre of precision, plenty for a city
+        return (round(self._coordinates[2 * index], 5), round(self._coordinates[2 * index + 1], 5))
+
+    def _bisect(self, key: bytes) -> int:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def prefixed(self, prefix: str):
+        """Yield (index, key) for every key starting with prefix, in order."""
+        prefix = prefix.encode('utf-8')
+        index = self._bisect(prefix)
+        while index < self.count:
+            key = self.key(index)
+            if not key.startswith(prefix):
+                return
+            yield index, key.decode('utf-8')
+            index += 1
+
+    def _lookup(self, city: Optional[str], state: Optional[str] = None,
+                country: Optional[str] = None,
+                fuzzy: bool = False) -> Optional[Tuple[float, float]]:
+        country, city, state = gazetteer_key(city, state, country)
+        if not city:
+            return None
+        if state:
+            # Places listed without a state match any state
+            for key in (SEPARATOR.join((country, city, state)), SEPARATOR.join((country, city, ''))):
+                key = key.encode('utf-8')
+                index = self._bisect(key)
+                if index < self.count and self.key(index) == key:
+                    return self.coordinates(index)
+        else:
+            # No state: the city name must be unambiguous in the country
+            matches = list(self.prefixed(SEPARATOR.join((country, city, ''))))
+            if len(matches) == 1:
+                return self.coordinates(matches[0][0])
+            if matches:
+                return None
+        return self._fuzzy(country, city, state) if fuzzy else None
+
+    def _fuzzy(self, country, city, state):
+        """Closest spelling of the city among the country's places."""
+        cutoff = getattr(settings, 'GEOCODING_GAZETTEER_CUTOFF', DEFAULT_FUZZY_CUTOFF)
+        # Keep the best few (score, city, index) for places in the right state
+        matcher = difflib.SequenceMatcher(b=city)
+        best = []
+        for index, key in self.prefixed(country + SEPARATOR):
+            _, candidate, candidate_state = key.split(SEPARATOR)
+            if state and candidate_state != state:
+                continue
+            matcher.set_seq1(candidate)
+            if (matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff
+                    and matcher.ratio() >= cutoff):
+                insort(best, (-matcher.ratio(), candidate, index))
+                del best[2:]
+        if not best:
+            return None
+        # A near-tie between two different places is ambiguous
+        margin = getattr(settings, 'GEOCODING_GAZETTEER_TIE_MARGIN', DEFAULT_FUZZY_TIE_MARGIN)
+        if len(best) == 2 and best[1][0] - best[0][0] < margin:
+            return None
+        return self.coordinates(best[0][2])
+
+
+_gazetteer = None
+_gazetteer_file = None
+_default_build_tried = False
+_gazetteer_lock = threading.Lock()
+
+
+def _file_version(path):
+    """(path, mtime, size) of a file, or None if it does not exist."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def get_gazetteer() -> Optional[Gazetteer]:
+    """
+    The gazetteer at GEOCODING_GAZETTEER_PATH, or None if there is none.
+
+    The default file is built from the bundled CSV when it is missing, and
+    any file is reopened once it changes on disk.
+    """
+    global _gazetteer, _gazetteer_file, _default_build_tried
+    path = Path(getattr(settings, 'GEOCODING_GAZETTEER_PATH', None) or DEFAULT_PATH)
+    with _gazetteer_lock:
+        version = _file_version(path)
+        if (version is None and path == DEFAULT_PATH and not _default_build_tried
+                and DEFAULT_SOURCE.is_file()):
+            _default_build_tried = True
+            try:
+                build(DEFAULT_SOURCE, path)
+            except (OSError, KeyError, ValueError):
+                pass    # e.g. a read-only install: run build_gazetteer instead
+            version = _file_version(path)
+        if version != _gazetteer_file:
+            _gazetteer_file = version
+            try:
+                _gazetteer = Gazetteer(path) if version else None
+            except (OSError, ValueError):
+                _gazetteer = None
+        return _gazetteer
+
+
+def reset_gazetteer() -> None:
+    """Reopen the gazetteer on next use (after rebuilding it)."""
+    global _gazetteer, _gazetteer_file, _default_build_tried
+    with _gazetteer_lock:
+        _gazetteer = _gazetteer_file = None
+        _default_build_tried = False
+
+
+def gazetteer_lookup(city: Optional[str], state: Optional[str] = None,
+                     country: Optional[str] = None,
+                     fuzzy: bool = False) -> Optional[Tuple[float, float]]:
+    """
+    Geocode an address from the gazetteer, without any network access.
+
+    Args:
+        fuzzy: Also try close spellings of the city when there is no exact
+            match. This is a linear scan, so keep it off the request path.
+
+    Returns:
+        Tuple of (latitude, longitude), or None if there is no gazetteer or
+        the address is not in it (or is ambiguous)
+    """
+    gazetteer = get_gazetteer()
+    if gazetteer is None or not city:
+        return None
+    coordinates = gazetteer.lookup(city, state, country, fuzzy)
+    provider_calls.inc(provider='gazetteer', outcome='found' if coordinates else 'miss')
+    return coordinates
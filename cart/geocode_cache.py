@@ -0,0 +1,155 @@
+"""
+Two-tier cache for geocoding results.
+
+Lookups are keyed on the normalized (city, state, country) tuple. The first
+tier is an in-process LRU so repeat cities never leave the process; the second
+tier is the GeocodedAddress table so results survive restarts and are shared
+between workers. Failed lookups are cached too (with a shorter TTL) so
+geocode_address does not ask the providers about an unknown city on every
+call. The geocode worker ignores them: a failure may have been a timeout,
+and its own retry backoff already spaces out the calls.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from moviesstore.instrumentation import record_cache
+
+AddressKey = Tuple[str, str, str]
+Coordinates = Optional[Tuple[float, float]]
+
+# Default lifetimes, overridable in settings
+DEFAULT_TTL = 60 * 60 * 24 * 30        # 30 days for successful lookups
+DEFAULT_NEGATIVE_TTL = 60 * 60         # 1 hour for failed lookups
+DEFAULT_LRU_SIZE = 1024
+
+
+def normalize_address(city: Optional[str], state: Optional[str] = None,
+                      country: Optional[str] = None) -> AddressKey:
+    """
+    Build the cache key for an address.
+
+    Whitespace is collapsed and case is folded so that "New  York" and
+    "new york" share a cache entry. Missing parts become empty strings.
+    """
+    def clean(value):
+        return ' '.join((value or '').split()).casefold()
+    return (clean(city), clean(state), clean(country))
+
+
+class GeocodeCache:
+    """
+    In-process LRU in front of the persistent GeocodedAddress table.
+
+    `get` returns a (found, coordinates) pair so that a cached negative
+    result (found=True, coordinates=None) can be told apart from a miss.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_LRU_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, 'GEOCODE_CACHE_TTL', DEFAULT_TTL)
+
+    @property
+    def negative_ttl(self) -> int:
+        return getattr(settings, 'GEOCODE_NEGATIVE_CACHE_TTL', DEFAULT_NEGATIVE_TTL)
+
+    def get(self, key: AddressKey) -> Tuple[bool, Coordinates]:
+        """
+        Look up an address in the LRU, then in the database.
+
+        Args:
+            key: Normalized address from normalize_address()
+
+        Returns:
+            Tuple of (found, coordinates); coordinates is None for a cached
+            negative result or a miss
+        """
+        found, coordinates = self._get_local(key)
+        if found:
+            record_cache('geocode', True)
+            return True, coordinates
+
+        from .models import GeocodedAddress
+        city, state, country = key
+        row = (GeocodedAddress.objects
+               .filter(city=city, state=state, country=country,
+                       expires_at__gt=timezone.now())
+               .only('latitude', 'longitude', 'expires_at')
+               .first())
+        record_cache('geocode', row is not None)
+        if row is None:
+            return False, None
+
+        coordinates = row.coordinates
+        remaining = (row.expires_at - timezone.now()).total_seconds()
+        self._set_local(key, coordinates, remaining)
+        return True, coordinates
+
+    def set(self, key: AddressKey, coordinates: Coordinates) -> None:
+        """
+        Store a lookup result (or a failed lookup) in both tiers.
+
+        Args:
+            key: Normalized address from normalize_address()
+            coordinates: Tuple of (latitude, longitude), or None if the
+                providers could not resolve the address
+        """
+        ttl = self.ttl if coordinates else self.negative_ttl
+        latitude, longitude = coordinates if coordinates else (None, None)
+
+        from .models import GeocodedAddress
+        city, state, country = key
+        GeocodedAddress.objects.update_or_create(
+            city=city, state=state, country=country,
+            defaults={
+                'latitude': latitude,
+                'longitude': longitude,
+                'expires_at': timezone.now() + timedelta(seconds=ttl),
+            },
+        )
+        self._set_local(key, coordinates, ttl)
+
+    def clear(self) -> None:
+        """Drop the in-process tier (the database tier is left untouched)."""
+        with self._lock:
+            self._entries.clear()
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            coordinates, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, coordinates
+
+    def _set_local(self, key, coordinates, ttl):
+        with self._lock:
+            self._entries[key] = (coordinates, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_geocode_cache = None
+
+def get_geocode_cache() -> GeocodeCache:
+    """Get or create the geocode cache singleton."""
+    global _geocode_cache
+    if _geocode_cache is None:
+        _geocode_cache = GeocodeCache(
+            getattr(settings, 'GEOCODE_CACHE_SIZE', DEFAULT_LRU_SIZE))
+    return _geocode_cache
@@ -0,0 +1,215 @@
+"""
+Scheduling of geocoding providers: racing, hedging and circuit breakers.
+
+A lookup used to try each provider in turn, so a degraded provider added
+its whole timeout to every lookup. `orchestrate` runs the providers with
+one of three strategies (GEOCODING_STRATEGY):
+
+- 'hedge' (default): ask the preferred provider first and start the next
+  one if no answer arrived within GEOCODING_HEDGE_DELAY seconds, or as soon
+  as a provider fails;
+- 'race': ask every provider at once;
+- 'sequential': the old one-at-a-time behaviour.
+
+The first coordinates found win and the other calls are cancelled.
+Providers that keep failing are skipped by a per-provider circuit breaker
+until GEOCODING_BREAKER_RESET seconds have passed, after which a single
+trial call decides whether they are healthy again.
+
+Latency, outcomes and breaker states are exported through
+moviesstore.metrics.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+
+from moviesstore.instrumentation import record_external
+from moviesstore.metrics import REGISTRY, counter, gauge, histogram
+
+DEFAULT_STRATEGY = 'hedge'
+DEFAULT_HEDGE_DELAY = 0.5
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30
+
+provider_latency = histogram(
+    'geocoding_provider_latency_seconds',
+    'Time taken by geocoding provider calls that got a response', ['provider'])
+provider_calls = counter(
+    'geocoding_provider_calls_total',
+    'Geocoding provider calls by outcome (found, miss, error, cancelled, skipped)',
+    ['provider', 'outcome'])
+breaker_state = gauge(
+    'geocoding_provider_circuit_state',
+    'Circuit breaker state per provider (0 closed, 1 half-open, 2 open)', ['provider'])
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed: calls go through. After `threshold` failures in a row it opens
+    and calls are refused for `reset_timeout` seconds; then it is half-open
+    and lets one trial call through, which closes it again on success or
+    re-opens it on failure.
+    """
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half-open', 'open'
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, reset_timeout=DEFAULT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Whether a call may be made now (claims the trial when half-open)."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release(self):
+        """Give back a trial claimed by allow() whose call was cancelled."""
+        with self._lock:
+            self._trial_running = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider):
+    """Get or create the shared circuit breaker for a provider."""
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(
+                getattr(settings, 'GEOCODING_BREAKER_THRESHOLD', DEFAULT_BREAKER_THRESHOLD),
+                getattr(settings, 'GEOCODING_BREAKER_RESET', DEFAULT_BREAKER_RESET))
+        return _breakers[provider]
+
+
+def reset_circuit_breakers():
+    """Forget all breaker state (used by tests and benchmarks)."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def _collect_breaker_states():
+    codes = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    for provider, breaker in breakers:
+        breaker_state.set(codes[breaker.state], provider=provider)
+
+
+REGISTRY.add_collector(_collect_breaker_states)
+
+
+async def call_provider(name, fetch):
+    """
+    Run one provider call through its circuit breaker and record metrics.
+
+    Args:
+        name: Provider name
+        fetch: Coroutine function returning coordinates or None (no match),
+            raising on errors
+
+    Returns:
+        Coordinates, or None if there was no match, the call failed or the
+        breaker refused it
+    """
+    breaker = get_circuit_breaker(name)
+    if not breaker.allow():
+        provider_calls.inc(provider=name, outcome='skipped')
+        return None
+    started = time.monotonic()
+    try:
+        result = await fetch()
+    except asyncio.CancelledError:
+        breaker.release()
+        provider_calls.inc(provider=name, outcome='cancelled')
+        raise
+    except Exception:
+        breaker.record_failure()
+        provider_calls.inc(provider=name, outcome='error')
+        raise
+    finally:
+        record_external(time.monotonic() - started)
+    breaker.record_success()
+    provider_latency.observe(time.monotonic() - started, provider=name)
+    provider_calls.inc(provider=name, outcome='found' if result else 'miss')
+    return result
+
+
+async def orchestrate(calls, strategy=None, hedge_delay=None):
+    """
+    Run provider calls with the configured strategy; first answer wins.
+
+    Args:
+        calls: Coroutine functions in order of preference, each returning
+            coordinates or None
+        strategy: 'hedge', 'race' or 'sequential' (default: the
+            GEOCODING_STRATEGY setting)
+        hedge_delay: Seconds to wait before hedging (default: the
+            GEOCODING_HEDGE_DELAY setting)
+
+    Returns:
+        The first coordinates returned, or None if no call found any
+    """
+    strategy = strategy or getattr(settings, 'GEOCODING_STRATEGY', DEFAULT_STRATEGY)
+    if strategy == 'race':
+        delay = 0
+    elif strategy == 'sequential':
+        delay = None
+    elif strategy == 'hedge':
+        delay = hedge_delay if hedge_delay is not None else getattr(
+            settings, 'GEOCODING_HEDGE_DELAY', DEFAULT_HEDGE_DELAY)
+    else:
+        raise ValueError(f'Unknown geocoding strategy {strategy!r}')
+
+    remaining = list(calls)
+    pending = set()
+    try:
+        while remaining or pending:
+            # Start the next provider: at once, after the hedge delay, or
+            # once every running call has failed
+            if remaining:
+                pending.add(asyncio.ensure_future(remaining.pop(0)()))
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    return task.result()
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
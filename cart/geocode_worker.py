@@ -0,0 +1,216 @@
+"""
+Background resolution of order coordinates.
+
+Orders are saved with geocode_status='pending' and picked up here in batches.
+Each distinct address in a batch is looked up once: addresses in the
+offline gazetteer or the cache are resolved straight away, the rest are
+sent to the providers concurrently by the async geocoding client, which
+hedges the providers for each address (the shared per-provider token
+buckets keep it within each provider's rate limit). Addresses that cannot
+be resolved are retried with exponential backoff until
+GEOCODE_MAX_ATTEMPTS is reached.
+
+`backfill_orders` applies the same address deduplication to historical
+orders that have a city but no coordinates, whatever their status.
+"""
+import asyncio
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Q
+
+from .gazetteer import gazetteer_lookup
+from .geocode_cache import get_geocode_cache, normalize_address
+from .async_geocoding import AsyncGeocodingClient
+from .geocoding import format_address
+from .models import Order
+from .rollup import set_coordinates
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BACKOFF = 60        # seconds before the first retry
+MAX_RETRY_BACKOFF = 60 * 60 * 24  # never wait more than a day between retries
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff for an order that has failed `attempts` times."""
+    base = getattr(settings, 'GEOCODE_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), MAX_RETRY_BACKOFF))
+
+
+def resolve_addresses(addresses, workers=4):
+    """
+    Resolve distinct addresses through the gazetteer and the cache, then
+    the providers. Cached failures are looked up again.
+
+    Args:
+        addresses: Dict mapping normalized address keys to the
+            (city, state, country) values to send to the providers
+        workers: Number of concurrent provider lookups
+
+    Returns:
+        Dict mapping each key to (latitude, longitude), or None if it could
+        not be resolved
+    """
+    cache = get_geocode_cache()
+    results = {}
+    misses = []
+    for key, parts in addresses.items():
+        # Misspelt cities are worth a gazetteer scan here, off the request path
+        coordinates = gazetteer_lookup(*parts, fuzzy=True)
+        if coordinates:
+            results[key] = coordinates
+            continue
+        # A cached failure may have been a timeout or a provider error, so
+        # only coordinates are trusted; the retry backoff spaces out the
+        # calls for addresses that really cannot be found
+        found, coordinates = cache.get(key)
+        if found and coordinates:
+            results[key] = coordinates
+        else:
+            misses.append(key)
+
+    if misses:
+        # Only the provider calls run on the event loop; cache writes stay
+        # on this thread so the database is never written to concurrently
+        lookups = asyncio.run(_geocode_many(
+            {key: format_address(*addresses[key]) for key in misses}, workers))
+        for key in misses:
+            cache.set(key, lookups[key])
+            results[key] = lookups[key]
+    return results
+
+
+async def _geocode_many(addresses, concurrency):
+    async with AsyncGeocodingClient() as client:
+        return await client.geocode_many(addresses, concurrency)
+
+
+def geocode_pending_orders(batch_size=100, workers=4):
+    """
+    Resolve one batch of pending orders.
+
+    Args:
+        batch_size: Maximum number of orders to process
+        workers: Number of concurrent provider lookups
+
+    Returns:
+        Dict with the number of orders 'resolved', 'retried' and 'failed'
+    """
+    now = timezone.now()
+    max_attempts = getattr(settings, 'GEOCODE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    orders = list(
+        Order.objects
+        .filter(geocode_status=Order.GEOCODE_PENDING)
+        .filter(Q(geocode_retry_at__isnull=True) | Q(geocode_retry_at__lte=now))
+        .order_by('id')
+        .values('id', 'city', 'state', 'country', 'geocode_attempts')[:batch_size]
+    )
+
+    addresses = {}
+    orders_by_address = {}
+    for order in orders:
+        key = normalize_address(order['city'], order['state'], order['country'])
+        addresses.setdefault(key, (order['city'], order['state'], order['country']))
+        orders_by_address.setdefault(key, []).append(order)
+
+    stats = {'resolved': 0, 'retried': 0, 'failed': 0}
+    results = resolve_addresses(addresses, workers=workers)
+    for key, group in orders_by_address.items():
+        coordinates = results[key]
+        if coordinates:
+            latitude, longitude = coordinates
+            Order.objects.filter(id__in=[order['id'] for order in group]).update(
+                latitude=latitude,
+                longitude=longitude,
+                geocode_status=Order.GEOCODE_RESOLVED,
+                geocode_retry_at=None,
+            )
+            set_coordinates(*addresses[key], latitude, longitude)
+            stats['resolved'] += len(group)
+            continue
+
+        # Orders in the group may have failed a different number of times
+        by_attempts = {}
+        for order in group:
+            by_attempts.setdefault(order['geocode_attempts'] + 1, []).append(order['id'])
+        for attempts, ids in by_attempts.items():
+            if attempts >= max_attempts:
+                Order.objects.filter(id__in=ids).update(
+                    geocode_status=Order.GEOCODE_FAILED,
+                    geocode_attempts=attempts,
+                    geocode_retry_at=None,
+                )
+                stats['failed'] += len(ids)
+            else:
+                Order.objects.filter(id__in=ids).update(
+                    geocode_attempts=attempts,
+                    geocode_retry_at=now + retry_delay(attempts),
+                )
+                stats['retried'] += len(ids)
+    return stats
+
+
+def backfill_orders(start_after=0, batch_size=1000, workers=4):
+    """
+    Fill in the coordinates of orders that have a city but none yet.
+
+    Orders are read in id order, batch_size at a time (keyset batches
+    rather than one long-lived cursor, because the rows being read are
+    updated along the way). Each distinct address is looked up once per
+    run: the geocode cache remembers both hits and misses across batches.
+    Orders whose address cannot be resolved are left unchanged.
+
+    Args:
+        start_after: Only consider orders with a greater id (to resume)
+        batch_size: Number of orders read and written per batch
+        workers: Number of concurrent provider lookups
+
+    Yields:
+        Dict per committed batch with 'last_id', 'orders', 'addresses',
+        'resolved' and 'unresolved'
+    """
+    located = set()
+    while True:
+        orders = list(
+            Order.objects
+            .filter(id__gt=start_after, latitude__isnull=True, city__isnull=False)
+            .exclude(city='')
+            .order_by('id')
+            .only('id', 'city', 'state', 'country')[:batch_size]
+        )
+        if not orders:
+            return
+
+        addresses = {}
+        for order in orders:
+            key = normalize_address(order.city, order.state, order.country)
+            addresses.setdefault(key, (order.city, order.state, order.country))
+        results = resolve_addresses(addresses, workers=workers)
+
+        updated = []
+        for order in orders:
+            coordinates = results[normalize_address(order.city, order.state, order.country)]
+            if coordinates:
+                order.latitude, order.longitude = coordinates
+                order.geocode_status = Order.GEOCODE_RESOLVED
+                order.geocode_retry_at = None
+                updated.append(order)
+        with transaction.atomic():
+            Order.objects.bulk_update(
+                updated, ['latitude', 'longitude', 'geocode_status', 'geocode_retry_at'],
+                batch_size=500)
+            for key, coordinates in results.items():
+                if coordinates and key not in located:
+                    set_coordinates(*addresses[key], *coordinates)
+                    located.add(key)
+
+        start_after = orders[-1].id
+        yield {
+            'last_id': start_after,
+            'orders': len(orders),
+            'addresses': len(addresses),
+            'resolved': len(updated),
+            'unresolved': len(orders) - len(updated),
+        }
@@ -2,24 +2,219 @@
 Geocoding utilities for converting addresses to latitude/longitude coordinates.
 Supports multiple geocoding providers with fallback support.
 """
+import asyncio
 import requests
+import threading
 import time
+from collections import namedtuple
 from typing import Optional, Tuple
 from django.conf import settings
+from .gazetteer import gazetteer_lookup
+from .geocode_cache import get_geocode_cache, normalize_address
+
+# Requests per second allowed for each provider, overridable with the
+# GEOCODING_RATE_LIMITS setting
+DEFAULT_RATE_LIMITS = {
+    'nominatim': 1.0,
+    'opencage': 1.0,
+    'positionstack': 1.0,
+}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to honour a provider's rate limit.
+
+    Every thread in the process shares the same bucket per provider, so a
+    pool of geocoding workers never exceeds the provider's allowance.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Consume a token if one is available.
+
+        Returns:
+            0 if a token was consumed, otherwise the seconds to wait before
+            trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """Block until a token is available, then consume it."""
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        """Like acquire(), but waits without blocking the event loop."""
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+# Endpoints, overridable with the GEOCODING_PROVIDER_URLS setting (e.g. to
+# point at a self-hosted Nominatim or at a fake server in tests)
+DEFAULT_PROVIDER_URLS = {
+    'nominatim': 'https://nominatim.openstreetmap.org/search',
+    'opencage': 'https://api.opencagedata.com/geocode/v1/json',
+    'positionstack': 'http://api.positionstack.com/v1/forward',
+}
+
+USER_AGENT = 'MovieStore/1.0 (Django Application)'
+
+
+def provider_url(provider: str) -> str:
+    """Endpoint of a provider."""
+    urls = dict(DEFAULT_PROVIDER_URLS)
+    urls.update(getattr(settings, 'GEOCODING_PROVIDER_URLS', {}))
+    return urls[provider]
+
+
+def _nominatim_params(address, api_key):
+    return {'q': address, 'format': 'json', 'limit': 1, 'addressdetails': 1}
+
+
+def _nominatim_parse(data):
+    if data and len(data) > 0:
+        return (float(data[0]['lat']), float(data[0]['lon']))
+    return None
+
+
+def _opencage_params(address, api_key):
+    return {'q': address, 'key': api_key, 'limit': 1, 'no_annotations': 1}
+
+
+def _opencage_parse(data):
+    if data.get('results') and len(data['results']) > 0:
+        geometry = data['results'][0]['geometry']
+        return (float(geometry['lat']), float(geometry['lng']))
+    return None
+
+
+def _positionstack_params(address, api_key):
+    return {'access_key': api_key, 'query': address, 'limit': 1}
+
+
+def _positionstack_parse(data):
+    if data.get('data') and len(data['data']) > 0:
+        result = data['data'][0]
+        return (float(result['latitude']), float(result['longitude']))
+    return None
+
+
+# How to query each provider: the setting holding its API key (None if it
+# needs none), the query parameters for an address and the response parser
+Provider = namedtuple('Provider', ['name', 'label', 'key_setting', 'params', 'parse'])
+
+PROVIDERS = [
+    Provider('opencage', 'OpenCage', 'OPENCAGE_API_KEY', _opencage_params, _opencage_parse),
+    Provider('positionstack', 'Positionstack', 'POSITIONSTACK_API_KEY',
+             _positionstack_params, _positionstack_parse),
+    Provider('nominatim', 'Nominatim', None, _nominatim_params, _nominatim_parse),
+]
+PROVIDERS_BY_NAME = {provider.name: provider for provider in PROVIDERS}
+
+
+def configured_providers():
+    """
+    Providers usable with the current settings, in order of preference.
+
+    Returns:
+        List of (Provider, api_key) pairs; providers whose API key is not
+        configured are left out
+    """
+    providers = []
+    for provider in PROVIDERS:
+        api_key = getattr(settings, provider.key_setting, None) if provider.key_setting else None
+        if provider.key_setting is None or api_key:
+            providers.append((provider, api_key))
+    return providers
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str) -> TokenBucket:
+    """Get or create the shared token bucket for a provider."""
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            limits = dict(DEFAULT_RATE_LIMITS)
+            limits.update(getattr(settings, 'GEOCODING_RATE_LIMITS', {}))
+            _rate_limiters[provider] = TokenBucket(limits.get(provider, 1.0))
+        return _rate_limiters[provider]
 
 
 class GeocodingService:
     """
     A robust geocoding service that uses API-based geocoding providers.
-    Supports Nominatim (OpenStreetMap), OpenCage, and Positionstack.
+    Supports Nominatim (OpenStreetMap), OpenCage, and Positionstack, plus
+    an offline gazetteer (see cart.gazetteer) that callers try first.
     """
     
     def __init__(self):
         self.session = requests.Session()
         self.session.headers.update({
-            'User-Agent': 'MovieStore/1.0 (Django Application)'
+            'User-Agent': USER_AGENT
         })
+
+    def lookup(self, provider: Provider, address: str,
+               api_key: Optional[str] = None) -> Optional[Tuple[float, float]]:
+        """
+        Geocode with one provider, honouring its rate limit.
+
+        Args:
+            provider: Entry of PROVIDERS
+            address: Full address string to geocode
+            api_key: The provider's API key, if it needs one
+
+        Returns:
+            Tuple of (latitude, longitude) or None if geocoding fails
+        """
+        try:
+            get_rate_limiter(provider.name).acquire()
+            response = self.session.get(provider_url(provider.name),
+                                        params=provider.params(address, api_key), timeout=10)
+            response.raise_for_status()
+            return provider.parse(response.json())
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"{provider.label} geocoding error: {e}")
+            return None
         
+    def geocode_gazetteer(self, city: str, state: Optional[str] = None,
+                          country: Optional[str] = None) -> Optional[Tuple[float, float]]:
+        """
+        Geocode from the local gazetteer file (no network, no rate limit).
+        
+        Args:
+            city: City name
+            state: State/province name (optional)
+            country: Country name (optional)
+            
+        Returns:
+            Tuple of (latitude, longitude) or None if the address is not
+            in the gazetteer
+        """
+        return gazetteer_lookup(city, state, country)
+
     def geocode_nominatim(self, address: str) -> Optional[Tuple[float, float]]:
         """
         Geocode using OpenStreetMap's Nominatim API (free, no API key required).
@@ -31,32 +226,7 @@ class GeocodingService:
         Returns:
             Tuple of (latitude, longitude) or None if geocoding fails
         """
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            'q': address,
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1
-        }
-        
-        try:
-            # Respect Nominatim's rate limit
-            time.sleep(1)
-            
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data and len(data) > 0:
-                lat = float(data[0]['lat'])
-                lon = float(data[0]['lon'])
-                return (lat, lon)
-            
-            return None
-            
-        except (requests.RequestException, ValueError, KeyError) as e:
-            print(f"Nominatim geocoding error: {e}")
-            return None
+        return self.lookup(PROVIDERS_BY_NAME['nominatim'], address)
     
     def geocode_opencage(self, address: str, api_key: str) -> Optional[Tuple[float, float]]:
         """
@@ -70,30 +240,7 @@ class GeocodingService:
         Returns:
             Tuple of (latitude, longitude) or None if geocoding fails
         """
-        url = "https://api.opencagedata.com/geocode/v1/json"
-        params = {
-            'q': address,
-            'key': api_key,
-            'limit': 1,
-            'no_annotations': 1
-        }
-        
-        try:
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get('results') and len(data['results']) > 0:
-                geometry = data['results'][0]['geometry']
-                lat = float(geometry['lat'])
-                lon = float(geometry['lng'])
-                return (lat, lon)
-            
-            return None
-            
-        except (requests.RequestException, ValueError, KeyError) as e:
-            print(f"OpenCage geocoding error: {e}")
-            return None
+        return self.lookup(PROVIDERS_BY_NAME['opencage'], address, api_key)
     
     def geocode_positionstack(self, address: str, api_key: str) -> Optional[Tuple[float, float]]:
         """
@@ -107,33 +254,17 @@ class GeocodingService:
         Returns:
             Tuple of (latitude, longitude) or None if geocoding fails
         """
-        url = "http://api.positionstack.com/v1/forward"
-        params = {
-            'access_key': api_key,
-            'query': address,
-            'limit': 1
-        }
-        
-        try:
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get('data') and len(data['data']) > 0:
-                result = data['data'][0]
-                lat = float(result['latitude'])
-                lon = float(result['longitude'])
-                return (lat, lon)
-            
-            return None
-            
-        except (requests.RequestException, ValueError, KeyError) as e:
-            print(f"Positionstack geocoding error: {e}")
-            return None
+        return self.lookup(PROVIDERS_BY_NAME['positionstack'], address, api_key)
     
     def geocode(self, address: str) -> Optional[Tuple[float, float]]:
         """
         Main geocoding method that tries multiple providers based on settings.
+
+        OpenCage and Positionstack (when their API keys are set) and
+        Nominatim are scheduled concurrently by cart.geocode_orchestrator:
+        hedged by default, skipping providers whose circuit breaker is open.
+        The calls run on a background event loop with a client shared by
+        the whole process (see cart.async_geocoding.run_in_background).
         
         Args:
             address: Full address string to geocode
@@ -141,22 +272,9 @@ class GeocodingService:
         Returns:
             Tuple of (latitude, longitude) or None if all providers fail
         """
-        # Try OpenCage if API key is available
-        opencage_key = getattr(settings, 'OPENCAGE_API_KEY', None)
-        if opencage_key:
-            result = self.geocode_opencage(address, opencage_key)
-            if result:
-                return result
-        
-        # Try Positionstack if API key is available
-        positionstack_key = getattr(settings, 'POSITIONSTACK_API_KEY', None)
-        if positionstack_key:
-            result = self.geocode_positionstack(address, positionstack_key)
-            if result:
-                return result
-        
-        # Fall back to Nominatim (free, no API key required)
-        return self.geocode_nominatim(address)
+        from .async_geocoding import run_in_background
+
+        return run_in_background(lambda client: client.geocode(address))
 
 
 # Create a singleton instance
@@ -170,10 +288,51 @@ def get_geocoding_service() -> GeocodingService:
     return _geocoding_service
 
 
+def format_address(city: str, state: Optional[str] = None,
+                   country: Optional[str] = None) -> str:
+    """Join the address parts into the query string sent to providers."""
+    address_parts = [city]
+    if state:
+        address_parts.append(state)
+    if country:
+        address_parts.append(country)
+    return ", ".join(address_parts)
+
+
+def cached_coordinates(city: str, state: Optional[str] = None,
+                       country: Optional[str] = None) -> Optional[Tuple[float, float]]:
+    """
+    Look an address up in the gazetteer and the geocode cache only, never
+    calling a remote provider.
+
+    Used on the checkout path, where waiting on a remote API is not allowed.
+
+    Args:
+        city: City name
+        state: State/province name (optional)
+        country: Country name (optional)
+
+    Returns:
+        Tuple of (latitude, longitude) or None if the address is not cached
+    """
+    if not city:
+        return None
+    coordinates = gazetteer_lookup(city, state, country)
+    if coordinates:
+        return coordinates
+    found, coordinates = get_geocode_cache().get(
+        normalize_address(city, state, country))
+    return coordinates if found else None
+
+
 def geocode_address(city: str, state: Optional[str] = None, 
                    country: Optional[str] = None) -> Optional[Tuple[float, float]]:
     """
     Convenience function to geocode an address.
+
+    The offline gazetteer is tried first. Provider results (including
+    failed lookups) are cached per normalized address, so only the first
+    order from a given city reaches the providers.
     
     Args:
         city: City name
@@ -185,17 +344,19 @@ def geocode_address(city: str, state: Optional[str] = None,
     """
     if not city:
         return None
-    
-    # Build full address
-    address_parts = [city]
-    if state:
-        address_parts.append(state)
-    if country:
-        address_parts.append(country)
-    
-    full_address = ", ".join(address_parts)
+    coordinates = gazetteer_lookup(city, state, country)
+    if coordinates:
+        return coordinates
+
+    cache = get_geocode_cache()
+    key = normalize_address(city, state, country)
+    found, coordinates = cache.get(key)
+    if found:
+        return coordinates
     
     # Get geocoding service and geocode
     service = get_geocoding_service()
-    return service.geocode(full_address)
+    coordinates = service.geocode(format_address(city, state, country))
+    cache.set(key, coordinates)
+    return coordinates
 
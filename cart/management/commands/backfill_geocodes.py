@@ -0,0 +1,54 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.geocode_worker import backfill_orders
+
+
+class Command(BaseCommand):
+    help = ('Fill in coordinates for existing orders that have a city but no '
+            'latitude/longitude, looking up each distinct address once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Number of orders read and written per batch.')
+        parser.add_argument('--workers', type=int, default=8,
+            help='Number of concurrent provider lookups (within the rate limits).')
+        parser.add_argument('--start-after', type=int,
+            help='Skip orders up to and including this id.')
+        parser.add_argument('--checkpoint',
+            help='File holding the last processed order id; read to resume and '
+                 'updated after every batch.')
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint']) if options['checkpoint'] else None
+        start_after = options['start_after']
+        if start_after is None and checkpoint is not None and checkpoint.exists():
+            try:
+                start_after = int(checkpoint.read_text().strip() or 0)
+            except ValueError:
+                raise CommandError(f'{checkpoint} does not hold an order id')
+        start_after = start_after or 0
+        if start_after:
+            self.stdout.write(f'Resuming after order {start_after}')
+
+        started = time.monotonic()
+        totals = {'orders': 0, 'addresses': 0, 'resolved': 0, 'unresolved': 0}
+        for stats in backfill_orders(start_after, options['batch_size'], options['workers']):
+            for name in totals:
+                totals[name] += stats[name]
+            if checkpoint is not None:
+                checkpoint.write_text(f"{stats['last_id']}\n")
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"Up to order {stats['last_id']}: {totals['orders']} orders "
+                f"({totals['orders'] / elapsed:.0f}/s), {totals['resolved']} resolved, "
+                f"{totals['unresolved']} unresolved")
+
+        if not totals['orders']:
+            self.stdout.write('No orders without coordinates.')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.monotonic() - started:.1f}s: {totals['resolved']} of "
+            f"{totals['orders']} orders resolved"))
@@ -0,0 +1,48 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from cart.utils import place_order
+from movies.models import Movie
+
+
+class Command(BaseCommand):
+    help = ('Measure query count and latency of checkout for different cart '
+            'sizes. All data is created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+            help='Cart sizes (number of distinct movies) to benchmark.')
+        parser.add_argument('--repeat', type=int, default=20,
+            help='Number of checkouts per cart size.')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        with transaction.atomic():
+            user = User.objects.create(username='benchmark-checkout')
+            movies = Movie.objects.bulk_create([
+                Movie(name=f'Benchmark {i}', price=10 + i, description='',
+                      image='movie_images/benchmark.jpg')
+                for i in range(max(sizes))
+            ])
+
+            self.stdout.write(f"{'cart size':>10} {'queries':>8} {'mean ms':>9} {'p95 ms':>8}")
+            for size in sizes:
+                cart = {str(movie.id): '2' for movie in movies[:size]}
+                timings = []
+                for _ in range(options['repeat']):
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        place_order(user, cart, 'Atlanta', 'GA', 'USA')
+                        timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                self.stdout.write(
+                    f'{size:>10} {len(queries):>8} '
+                    f'{statistics.mean(timings):>9.2f} {p95:>8.2f}')
+
+            transaction.set_rollback(True)
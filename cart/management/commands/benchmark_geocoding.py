@@ -0,0 +1,117 @@
+import asyncio
+import random
+import statistics
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from cart import geocoding
+from cart.async_geocoding import AsyncGeocodingClient
+from cart.geocode_orchestrator import provider_calls, reset_circuit_breakers
+from cart.stub_providers import FakeGeocodingServer
+from moviesstore.metrics import REGISTRY
+
+PROVIDERS = [provider.name for provider in geocoding.PROVIDERS]
+
+
+def provider_values(values, option, cast):
+    """Parse 'provider=value' arguments into a dict."""
+    parsed = {}
+    for value in values:
+        name, _, number = value.partition('=')
+        if name not in PROVIDERS:
+            raise CommandError(f'{option}: unknown provider {name!r}')
+        try:
+            parsed[name] = cast(number)
+        except ValueError:
+            raise CommandError(f'{option}: bad value {value!r}')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = ('Compare geocoding strategies (sequential, hedge, race) against a '
+            'local stub of the providers with injected latency and errors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=200,
+            help='Number of addresses to geocode per strategy.')
+        parser.add_argument('--concurrency', type=int, default=20,
+            help='Addresses in flight at once.')
+        parser.add_argument('--strategies', nargs='+', default=['sequential', 'hedge', 'race'],
+            choices=['sequential', 'hedge', 'race'], help='Strategies to compare.')
+        parser.add_argument('--latency', nargs='*', default=[],
+            help='Mean latency per provider in ms, e.g. opencage=400 (latencies are '
+                 'exponentially distributed, so each provider has a long tail).')
+        parser.add_argument('--error-rate', nargs='*', default=[],
+            help='Fraction of failing calls per provider, e.g. positionstack=0.5.')
+        parser.add_argument('--hedge-delay', type=float, default=0.2,
+            help='Seconds before the hedge strategy asks the next provider.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        latency = {'opencage': 150, 'positionstack': 100, 'nominatim': 200}
+        latency.update(provider_values(options['latency'], '--latency', float))
+        error_rate = {name: 0.0 for name in PROVIDERS}
+        error_rate.update(provider_values(options['error_rate'], '--error-rate', float))
+        rng = random.Random(options['seed'])
+
+        def responder(name):
+            def respond():
+                delay = rng.expovariate(1000 / latency[name]) if latency[name] else 0
+                if rng.random() < error_rate[name]:
+                    return delay, 503, None
+                return delay, 200, (33.75, -84.39)
+            return respond
+
+        addresses = {i: f'Benchmark city {i}' for i in range(options['lookups'])}
+        self.stdout.write(f"{'strategy':>10} {'found':>6} {'p50 ms':>8} {'p95 ms':>8} "
+                          f"{'max ms':>8} {'total s':>8} {'calls':>6}")
+        with FakeGeocodingServer() as server:
+            server.responses = {f'/{name}': responder(name) for name in PROVIDERS}
+            with override_settings(
+                    GEOCODING_PROVIDER_URLS=server.provider_urls(),
+                    GEOCODING_RATE_LIMITS={name: 1_000_000 for name in PROVIDERS},
+                    GEOCODING_HEDGE_DELAY=options['hedge_delay'],
+                    OPENCAGE_API_KEY='benchmark', POSITIONSTACK_API_KEY='benchmark'):
+                for strategy in options['strategies']:
+                    geocoding._rate_limiters.clear()
+                    reset_circuit_breakers()
+                    REGISTRY.clear()
+                    server.requests.clear()
+                    started = time.perf_counter()
+                    # Silence the per-call error messages of failing providers
+                    with redirect_stdout(StringIO()):
+                        timings, found = asyncio.run(
+                            self.run(addresses, strategy, options['concurrency']))
+                    total = time.perf_counter() - started
+                    timings.sort()
+                    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                    self.stdout.write(
+                        f'{strategy:>10} {found:>6} {statistics.median(timings):>8.1f} '
+                        f'{p95:>8.1f} {timings[-1]:>8.1f} {total:>8.2f} '
+                        f'{len(server.requests):>6}')
+                    for name in PROVIDERS:
+                        outcomes = {outcome: provider_calls.value(provider=name, outcome=outcome)
+                                    for outcome in ('found', 'miss', 'error', 'cancelled',
+                                                    'skipped')}
+                        self.stdout.write('           {:<14} '.format(name) + ' '.join(
+                            f'{outcome}={count}' for outcome, count in outcomes.items()))
+
+    async def run(self, addresses, strategy, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+
+        async def one(client, address):
+            async with semaphore:
+                started = time.perf_counter()
+                coordinates = await client.geocode(address, strategy)
+                timings.append((time.perf_counter() - started) * 1000)
+                return coordinates
+
+        async with AsyncGeocodingClient(max_connections=concurrency * len(PROVIDERS)) as client:
+            results = await asyncio.gather(*(one(client, address)
+                                             for address in addresses.values()))
+        return timings, sum(1 for coordinates in results if coordinates)
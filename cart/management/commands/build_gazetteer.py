@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from cart import gazetteer
+
+
+class Command(BaseCommand):
+    help = ('Build the memory-mapped gazetteer used for offline geocoding from a '
+            'CSV with city, state, country, latitude and longitude columns.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=str(gazetteer.DEFAULT_SOURCE),
+            help='CSV file to import (default: the bundled cart/data/gazetteer.csv).')
+        parser.add_argument('--output',
+            help='File to write (default: GEOCODING_GAZETTEER_PATH or cart/data/gazetteer.bin).')
+
+    def handle(self, *args, **options):
+        output = (options['output'] or getattr(settings, 'GEOCODING_GAZETTEER_PATH', None)
+                  or gazetteer.DEFAULT_PATH)
+        try:
+            count = gazetteer.build(options['source'], output)
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f'Could not build the gazetteer: {e!r}')
+        gazetteer.reset_gazetteer()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} places to {output}'))
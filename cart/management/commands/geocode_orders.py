@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.geocode_worker import geocode_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'Resolve coordinates for orders that are waiting to be geocoded.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+            help='Maximum number of orders to process per batch.')
+        parser.add_argument('--workers', type=int, default=4,
+            help='Number of concurrent provider lookups.')
+        parser.add_argument('--loop', action='store_true',
+            help='Keep polling for new orders instead of exiting when idle.')
+        parser.add_argument('--interval', type=float, default=5.0,
+            help='Seconds to sleep between polls when idle (with --loop).')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = geocode_pending_orders(
+                batch_size=options['batch_size'], workers=options['workers'])
+            processed = sum(stats.values())
+            if processed:
+                self.stdout.write(
+                    f"Resolved {stats['resolved']}, retrying {stats['retried']}, "
+                    f"failed {stats['failed']}")
+            elif not options['loop']:
+                self.stdout.write('No orders waiting to be geocoded.')
+                return
+            if not options['loop'] and processed < options['batch_size']:
+                return
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cart.rollup import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-location movie purchase counts used by the rating map.'
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(f'Wrote {count} purchase count rows.')
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_remove_order_region'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodedAddress',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('city', models.CharField(help_text='Normalized city', max_length=100)),
+                ('state', models.CharField(blank=True, default='', help_text='Normalized state/province', max_length=100)),
+                ('country', models.CharField(blank=True, default='', help_text='Normalized country', max_length=100)),
+                ('latitude', models.FloatField(blank=True, help_text='Null when the lookup failed', null=True)),
+                ('longitude', models.FloatField(blank=True, help_text='Null when the lookup failed', null=True)),
+                ('expires_at', models.DateTimeField(help_text='Entry is ignored after this time')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='geocodedaddress',
+            constraint=models.UniqueConstraint(fields=('city', 'state', 'country'), name='unique_geocoded_address'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_initial_geocode_status(apps, schema_editor):
+    Order = apps.get_model('cart', 'Order')
+    Order.objects.filter(latitude__isnull=False, longitude__isnull=False).update(
+        geocode_status='resolved')
+    Order.objects.filter(latitude__isnull=True, city__isnull=True).update(
+        geocode_status='skipped')
+    Order.objects.filter(latitude__isnull=True, city='').update(
+        geocode_status='skipped')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_geocodedaddress'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='geocode_attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of failed geocoding attempts'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='geocode_retry_at',
+            field=models.DateTimeField(blank=True, help_text='Earliest time the geocoding worker may retry this order', null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='geocode_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('resolved', 'Resolved'), ('failed', 'Failed'), ('skipped', 'Skipped (no city)')], default='pending', help_text='Progress of the background geocoding', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['geocode_status', 'geocode_retry_at'], name='order_geocode_queue_idx'),
+        ),
+        migrations.RunPython(set_initial_geocode_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0007_order_geocode_status'),
+        ('movies', '0002_review'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MoviePurchaseCount',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('address_key', models.CharField(help_text='Normalized city|state|country', max_length=302)),
+                ('city', models.CharField(blank=True, default='', max_length=100)),
+                ('state', models.CharField(blank=True, default='', max_length=100)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('count', models.IntegerField(default=0, help_text='Number of purchases of the movie at this location')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='movies.movie')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='moviepurchasecount',
+            constraint=models.UniqueConstraint(fields=('address_key', 'movie'), name='unique_movie_purchase_location'),
+        ),
+    ]
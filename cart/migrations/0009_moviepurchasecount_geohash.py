@@ -0,0 +1,39 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:19
+
+from django.db import migrations, models
+
+from cart.geohash import encode
+
+
+def fill_geohashes(apps, schema_editor):
+    MoviePurchaseCount = apps.get_model('cart', 'MoviePurchaseCount')
+    rows = list(MoviePurchaseCount.objects.filter(
+        latitude__isnull=False, longitude__isnull=False))
+    for row in rows:
+        row.geohash = encode(row.latitude, row.longitude)
+    MoviePurchaseCount.objects.bulk_update(rows, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0008_moviepurchasecount'),
+        ('movies', '0002_review'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moviepurchasecount',
+            name='geohash',
+            field=models.CharField(blank=True, default='', help_text='Geohash of the coordinates, empty until geocoded', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='moviepurchasecount',
+            index=models.Index(fields=['latitude', 'longitude'], name='purchase_count_coords_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moviepurchasecount',
+            index=models.Index(fields=['geohash'], name='purchase_count_geohash_idx'),
+        ),
+        migrations.RunPython(fill_geohashes, migrations.RunPython.noop),
+    ]
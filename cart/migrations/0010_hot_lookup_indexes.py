@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0009_moviepurchasecount_geohash'),
+        ('movies', '0005_review_movie_date_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['order', 'movie'], name='item_order_movie_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['city', 'state', 'country'], name='order_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['latitude', 'longitude'], name='order_coords_idx'),
+        ),
+    ]
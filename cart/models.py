@@ -1,9 +1,20 @@
 from django.db import models
 from django.contrib.auth.models import User
 from movies.models import Movie
-from .geocoding import geocode_address
+from .geocoding import cached_coordinates
 
 class Order(models.Model):
+    GEOCODE_PENDING = 'pending'
+    GEOCODE_RESOLVED = 'resolved'
+    GEOCODE_FAILED = 'failed'
+    GEOCODE_SKIPPED = 'skipped'
+    GEOCODE_STATUS_CHOICES = [
+        (GEOCODE_PENDING, 'Pending'),
+        (GEOCODE_RESOLVED, 'Resolved'),
+        (GEOCODE_FAILED, 'Failed'),
+        (GEOCODE_SKIPPED, 'Skipped (no city)'),
+    ]
+
     id = models.AutoField(primary_key=True)
     total = models.IntegerField()
     date = models.DateTimeField(auto_now_add=True)
@@ -14,16 +25,38 @@ class Order(models.Model):
     country = models.CharField(max_length=100, default='USA', help_text="Country of purchase")
     latitude = models.FloatField(blank=True, null=True, help_text="Latitude of purchase location")
     longitude = models.FloatField(blank=True, null=True, help_text="Longitude of purchase location")
+    geocode_status = models.CharField(max_length=10, choices=GEOCODE_STATUS_CHOICES,
+        default=GEOCODE_PENDING, help_text="Progress of the background geocoding")
+    geocode_attempts = models.PositiveSmallIntegerField(default=0,
+        help_text="Number of failed geocoding attempts")
+    geocode_retry_at = models.DateTimeField(blank=True, null=True,
+        help_text="Earliest time the geocoding worker may retry this order")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geocode_status', 'geocode_retry_at'],
+                         name='order_geocode_queue_idx'),
+            models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+            models.Index(fields=['city', 'state', 'country'], name='order_location_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='order_coords_idx'),
+        ]
     
     def __str__(self):
         return str(self.id) + ' - ' + self.user.username
     
     def save(self, *args, **kwargs):
-        # Only try geocoding if lat/lon not already set and city exists
-        if (not self.latitude or not self.longitude) and self.city:
-            coordinates = geocode_address(self.city, self.state, self.country)
+        # Coordinates are filled in by the geocode_orders worker. Only
+        # addresses that are already cached are resolved here, so saving an
+        # order never waits on a geocoding provider.
+        if self.latitude is not None and self.longitude is not None:
+            self.geocode_status = self.GEOCODE_RESOLVED
+        elif not self.city:
+            self.geocode_status = self.GEOCODE_SKIPPED
+        elif self.geocode_status == self.GEOCODE_PENDING:
+            coordinates = cached_coordinates(self.city, self.state, self.country)
             if coordinates:
                 self.latitude, self.longitude = coordinates
+                self.geocode_status = self.GEOCODE_RESOLVED
 
         super().save(*args, **kwargs)
 
@@ -35,5 +68,64 @@ class Item(models.Model):
         on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie,
         on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'movie'], name='item_order_movie_idx'),
+        ]
+
     def __str__(self):
         return str(self.id) + ' - ' + self.movie.name
+
+
+class GeocodedAddress(models.Model):
+    id = models.AutoField(primary_key=True)
+    city = models.CharField(max_length=100, help_text="Normalized city")
+    state = models.CharField(max_length=100, blank=True, default='', help_text="Normalized state/province")
+    country = models.CharField(max_length=100, blank=True, default='', help_text="Normalized country")
+    latitude = models.FloatField(blank=True, null=True, help_text="Null when the lookup failed")
+    longitude = models.FloatField(blank=True, null=True, help_text="Null when the lookup failed")
+    expires_at = models.DateTimeField(help_text="Entry is ignored after this time")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'state', 'country'],
+                                    name='unique_geocoded_address'),
+        ]
+
+    @property
+    def coordinates(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return (self.latitude, self.longitude)
+
+    def __str__(self):
+        return ', '.join(part for part in (self.city, self.state, self.country) if part)
+
+
+class MoviePurchaseCount(models.Model):
+    id = models.AutoField(primary_key=True)
+    movie = models.ForeignKey(Movie,
+        on_delete=models.CASCADE)
+    address_key = models.CharField(max_length=302, help_text="Normalized city|state|country")
+    city = models.CharField(max_length=100, blank=True, default='')
+    state = models.CharField(max_length=100, blank=True, default='')
+    country = models.CharField(max_length=100, blank=True, default='')
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, default='', help_text="Geohash of the coordinates, empty until geocoded")
+    count = models.IntegerField(default=0, help_text="Number of purchases of the movie at this location")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['address_key', 'movie'],
+                                    name='unique_movie_purchase_location'),
+        ]
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'],
+                         name='purchase_count_coords_idx'),
+            models.Index(fields=['geohash'], name='purchase_count_geohash_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.movie_id) + ' - ' + self.city + ': ' + str(self.count)
@@ -0,0 +1,156 @@
+"""
+Incrementally maintained purchase counts per (movie, location).
+
+The rating map used to aggregate the whole Item table on every page view.
+Instead, each checkout bumps one MoviePurchaseCount row per movie in the
+order, and the geocoding worker fills in the coordinates of a location once
+they are known. `rebuild` recomputes the table from the sales history and is
+used for the initial backfill or to repair drift (e.g. after orders were
+deleted in the admin).
+
+Every change bumps a version number in the cache so that readers can key
+derived data (such as the serialized rating map payload) on it.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+from .geocode_cache import normalize_address
+from .geohash import encode as encode_geohash
+from .models import Item, MoviePurchaseCount, Order
+
+
+VERSION_KEY = 'cart:purchase_counts:version'
+
+
+def get_version():
+    """Current version of the rollup; changes whenever a count changes."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+async def aget_version():
+    """Async counterpart of get_version()."""
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(VERSION_KEY, 1)
+    return version
+
+
+def bump_version():
+    """Invalidate everything derived from the rollup."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def address_key(city, state=None, country=None):
+    """Key identifying a purchase location in the rollup."""
+    return '|'.join(normalize_address(city, state, country))
+
+
+def record_order(order, movie_ids):
+    """
+    Add one purchase per movie to the order's location.
+
+    Args:
+        order: Saved Order with its location fields set
+        movie_ids: Ids of the movies bought in the order
+    """
+    if not order.city or not movie_ids:
+        return
+    key = address_key(order.city, order.state, order.country)
+    located = order.latitude is not None and order.longitude is not None
+    geohash = encode_geohash(order.latitude, order.longitude) if located else ''
+    MoviePurchaseCount.objects.bulk_create([
+        MoviePurchaseCount(
+            movie_id=movie_id,
+            address_key=key,
+            city=order.city,
+            state=order.state or '',
+            country=order.country or '',
+            latitude=order.latitude,
+            longitude=order.longitude,
+            geohash=geohash,
+        )
+        for movie_id in movie_ids
+    ], ignore_conflicts=True)
+
+    updates = {'count': F('count') + 1}
+    if located:
+        updates.update(latitude=order.latitude, longitude=order.longitude,
+                       geohash=geohash)
+    MoviePurchaseCount.objects.filter(
+        address_key=key, movie_id__in=movie_ids).update(**updates)
+    transaction.on_commit(bump_version)
+
+
+def set_coordinates(city, state, country, latitude, longitude):
+    """Store the resolved coordinates of a location on all its rows."""
+    MoviePurchaseCount.objects.filter(
+        address_key=address_key(city, state, country)).update(
+        latitude=latitude, longitude=longitude,
+        geohash=encode_geohash(latitude, longitude))
+    transaction.on_commit(bump_version)
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute the rollup from the Item table.
+
+    Returns:
+        Number of rollup rows written
+    """
+    # Coordinates of each location, from its latest geocoded order (as
+    # record_order and set_coordinates would have left them); latitude and
+    # longitude must come from the same order
+    coordinates = {}
+    located = (
+        Order.objects
+        .filter(latitude__isnull=False, longitude__isnull=False)
+        .exclude(city='')
+        .order_by('date', 'id')
+        .values_list('city', 'state', 'country', 'latitude', 'longitude')
+    )
+    for city, state, country, latitude, longitude in located.iterator():
+        coordinates[address_key(city, state, country)] = (latitude, longitude)
+
+    rows = {}
+    totals = (
+        Item.objects
+        .filter(order__city__isnull=False)
+        .exclude(order__city='')
+        .values('movie_id', 'order__city', 'order__state', 'order__country')
+        .annotate(count=Count('id'))
+    )
+    for total in totals.iterator():
+        key = address_key(total['order__city'], total['order__state'],
+                          total['order__country'])
+        row = rows.get((key, total['movie_id']))
+        if row is None:
+            latitude, longitude = coordinates.get(key, (None, None))
+            rows[(key, total['movie_id'])] = MoviePurchaseCount(
+                movie_id=total['movie_id'],
+                address_key=key,
+                city=total['order__city'],
+                state=total['order__state'] or '',
+                country=total['order__country'] or '',
+                latitude=latitude,
+                longitude=longitude,
+                geohash=encode_geohash(latitude, longitude) if latitude is not None else '',
+                count=total['count'],
+            )
+        else:
+            # Same location typed differently ("Atlanta" vs "atlanta")
+            row.count += total['count']
+
+    with transaction.atomic():
+        MoviePurchaseCount.objects.all().delete()
+        MoviePurchaseCount.objects.bulk_create(rows.values(), batch_size=batch_size)
+        transaction.on_commit(bump_version)
+    return len(rows)
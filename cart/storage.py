@@ -0,0 +1,157 @@
+"""
+Storage for the shopping cart, kept out of the main database.
+
+The cart used to live in request.session, so every "add to cart" wrote a
+row to django_session and every page view read one. The views now go
+through a cart storage picked by the CART_STORAGE setting:
+
+- SignedCookieCartStorage (default): the cart travels with the browser in a
+  signed cookie; nothing is stored server side.
+- CacheCartStorage: the cart lives in a Django cache (CART_CACHE_ALIAS)
+  under a random id kept in a cookie. With the default LocMem cache it is
+  per process; point the alias at Memcached or Redis to share carts
+  between workers.
+- SessionCartStorage: the old behaviour, for deployments that rely on it.
+
+A cart is a dict of movie id -> quantity (both ints). It is stored in a
+compact "id:quantity,id:quantity" form, e.g. "12:1,40:3".
+"""
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+DEFAULT_STORAGE = 'cart.storage.SignedCookieCartStorage'
+DEFAULT_COOKIE_NAME = 'cart'
+DEFAULT_COOKIE_AGE = 60 * 60 * 24 * 14     # two weeks, like sessions
+DEFAULT_MAX_ITEMS = 100                    # keeps the cookie well under 4 KB
+COOKIE_SALT = 'cart.storage'
+
+
+def encode_cart(cart):
+    """Serialize a cart into its compact string form."""
+    return ','.join(f'{movie_id}:{quantity}' for movie_id, quantity in cart.items())
+
+
+def decode_cart(data):
+    """
+    Reverse encode_cart().
+
+    Malformed entries and non-positive quantities are dropped, so a
+    tampered or outdated value degrades to a smaller cart.
+    """
+    cart = {}
+    for entry in (data or '').split(','):
+        movie_id, _, quantity = entry.partition(':')
+        try:
+            movie_id, quantity = int(movie_id), int(quantity)
+        except ValueError:
+            continue
+        if movie_id > 0 and quantity > 0:
+            cart[movie_id] = quantity
+    return cart
+
+
+class CartStorage:
+    """
+    Base class of the cart backends.
+
+    `load` reads the cart of the current request; `save` stores a new cart
+    and may need to set cookies on the response.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def cookie_name(self):
+        return getattr(settings, 'CART_COOKIE_NAME', DEFAULT_COOKIE_NAME)
+
+    @property
+    def cookie_age(self):
+        return getattr(settings, 'CART_COOKIE_AGE', DEFAULT_COOKIE_AGE)
+
+    def set_cookie(self, response, value, signed=False):
+        options = {
+            'max_age': self.cookie_age,
+            'secure': settings.SESSION_COOKIE_SECURE,
+            'httponly': True,
+            'samesite': 'Lax',
+        }
+        if signed:
+            response.set_signed_cookie(self.cookie_name, value, salt=COOKIE_SALT, **options)
+        else:
+            response.set_cookie(self.cookie_name, value, **options)
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, response, cart):
+        raise NotImplementedError
+
+
+class SignedCookieCartStorage(CartStorage):
+    """Keeps the cart in a signed cookie."""
+
+    def load(self):
+        data = self.request.get_signed_cookie(self.cookie_name, default='', salt=COOKIE_SALT,
+                                              max_age=self.cookie_age)
+        return decode_cart(data)
+
+    def save(self, response, cart):
+        if cart:
+            self.set_cookie(response, encode_cart(cart), signed=True)
+        elif self.cookie_name in self.request.COOKIES:
+            response.delete_cookie(self.cookie_name, samesite='Lax')
+
+
+class CacheCartStorage(CartStorage):
+    """Keeps the cart in a cache, keyed by a random id in a cookie."""
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+
+    def cache_key(self, cart_id):
+        return f'cart:{cart_id}'
+
+    def load(self):
+        cart_id = self.request.COOKIES.get(self.cookie_name)
+        if not cart_id:
+            return {}
+        return decode_cart(self.cache.get(self.cache_key(cart_id)))
+
+    def save(self, response, cart):
+        cart_id = self.request.COOKIES.get(self.cookie_name)
+        if not cart:
+            if cart_id:
+                self.cache.delete(self.cache_key(cart_id))
+                response.delete_cookie(self.cookie_name, samesite='Lax')
+            return
+        if not cart_id:
+            cart_id = secrets.token_urlsafe(24)
+        self.cache.set(self.cache_key(cart_id), encode_cart(cart), self.cookie_age)
+        # Refresh the cookie so active carts do not expire
+        self.set_cookie(response, cart_id)
+
+
+class SessionCartStorage(CartStorage):
+    """Keeps the cart in the Django session (stored in the database by default)."""
+
+    def load(self):
+        data = self.request.session.get('cart', '')
+        if isinstance(data, dict):
+            # Sessions written before the cart storage held {"id": "quantity"}
+            data = encode_cart(data)
+        return decode_cart(data)
+
+    def save(self, response, cart):
+        self.request.session['cart'] = encode_cart(cart)
+
+
+def get_cart_storage(request):
+    """Return the configured cart storage for a request."""
+    storage_class = import_string(getattr(settings, 'CART_STORAGE', DEFAULT_STORAGE))
+    return storage_class(request)
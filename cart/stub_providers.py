@@ -0,0 +1,75 @@
+"""
+Local stand-in for the geocoding providers, for tests and benchmarks.
+
+Serves /nominatim, /opencage and /positionstack in each provider's
+response format, so AsyncGeocodingClient can be pointed at it through
+GEOCODING_PROVIDER_URLS without touching the network.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+PROVIDER_PATHS = ('/nominatim', '/opencage', '/positionstack')
+
+
+class FakeGeocodingServer:
+    """
+    HTTP server answering like the geocoding providers.
+
+    `responses` maps a path to (delay in seconds, status, coordinates or
+    None), or to a callable returning such a tuple for each request.
+    Unknown paths answer 404. Every request is recorded in `requests` as
+    (path, query dict).
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                server.requests.append((path, parse_qs(query)))
+                response = server.responses.get(path, (0, 404, None))
+                delay, status, coordinates = response() if callable(response) else response
+                time.sleep(delay)
+                body = json.dumps(server.body(path, coordinates)).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def body(self, path, coordinates):
+        if path == '/nominatim':
+            return [{'lat': str(coordinates[0]), 'lon': str(coordinates[1])}] if coordinates else []
+        if path == '/opencage':
+            return {'results': [{'geometry': {'lat': coordinates[0], 'lng': coordinates[1]}}]
+                    if coordinates else []}
+        return {'data': [{'latitude': coordinates[0], 'longitude': coordinates[1]}]
+                if coordinates else []}
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_port}{path}'
+
+    def provider_urls(self):
+        """GEOCODING_PROVIDER_URLS pointing every provider at this server."""
+        return {path.lstrip('/'): self.url(path) for path in PROVIDER_PATHS}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
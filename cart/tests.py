@@ -1,3 +1,653 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack, redirect_stdout
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from movies.models import Movie
+from moviesstore.metrics import REGISTRY
+from moviesstore.testing import QueryPlanTestMixin
+
+from . import async_geocoding, gazetteer, geocoding, rollup
+from .async_geocoding import AsyncGeocodingClient
+from .geocode_cache import GeocodeCache, get_geocode_cache, normalize_address
+from .geocode_orchestrator import (CircuitBreaker, orchestrate, provider_calls,
+                                   reset_circuit_breakers)
+from .geocode_worker import geocode_pending_orders
+from .geohash import encode as encode_geohash
+from .stub_providers import FakeGeocodingServer
+from .models import Item, MoviePurchaseCount, Order
+from .rollup import record_order
+from .utils import place_order
+from .storage import decode_cart, encode_cart
+
+
+class GeocodeCacheTests(TestCase):
+    def setUp(self):
+        self.cache = GeocodeCache(max_size=2)
+        self.key = normalize_address('Atlanta', 'GA', 'USA')
+
+    def later(self, seconds):
+        """Patch both clocks of the cache to `seconds` from now."""
+        monotonic = time.monotonic() + seconds
+        now = timezone.now() + timedelta(seconds=seconds)
+        stack = ExitStack()
+        stack.enter_context(mock.patch('cart.geocode_cache.time.monotonic', return_value=monotonic))
+        stack.enter_context(mock.patch('cart.geocode_cache.timezone.now', return_value=now))
+        return stack
+
+    def test_normalization(self):
+        self.assertEqual(normalize_address('  New   York ', 'NY', None), ('new york', 'ny', ''))
+        self.assertEqual(normalize_address('ATLANTA', 'ga', 'usa'), self.key)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.cache.get(self.key), (False, None))
+        self.cache.set(self.key, (33.75, -84.39))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(self.key), (True, (33.75, -84.39)))
+
+    def test_database_tier_after_lru_is_cleared(self):
+        self.cache.set(self.key, (33.75, -84.39))
+        self.cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(self.key), (True, (33.75, -84.39)))
+        # ...and the LRU is filled again
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(self.key), (True, (33.75, -84.39)))
+        # Another process (empty LRU) sees the entry too
+        self.assertEqual(GeocodeCache().get(self.key), (True, (33.75, -84.39)))
+
+    def test_lru_eviction(self):
+        keys = [normalize_address(city) for city in ('a', 'b', 'c')]
+        for key in keys:
+            self.cache.set(key, (1.0, 1.0))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get(keys[0]), (True, (1.0, 1.0)))
+
+    @override_settings(GEOCODE_CACHE_TTL=1000, GEOCODE_NEGATIVE_CACHE_TTL=10)
+    def test_negative_results_expire_sooner(self):
+        missing = normalize_address('Nowhere')
+        self.cache.set(self.key, (33.75, -84.39))
+        self.cache.set(missing, None)
+        self.assertEqual(self.cache.get(missing), (True, None))
+        with self.later(60):
+            self.assertEqual(self.cache.get(missing), (False, None))
+            self.assertEqual(self.cache.get(self.key), (True, (33.75, -84.39)))
+        with self.later(2000):
+            self.assertEqual(self.cache.get(self.key), (False, None))
+            self.cache.clear()
+            self.assertEqual(self.cache.get(self.key), (False, None))
+
+
+@override_settings(GEOCODE_MAX_ATTEMPTS=3, GEOCODE_RETRY_BACKOFF=60,
+                   GEOCODING_GAZETTEER_PATH=os.path.join(tempfile.gettempdir(), 'no-gazetteer.bin'))
+class GeocodeWorkerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_geocode_cache().clear()
+        self.lookups = []
+        self.coordinates = None
+
+        async def geocode_many(addresses, concurrency):
+            self.lookups.extend(addresses.values())
+            return {key: self.coordinates for key in addresses}
+        patcher = mock.patch('cart.geocode_worker._geocode_many', geocode_many)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user(username='geo')
+        self.order = Order.objects.create(user=user, total=10, city='Atlanta', state='GA')
+
+    def test_retries_with_backoff_then_fails(self):
+        self.assertEqual(self.order.geocode_status, Order.GEOCODE_PENDING)
+        expected = [({'resolved': 0, 'retried': 1, 'failed': 0}, 1, 60),
+                    ({'resolved': 0, 'retried': 1, 'failed': 0}, 2, 120),
+                    ({'resolved': 0, 'retried': 0, 'failed': 1}, 3, None)]
+        for stats, attempts, backoff in expected:
+            started = timezone.now()
+            self.assertEqual(geocode_pending_orders(), stats)
+            self.order.refresh_from_db()
+            self.assertEqual(self.order.geocode_attempts, attempts)
+            if backoff is None:
+                self.assertEqual(self.order.geocode_status, Order.GEOCODE_FAILED)
+                self.assertIsNone(self.order.geocode_retry_at)
+                continue
+            self.assertEqual(self.order.geocode_status, Order.GEOCODE_PENDING)
+            delay = (self.order.geocode_retry_at - started).total_seconds()
+            self.assertAlmostEqual(delay, backoff, delta=5)
+            # Not retried before its time
+            self.assertEqual(geocode_pending_orders(),
+                             {'resolved': 0, 'retried': 0, 'failed': 0})
+            Order.objects.filter(id=self.order.id).update(geocode_retry_at=timezone.now())
+        # Every attempt asked the provider again, despite the cached failure
+        self.assertEqual(self.lookups, ['Atlanta, GA, USA'] * 3)
+
+    def test_resolved(self):
+        self.coordinates = (33.75, -84.39)
+        self.assertEqual(geocode_pending_orders(), {'resolved': 1, 'retried': 0, 'failed': 0})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.geocode_status, Order.GEOCODE_RESOLVED)
+        self.assertEqual((self.order.latitude, self.order.longitude), (33.75, -84.39))
+
+    def test_token_bucket_throttles(self):
+        clock = [100.0]
+        with mock.patch('cart.geocoding.time.monotonic', lambda: clock[0]):
+            bucket = geocoding.TokenBucket(rate=2)
+            self.assertEqual(bucket.reserve(), 0)
+            self.assertAlmostEqual(bucket.reserve(), 0.5)
+            clock[0] += 0.25
+            self.assertAlmostEqual(bucket.reserve(), 0.25)
+            clock[0] += 0.25
+            self.assertEqual(bucket.reserve(), 0)
+            # Idle time does not bank more than `capacity` tokens
+            clock[0] += 10
+            self.assertEqual(bucket.reserve(), 0)
+            self.assertAlmostEqual(bucket.reserve(), 0.5)
+
+    def test_blocking_acquire_waits(self):
+        bucket = geocoding.TokenBucket(rate=20)
+        started = time.monotonic()
+        for _ in range(3):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='secret')
+        self.movies = [Movie.objects.create(name=f'Movie {i}', price=i + 1, description='',
+                                            image='movie_images/test.jpg')
+                       for i in range(20)]
+
+    def counts(self):
+        return (Order.objects.count(), Item.objects.count(),
+                MoviePurchaseCount.objects.count())
+
+    def test_failure_rolls_back_everything(self):
+        def record_then_fail(order, movie_ids):
+            record_order(order, movie_ids)
+            raise RuntimeError('boom')
+        with mock.patch('cart.utils.record_order', record_then_fail):
+            with self.assertRaises(RuntimeError):
+                place_order(self.user, {self.movies[0].id: 1}, 'Atlanta', 'GA', 'USA')
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        with CaptureQueriesContext(connection) as small:
+            place_order(self.user, {self.movies[0].id: 1}, 'Atlanta', 'GA', 'USA')
+        with self.assertNumQueries(len(small)):
+            order = place_order(self.user, {movie.id: 2 for movie in self.movies},
+                                'Atlanta', 'GA', 'USA')
+        self.assertEqual(order.total, 2 * sum(range(1, 21)))
+        self.assertEqual(order.item_set.count(), 20)
+
+    def test_missing_movies_are_skipped(self):
+        order = place_order(self.user, {self.movies[0].id: 2, 999999: 1})
+        self.assertEqual(order.total, 2)
+        self.assertEqual(list(order.item_set.values_list('movie_id', flat=True)),
+                         [self.movies[0].id])
+        self.assertIsNone(place_order(self.user, {999999: 1}))
+
+    def test_movie_deleted_after_the_cart_was_priced(self):
+        self.client.login(username='buyer', password='secret')
+        self.client.post(reverse('cart.add', args=[self.movies[0].id]), {'quantity': '1'})
+        self.client.post(reverse('cart.add', args=[self.movies[1].id]), {'quantity': '1'})
+        self.client.get(reverse('cart.index'))
+        # Deleted without running on_commit: the price catalogue still lists it
+        self.movies[1].delete()
+        response = self.client.post(reverse('cart.purchase'), {'city': 'Atlanta'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().total, 1)
+        # Nothing left to buy: back to the cart
+        self.client.post(reverse('cart.add', args=[self.movies[0].id]), {'quantity': '1'})
+        self.movies[0].delete()
+        response = self.client.post(reverse('cart.purchase'), {'city': 'Atlanta'})
+        self.assertRedirects(response, reverse('cart.index'), fetch_redirect_response=False)
+
+
+@override_settings(GEOCODING_GAZETTEER_PATH=os.path.join(tempfile.gettempdir(), 'no-gazetteer.bin'))
+class PurchaseRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_geocode_cache().clear()
+        self.user = User.objects.create_user(username='buyer')
+        self.movies = [Movie.objects.create(name=f'Movie {i}', price=5, description='',
+                                            image='movie_images/test.jpg')
+                       for i in range(3)]
+
+    def snapshot(self):
+        return sorted(MoviePurchaseCount.objects.values_list(
+            'movie_id', 'address_key', 'count', 'latitude', 'longitude', 'geohash'))
+
+    def test_incremental_rollup_matches_rebuild(self):
+        places = {'Atlanta, GA, USA': (33.75, -84.39), 'Savannah, GA, USA': (32.08, -81.09)}
+
+        async def geocode_many(addresses, concurrency):
+            return {key: places.get(address) for key, address in addresses.items()}
+        a, b, c = self.movies
+        place_order(self.user, {a.id: 1, b.id: 2}, 'Atlanta', 'GA')
+        place_order(self.user, {a.id: 1}, ' atlanta', 'ga')
+        place_order(self.user, {c.id: 1}, 'Savannah', 'GA')
+        place_order(self.user, {b.id: 1}, 'Nowhere', 'GA')
+        place_order(self.user, {a.id: 1})
+        with mock.patch('cart.geocode_worker._geocode_many', geocode_many), \
+                redirect_stdout(StringIO()):
+            geocode_pending_orders()
+        # Known location: resolved from the cache at checkout
+        place_order(self.user, {c.id: 1}, 'Atlanta', 'GA')
+
+        incremental = self.snapshot()
+        self.assertIn((a.id, 'atlanta|ga|usa', 2, 33.75, -84.39, encode_geohash(33.75, -84.39)),
+                      incremental)
+        self.assertIn((b.id, 'nowhere|ga|usa', 1, None, None, ''), incremental)
+        rollup.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_rebuild_takes_both_coordinates_from_one_order(self):
+        first = place_order(self.user, {self.movies[0].id: 1}, 'Atlanta', 'GA')
+        second = place_order(self.user, {self.movies[0].id: 1}, 'Atlanta', 'GA')
+        Order.objects.filter(id=first.id).update(latitude=40.0, longitude=-90.0)
+        Order.objects.filter(id=second.id).update(latitude=30.0, longitude=-80.0)
+        rollup.rebuild()
+        row = MoviePurchaseCount.objects.get()
+        self.assertEqual((row.count, row.latitude, row.longitude), (2, 30.0, -80.0))
+
+
+class CartQueryPlanTests(QueryPlanTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='secret')
+        self.movies = [
+            Movie.objects.create(name=f'Movie {i}', price=i + 1,
+                                 description='A film', image='movie_images/test.jpg')
+            for i in range(5)
+        ]
+        self.client.login(username='buyer', password='secret')
+        for movie in self.movies[:3]:
+            self.client.post(reverse('cart.add', args=[movie.id]), {'quantity': '2'})
+
+    def test_cart(self):
+        self.assertNoFullScans(self.client.get, reverse('cart.index'))
+
+    def test_purchase(self):
+        self.assertNoFullScans(self.client.post, reverse('cart.purchase'),
+                               {'city': 'Atlanta', 'state': 'GA', 'country': 'USA'})
+
+
+class CartStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='secret')
+        self.movies = [
+            Movie.objects.create(name=f'Movie {i}', price=10 * (i + 1),
+                                 description='A film', image='movie_images/test.jpg')
+            for i in range(2)
+        ]
+
+    def fill_cart(self):
+        for movie, quantity in zip(self.movies, ['2', '1']):
+            self.client.post(reverse('cart.add', args=[movie.id]), {'quantity': quantity})
+
+    def test_encoding(self):
+        self.assertEqual(encode_cart({12: 1, 40: 3}), '12:1,40:3')
+        self.assertEqual(decode_cart('12:1,40:3'), {12: 1, 40: 3})
+        self.assertEqual(decode_cart('12:1,x:2,40:0,:,'), {12: 1})
+        self.assertEqual(decode_cart(None), {})
+
+    def test_backends(self):
+        for backend in ['SignedCookieCartStorage', 'CacheCartStorage', 'SessionCartStorage']:
+            with self.subTest(backend), override_settings(CART_STORAGE=f'cart.storage.{backend}'):
+                self.client = self.client_class()
+                self.fill_cart()
+                response = self.client.get(reverse('cart.index'))
+                self.assertEqual(response.context['template_data']['cart'],
+                                 {self.movies[0].id: 2, self.movies[1].id: 1})
+                self.assertEqual(response.context['template_data']['cart_total'], 40)
+                self.client.get(reverse('cart.clear'))
+                response = self.client.get(reverse('cart.index'))
+                self.assertEqual(response.context['template_data']['cart'], {})
+
+    def test_mutations_do_not_write_to_the_database(self):
+        self.client.login(username='shopper', password='secret')
+        # Only the movie lookup; the session is never touched
+        with self.assertNumQueries(1):
+            self.client.post(reverse('cart.add', args=[self.movies[0].id]), {'quantity': '1'})
+        with self.assertNumQueries(0):
+            self.client.get(reverse('cart.clear'))
+
+    def test_tampered_cookie_is_ignored(self):
+        self.fill_cart()
+        self.client.cookies['cart'] = self.client.cookies['cart'].value.replace('2', '9', 1)
+        response = self.client.get(reverse('cart.index'))
+        self.assertEqual(response.context['template_data']['cart'], {})
+
+    def test_purchase_clears_the_cart(self):
+        self.client.login(username='shopper', password='secret')
+        self.fill_cart()
+        self.client.post(reverse('cart.purchase'),
+                         {'city': 'Atlanta', 'state': 'GA', 'country': 'USA'})
+        self.assertEqual(Order.objects.get().total, 40)
+        response = self.client.get(reverse('cart.index'))
+        self.assertEqual(response.context['template_data']['cart'], {})
+
+
+class PriceCatalogueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name='Priced', price=12, description='A film',
+                                          image='movie_images/test.jpg')
+        self.client.post(reverse('cart.add', args=[self.movie.id]), {'quantity': '3'})
+
+    def test_warm_cart_needs_no_queries(self):
+        self.client.get(reverse('cart.index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('cart.index'))
+        self.assertEqual(response.context['template_data']['cart_total'], 36)
+        self.assertContains(response, 'Priced')
+
+    def test_admin_changes_refresh_prices(self):
+        self.client.get(reverse('cart.index'))
+        User.objects.create_superuser(username='admin', password='secret')
+        self.client.login(username='admin', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:movies_movie_change', args=[self.movie.id]), {
+                'name': 'Priced', 'price': 20, 'description': 'A film',
+            })
+        response = self.client.get(reverse('cart.index'))
+        self.assertEqual(response.context['template_data']['cart_total'], 60)
+
+    def test_deleted_movies_drop_out_of_the_cart(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movie.delete()
+        response = self.client.get(reverse('cart.index'))
+        self.assertEqual(response.context['template_data']['cart_total'], 0)
+
+
+class AsyncGeocodingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_geocode_cache().clear()
+        self.server = FakeGeocodingServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        settings = override_settings(
+            GEOCODING_PROVIDER_URLS={name: self.server.url(f'/{name}')
+                                     for name in ['nominatim', 'opencage', 'positionstack']},
+            GEOCODING_RATE_LIMITS={'nominatim': 1000, 'opencage': 1000, 'positionstack': 1000},
+            OPENCAGE_API_KEY='key', POSITIONSTACK_API_KEY='key',
+            GEOCODING_GAZETTEER_PATH=os.path.join(tempfile.gettempdir(), 'no-gazetteer.bin'),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        geocoding._rate_limiters.clear()
+        self.addCleanup(geocoding._rate_limiters.clear)
+        reset_circuit_breakers()
+        self.addCleanup(reset_circuit_breakers)
+        REGISTRY.clear()
+
+    def geocode(self, address, strategy=None):
+        async def run():
+            async with AsyncGeocodingClient() as client:
+                return await client.geocode(address, strategy)
+        return async_to_sync(run)()
+
+    def test_providers_are_raced(self):
+        self.server.responses = {
+            '/opencage': (1.0, 200, (1.0, 1.0)),
+            '/positionstack': (1.0, 200, (2.0, 2.0)),
+            '/nominatim': (0, 200, (33.75, -84.39)),
+        }
+        started = time.monotonic()
+        self.assertEqual(self.geocode('Atlanta, GA, USA', 'race'), (33.75, -84.39))
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_hedged_providers(self):
+        self.server.responses = {
+            '/opencage': (0.6, 200, (1.0, 1.0)),
+            '/positionstack': (0, 200, (2.0, 2.0)),
+        }
+        with override_settings(GEOCODING_HEDGE_DELAY=0.2):
+            started = time.monotonic()
+            self.assertEqual(self.geocode('Atlanta', 'hedge'), (2.0, 2.0))
+            # Positionstack was asked after the hedge delay; Nominatim never
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual([path for path, query in self.server.requests],
+                             ['/opencage', '/positionstack'])
+            self.server.requests.clear()
+            self.server.responses['/opencage'] = (0, 200, (1.0, 1.0))
+            self.assertEqual(self.geocode('Atlanta', 'hedge'), (1.0, 1.0))
+            self.assertEqual(len(self.server.requests), 1)
+
+    def test_circuit_breaker_skips_failing_provider(self):
+        self.server.responses = {
+            '/opencage': (0, 500, None),
+            '/nominatim': (0, 200, (33.75, -84.39)),
+        }
+        with override_settings(GEOCODING_BREAKER_THRESHOLD=2, GEOCODING_BREAKER_RESET=60), \
+                redirect_stdout(StringIO()):
+            for _ in range(4):
+                self.assertEqual(self.geocode('Atlanta', 'sequential'), (33.75, -84.39))
+        opencage_calls = [path for path, query in self.server.requests if path == '/opencage']
+        self.assertEqual(len(opencage_calls), 2)
+        self.assertEqual(provider_calls.value(provider='opencage', outcome='skipped'), 2)
+
+    def test_failing_providers_are_skipped(self):
+        self.server.responses = {
+            '/opencage': (0, 500, None),
+            '/positionstack': (0, 200, None),
+            '/nominatim': (0.1, 200, (33.75, -84.39)),
+        }
+        with redirect_stdout(StringIO()):
+            self.assertEqual(self.geocode('Atlanta, GA, USA'), (33.75, -84.39))
+        self.server.responses = {}
+        with redirect_stdout(StringIO()):
+            self.assertIsNone(self.geocode('Nowhere'))
+
+    def test_addresses_are_resolved_concurrently(self):
+        self.server.responses = {'/nominatim': (0.3, 200, (10.0, 20.0))}
+
+        async def run():
+            async with AsyncGeocodingClient() as client:
+                return await client.geocode_many(
+                    {i: f'City {i}' for i in range(8)}, concurrency=8)
+        started = time.monotonic()
+        with redirect_stdout(StringIO()):
+            results = async_to_sync(run)()
+        self.assertEqual(results, {i: (10.0, 20.0) for i in range(8)})
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_worker_and_blocking_service_use_the_same_providers(self):
+        self.server.responses = {'/nominatim': (0, 200, (33.75, -84.39))}
+        user = User.objects.create_user(username='geo')
+        movie = Movie.objects.create(name='Map', price=5, description='A film',
+                                     image='movie_images/test.jpg')
+        order = place_order(user, {movie.id: 1}, 'Atlanta', 'GA', 'USA')
+        with redirect_stdout(StringIO()):
+            geocode_pending_orders()
+        order.refresh_from_db()
+        self.assertEqual(order.geocode_status, Order.GEOCODE_RESOLVED)
+        self.assertEqual((order.latitude, order.longitude), (33.75, -84.39))
+        with redirect_stdout(StringIO()):
+            self.assertEqual(geocoding.GeocodingService().geocode('Atlanta'), (33.75, -84.39))
+
+    def test_blocking_service_shares_one_client(self):
+        self.server.responses = {'/nominatim': (0, 200, (33.75, -84.39))}
+        service = geocoding.GeocodingService()
+        with redirect_stdout(StringIO()):
+            self.assertEqual(service.geocode('Atlanta'), (33.75, -84.39))
+            loop, client = async_geocoding._background_client()
+            self.assertEqual(service.geocode('Savannah'), (33.75, -84.39))
+        self.assertEqual(async_geocoding._background_client(), (loop, client))
+        self.assertTrue(loop.is_running())
+
+    def test_backfill_resolves_each_address_once(self):
+        self.server.responses = {'/nominatim': (0, 200, (33.75, -84.39))}
+        user = User.objects.create_user(username='history')
+        orders = [Order.objects.create(user=user, total=10, city=city, state='GA')
+                  for city in ['Atlanta', 'atlanta ', 'Atlanta', 'Savannah', '']]
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint')
+            with redirect_stdout(StringIO()):
+                call_command('backfill_geocodes', batch_size=2, checkpoint=checkpoint,
+                             stdout=StringIO())
+            with open(checkpoint) as f:
+                self.assertEqual(int(f.read()), orders[3].id)
+            nominatim = [query['q'] for path, query in self.server.requests
+                         if path == '/nominatim']
+            self.assertEqual(sorted(nominatim), [['Atlanta, GA, USA'], ['Savannah, GA, USA']])
+            for order in orders[:4]:
+                order.refresh_from_db()
+                self.assertEqual((order.latitude, order.longitude), (33.75, -84.39))
+                self.assertEqual(order.geocode_status, Order.GEOCODE_RESOLVED)
+
+            # Resuming from the checkpoint finds nothing left to do
+            Order.objects.filter(id=orders[0].id).update(latitude=None, longitude=None)
+            output = StringIO()
+            call_command('backfill_geocodes', checkpoint=checkpoint, stdout=output)
+            self.assertIn('No orders without coordinates', output.getvalue())
+
+
+class GazetteerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_geocode_cache().clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'gazetteer.bin')
+        call_command('build_gazetteer', gazetteer.DEFAULT_SOURCE, output=path, stdout=StringIO())
+        settings = override_settings(
+            GEOCODING_GAZETTEER_PATH=path,
+            # Any provider call would fail the test
+            GEOCODING_PROVIDER_URLS={name: 'http://127.0.0.1:9/' for name in
+                                     ['nominatim', 'opencage', 'positionstack']})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(gazetteer.reset_gazetteer)
+
+    def test_lookups(self):
+        places = gazetteer.get_gazetteer()
+        self.assertEqual(places.lookup('Atlanta', 'GA', 'USA'), (33.749, -84.388))
+        self.assertEqual(places.lookup(' atlanta', 'Georgia', 'United States'), (33.749, -84.388))
+        # Close spellings only when asked for, i.e. by the worker
+        self.assertIsNone(places.lookup('Atlnta', 'GA', 'USA'))
+        self.assertEqual(places.lookup('Atlnta', 'GA', 'USA', fuzzy=True), (33.749, -84.388))
+        self.assertEqual(places.lookup('Savannah', None, 'USA'), (32.0809, -81.0912))
+        self.assertEqual(places.lookup('London', 'Greater London', 'UK'), (51.5074, -0.1278))
+        # Two Portlands and no state to tell them apart
+        self.assertIsNone(places.lookup('Portland', None, 'USA'))
+        self.assertEqual(places.lookup('Portland', 'ME', 'USA'), (43.6591, -70.2568))
+        self.assertIsNone(places.lookup('Atlanta', 'GA', 'France'))
+        self.assertIsNone(places.lookup('Gotham', 'NJ', 'USA'))
+
+    def test_near_tie_between_spellings_is_ambiguous(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'places.csv')
+        with open(source, 'w') as f:
+            f.write('city,state,country,latitude,longitude\n'
+                    'Westvill,NJ,US,1,1\nWestvillle,NJ,US,2,2\nEastham,MA,US,3,3\n')
+        path = os.path.join(directory, 'places.bin')
+        gazetteer.build(source, path)
+        places = gazetteer.Gazetteer(path)
+        # 0.941 against 0.947: too close to pick one
+        self.assertIsNone(places.lookup('Westville', 'NJ', 'USA', fuzzy=True))
+        self.assertEqual(places.lookup('Eastam', 'MA', 'USA', fuzzy=True), (3.0, 3.0))
+
+    def test_missing_default_file_is_built_from_the_bundled_csv(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = Path(directory) / 'gazetteer.bin'
+        gazetteer.reset_gazetteer()
+        with override_settings(GEOCODING_GAZETTEER_PATH=None), \
+                mock.patch.object(gazetteer, 'DEFAULT_PATH', path):
+            self.assertEqual(gazetteer.gazetteer_lookup('Atlanta', 'GA'), (33.749, -84.388))
+        self.assertTrue(path.is_file())
+
+    def test_file_installed_later_is_picked_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'gazetteer.bin')
+        with override_settings(GEOCODING_GAZETTEER_PATH=path):
+            self.assertIsNone(gazetteer.gazetteer_lookup('Atlanta', 'GA'))
+            gazetteer.build(gazetteer.DEFAULT_SOURCE, path)
+            self.assertEqual(gazetteer.gazetteer_lookup('Atlanta', 'GA'), (33.749, -84.388))
+
+    def test_checkout_resolves_offline(self):
+        user = User.objects.create_user(username='offline')
+        order = Order.objects.create(user=user, total=10, city='Atlanta', state='GA')
+        self.assertEqual(order.geocode_status, Order.GEOCODE_RESOLVED)
+        self.assertEqual((order.latitude, order.longitude), (33.749, -84.388))
+        self.assertEqual(geocoding.geocode_address('Boston', 'MA'), (42.3601, -71.0589))
+
+    def test_misspelt_city_is_left_to_the_worker(self):
+        user = User.objects.create_user(username='typo')
+        order = Order.objects.create(user=user, total=10, city='Atlnta', state='GA')
+        self.assertEqual(order.geocode_status, Order.GEOCODE_PENDING)
+        geocode_pending_orders()
+        order.refresh_from_db()
+        self.assertEqual(order.geocode_status, Order.GEOCODE_RESOLVED)
+        self.assertEqual((order.latitude, order.longitude), (33.749, -84.388))
+
+
+class CircuitBreakerTests(TestCase):
+    def test_opens_and_recovers(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        # Half-open: a single trial call, which re-opens it on failure
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_sequential_strategy_stops_at_first_answer(self):
+        asked = []
+
+        def call(name, result):
+            async def run():
+                asked.append(name)
+                return result
+            return run
+        calls = [call('a', None), call('b', (1.0, 2.0)), call('c', (3.0, 4.0))]
+        self.assertEqual(async_to_sync(orchestrate)(calls, 'sequential'), (1.0, 2.0))
+        self.assertEqual(asked, ['a', 'b'])
+
+
+class AsyncPurchaseTests(TestCase):
+    async def test_purchase(self):
+        user = await sync_to_async(User.objects.create_user)(username='async', password='secret')
+        movie = await Movie.objects.acreate(name='Async', price=7, description='A film',
+                                            image='movie_images/test.jpg')
+        response = await self.async_client.post(reverse('cart.purchase'))
+        self.assertRedirects(response, reverse('accounts.login') + '?next=' + reverse('cart.purchase'),
+                             fetch_redirect_response=False)
+        await self.async_client.aforce_login(user)
+        await self.async_client.post(reverse('cart.add', args=[movie.id]), {'quantity': '2'})
+        response = await self.async_client.post(reverse('cart.purchase'), {
+            'city': 'Atlanta', 'state': 'GA', 'country': 'USA'})
+        self.assertEqual(response.status_code, 200)
+        order = await Order.objects.aget(user=user)
+        self.assertEqual(order.total, 14)
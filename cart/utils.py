@@ -1,7 +1,56 @@
+from django.db import transaction
+from movies.models import Movie
+from .models import Order, Item
+from .rollup import record_order
 
 def calculate_cart_total(cart, movies_in_cart):
-    total = 0
-    for movie in movies_in_cart:
-        quantity = cart[str(movie.id)]
-        total += movie.price * int(quantity)
-    return total
\ No newline at end of file
+    """
+    Total of a cart at catalogue prices.
+
+    Args:
+        cart: Dict of movie id -> quantity
+        movies_in_cart: Catalogue entries (or movies) of the movies in the cart
+
+    Returns:
+        Sum of price * quantity
+    """
+    return sum(movie.price * cart[movie.id] for movie in movies_in_cart)
+
+def place_order(user, cart, city=None, state=None, country='USA'):
+    """
+    Create an Order and its Items from a cart in a single transaction.
+
+    Prices are read once, inside the transaction, and that snapshot is used
+    both for the order total and for each Item's price. The work is a
+    constant number of queries whatever the size of the cart.
+
+    Returns the new Order, or None if none of the movies in the cart exist.
+    """
+    quantities = {int(movie_id): int(quantity)
+                  for movie_id, quantity in cart.items()}
+    with transaction.atomic():
+        prices = dict(
+            Movie.objects
+            .select_for_update()
+            .filter(id__in=quantities)
+            .values_list('id', 'price')
+        )
+        if not prices:
+            return None
+
+        order = Order(
+            user=user,
+            total=sum(price * quantities[movie_id]
+                      for movie_id, price in prices.items()),
+            city=city,
+            state=state,
+            country=country
+        )
+        order.save()
+        Item.objects.bulk_create([
+            Item(order=order, movie_id=movie_id, price=price,
+                 quantity=quantities[movie_id])
+            for movie_id, price in prices.items()
+        ])
+        record_order(order, list(prices))
+    return order
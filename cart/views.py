@@ -1,43 +1,67 @@
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render
-from django.shortcuts import get_object_or_404, redirect
-from movies.models import Movie
-from .utils import calculate_cart_total
-from .models import Order, Item
-from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect
+from movies.catalogue import get_price_catalogue
+from .storage import DEFAULT_MAX_ITEMS, get_cart_storage
+from .utils import calculate_cart_total, place_order
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
 
 def index(request):
     cart_total = 0
     movies_in_cart = []
-    cart = request.session.get('cart', {})
+    cart = get_cart_storage(request).load()
     movie_ids = list(cart.keys())
     if (movie_ids != []):
-        movies_in_cart = Movie.objects.filter(id__in=movie_ids)
+        movies_in_cart = list(get_price_catalogue().lookup(movie_ids).values())
         cart_total = calculate_cart_total(cart,
             movies_in_cart)
     template_data = {}
     template_data['title'] = 'Cart'
     template_data['movies_in_cart'] = movies_in_cart
+    template_data['cart'] = cart
     template_data['cart_total'] = cart_total
     return render(request, 'cart/index.html',
         {'template_data': template_data})
 
 def add(request, id):
-    get_object_or_404(Movie, id=id)
-    cart = request.session.get('cart', {})
-    cart[id] = request.POST['quantity']
-    request.session['cart'] = cart
-    return redirect('cart.index')
+    if id not in get_price_catalogue().lookup([id]):
+        raise Http404('No Movie matches the given query.')
+    storage = get_cart_storage(request)
+    cart = storage.load()
+    response = redirect('cart.index')
+    try:
+        quantity = int(request.POST['quantity'])
+    except ValueError:
+        return response
+    if quantity < 1:
+        return response
+    if id not in cart and len(cart) >= getattr(settings, 'CART_MAX_ITEMS', DEFAULT_MAX_ITEMS):
+        return response
+    cart[id] = quantity
+    storage.save(response, cart)
+    return response
 
 def clear(request):
-    request.session['cart'] = {}
-    return redirect('cart.index')
+    response = redirect('cart.index')
+    get_cart_storage(request).save(response, {})
+    return response
 
-@login_required
-def purchase(request):
+async def purchase(request):
+    # login_required does not support async views before Django 5.1
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
     if request.method == 'POST':
-        cart = request.session.get('cart', {})
-        movie_ids = list(cart.keys())
-        if not movie_ids:
+        storage = get_cart_storage(request)
+        cart = await sync_to_async(storage.load)()
+        # Drop movies deleted since they were added; the prices charged are
+        # still read (and locked) from the database by place_order
+        known = await sync_to_async(get_price_catalogue().lookup)(cart)
+        cart = {movie_id: quantity for movie_id, quantity in cart.items()
+                if movie_id in known}
+        if not cart:
             return redirect('cart.index')
 
         # Get location info from form
@@ -45,36 +69,21 @@ def purchase(request):
         state = request.POST.get('state')
         country = request.POST.get('country', 'USA')
 
-        movies_in_cart = Movie.objects.filter(id__in=movie_ids)
-        cart_total = calculate_cart_total(cart, movies_in_cart)
-
-        # Create Order with location info
-        order = Order(
-            user=request.user,
-            total=cart_total,
-            city=city,
-            state=state,
-            country=country
-        )
-        order.save()  # save() will trigger automatic latitude/longitude
-
-        # Create Item objects
-        for movie in movies_in_cart:
-            Item.objects.create(
-                movie=movie,
-                price=movie.price,
-                order=order,
-                quantity=cart[str(movie.id)]
-            )
-
-        # Clear cart
-        request.session['cart'] = {}
+        # Create the Order and its Items in one transaction
+        order = await sync_to_async(place_order)(user, cart, city, state, country)
+        if order is None:
+            return redirect('cart.index')
 
         template_data = {
             'title': 'Purchase confirmation',
             'order_id': order.id
         }
-        return render(request, 'cart/purchase.html', {'template_data': template_data})
+        response = await sync_to_async(render)(
+            request, 'cart/purchase.html', {'template_data': template_data})
+
+        # Clear cart
+        await sync_to_async(storage.save)(response, {})
+        return response
 
     # If GET request, redirect to cart page
-    return redirect('cart.index')
\ No newline at end of file
+    return redirect('cart.index')
@@ -1,3 +1,176 @@
-from django.test import TestCase
+import gzip
+import shutil
+import tempfile
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils.http import http_date
+
+from moviesstore.assets import CompressedManifestStaticFilesStorage, serve_static
+from django.core.cache import cache
+
+from moviesstore import instrumentation
+from moviesstore.metrics import REGISTRY, Registry, Counter, Histogram
+
+
+class AssetServingTests(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        (self.root / 'movie_images').mkdir()
+        self.poster = self.root / 'movie_images' / 'poster.jpg'
+        self.poster.write_bytes(bytes(range(256)) * 4)
+        settings = override_settings(MEDIA_ROOT=str(self.root))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_media_caching_headers(self):
+        response = self.client.get('/media/movie_images/poster.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.poster.read_bytes())
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('max-age=2592000', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get('/media/movie_images/poster.jpg',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/media/movie_images/poster.jpg',
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        content = self.poster.read_bytes()
+        response = self.client.get('/media/movie_images/poster.jpg', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+
+        response = self.client.get('/media/movie_images/poster.jpg', HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.content, content[-4:])
+
+        response = self.client.get('/media/movie_images/poster.jpg', HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+        # A stale If-Range gets the whole file
+        response = self.client.get('/media/movie_images/poster.jpg', HTTP_RANGE='bytes=0-1',
+                                   HTTP_IF_RANGE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+
+    def test_precompressed_variant(self):
+        (self.root / 'notes.txt').write_bytes(b'a' * 1000)
+        (self.root / 'notes.txt.gz').write_bytes(gzip.compress(b'a' * 1000))
+        response = self.client.get('/media/notes.txt', HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'a' * 1000)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get('/media/notes.txt')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_refused_encodings_are_not_served(self):
+        (self.root / 'notes.txt').write_bytes(b'a' * 1000)
+        (self.root / 'notes.txt.gz').write_bytes(gzip.compress(b'a' * 1000))
+        (self.root / 'notes.txt.br').write_bytes(b'not really brotli')
+        for header, encoding in [('gzip;q=0', None), ('br;q=0, gzip', 'gzip'),
+                                 ('br;q=0.0, gzip;q=0', None), ('*;q=0', None),
+                                 ('*, br;q=0', 'gzip'), ('gzip;q=0.5', 'gzip')]:
+            with self.subTest(header):
+                response = self.client.get('/media/notes.txt', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+        response = self.client.get('/media/notes.txt', HTTP_ACCEPT_ENCODING='br;q=0.1')
+        self.assertEqual(response['Content-Encoding'], 'br')
+
+    def test_paths_outside_the_root_are_not_served(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/missing.jpg').status_code, 404)
+
+
+class StaticStorageTests(TestCase):
+    def test_collectstatic_hashes_and_compresses(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with override_settings(STATIC_ROOT=root, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'moviesstore.assets.CompressedManifestStaticFilesStorage'},
+        }):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            self.assertIsInstance(staticfiles_storage._wrapped, CompressedManifestStaticFilesStorage)
+            name = staticfiles_storage.stored_name('css/style.css')
+            self.assertRegex(name, r'^css/style\.[0-9a-f]{12}\.css$')
+            path = Path(root, name)
+            self.assertEqual(gzip.decompress(Path(root, name + '.gz').read_bytes()),
+                             path.read_bytes())
+            response = serve_static(RequestFactory().get('/static/' + name), name)
+            self.assertIn('immutable', response['Cache-Control'])
+            response.close()
+            response = serve_static(RequestFactory().get('/static/css/style.css'), 'css/style.css')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=0')
+            response.close()
+
+
+class MetricsTests(TestCase):
+    def test_prometheus_format(self):
+        registry = Registry()
+        calls = registry.register(Counter('calls_total', 'Calls', ['outcome']))
+        latency = registry.register(Histogram('latency_seconds', 'Latency', buckets=(0.1, 1)))
+        calls.inc(outcome='found')
+        calls.inc(2, outcome='error')
+        latency.observe(0.05)
+        latency.observe(0.5)
+        self.assertIs(registry.register(Counter('calls_total', 'Calls', ['outcome'])), calls)
+        self.assertEqual(latency.quantile(0.5), 0.1)
+        text = registry.render()
+        self.assertIn('# TYPE calls_total counter', text)
+        self.assertIn('calls_total{outcome="error"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('latency_seconds_count 2', text)
+
+    def test_endpoint_is_limited_to_local_scrapers(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'geocoding_provider_calls_total', response.content)
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        REGISTRY.clear()
+        instrumentation.reset_slow_requests()
+        self.addCleanup(instrumentation.reset_slow_requests)
+
+    def test_requests_are_attributed_to_views(self):
+        self.client.get('/movies/')
+        self.client.get('/movies/')
+        queries = instrumentation.request_queries
+        self.assertEqual(queries.count(view='movies.index'), 2)
+        # Queries made in the async view's worker thread are counted too
+        self.assertGreaterEqual(queries.quantile(1, view='movies.index'), 1)
+        self.assertEqual(instrumentation.request_duration.count(view='movies.index', method='GET'), 2)
+        self.assertEqual(instrumentation.requests_total.value(
+            view='movies.index', method='GET', status=200), 2)
+        # The second request is served from the page cache
+        lookups = instrumentation.request_cache_lookups
+        self.assertEqual(lookups.value(view='movies.index', result='miss'), 1)
+        self.assertEqual(lookups.value(view='movies.index', result='hit'), 1)
+        self.assertIn(b'http_request_db_queries_bucket{view="movies.index"',
+                      self.client.get('/metrics').content)
+
+    @override_settings(INSTRUMENTATION_SLOW_THRESHOLD=0, INSTRUMENTATION_SLOW_REQUESTS=2)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('moviesstore.performance', 'WARNING') as logs:
+            for _ in range(3):
+                self.client.get('/movies/')
+            slowest = instrumentation.slow_requests()
+            response = self.client.get('/metrics/slow')
+        self.assertEqual(len(logs.records), 4)
+        self.assertIn('SELECT', logs.output[0])
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['seconds'], slowest[1]['seconds'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'GET /movies/ (movies.index) 200', response.content)
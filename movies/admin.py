@@ -1,9 +1,25 @@
 from django.contrib import admin
+from .cache import invalidate_reviews
 from .models import Movie, Review
 
 class MovieAdmin(admin.ModelAdmin):
     ordering = ['name']
     search_fields = ['name']
 admin.site.register(Movie, MovieAdmin)
-admin.site.register(Review)
+
+class ReviewAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_reviews(obj.movie_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_reviews(obj.movie_id)
+
+    def delete_queryset(self, request, queryset):
+        movie_ids = set(queryset.values_list('movie_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for movie_id in movie_ids:
+            invalidate_reviews(movie_id)
+admin.site.register(Review, ReviewAdmin)
 # Register your models here.
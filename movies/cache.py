@@ -0,0 +1,117 @@
+"""
+Versioned caching of the movie detail and catalogue pages.
+
+Cached entries are keyed on a version number instead of being deleted:
+changing a movie's reviews bumps that movie's version, and changing a
+movie (any save or delete, see movies.signals) bumps both its version and
+the catalogue version. Entries for old versions are never read again and
+simply expire.
+
+Only the data behind the pages is cached, not the rendered HTML, so that
+the per-user parts (review controls, CSRF tokens) are rendered on every
+request while anonymous traffic never reaches the database.
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from moviesstore.instrumentation import record_cache
+
+
+CATALOGUE_VERSION_KEY = 'movies:catalogue:version'
+DEFAULT_TIMEOUT = 300
+
+
+def _movie_version_key(movie_id):
+    return f'movies:movie:{movie_id}:version'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1 so that a version evicted from
+        # the cache cannot come back and match entries cached under it
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key, 0)
+    return version
+
+
+async def _aget_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key, 0)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def movie_version(movie_id):
+    """Current version of a movie's detail page."""
+    return _get_version(_movie_version_key(movie_id))
+
+
+def catalogue_version():
+    """Current version of the catalogue pages."""
+    return _get_version(CATALOGUE_VERSION_KEY)
+
+
+async def acatalogue_version():
+    """Async counterpart of catalogue_version()."""
+    return await _aget_version(CATALOGUE_VERSION_KEY)
+
+
+def invalidate_reviews(movie_id):
+    """Invalidate a movie's detail page after one of its reviews changed."""
+    transaction.on_commit(lambda: _bump_version(_movie_version_key(movie_id)))
+
+
+def invalidate_movie(movie_id):
+    """Invalidate a movie's detail page and the catalogue."""
+    invalidate_reviews(movie_id)
+    transaction.on_commit(lambda: _bump_version(CATALOGUE_VERSION_KEY))
+
+
+def cache_key(prefix, version, *parts):
+    """
+    Build a cache key from untrusted request parts.
+
+    Args:
+        prefix: Namespace of the key
+        version: Version the cached data belongs to
+        *parts: Strings such as search terms or cursors
+
+    Returns:
+        Cache key safe for every cache backend
+    """
+    digest = hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest()
+    return f'{prefix}:{version}:{digest}'
+
+
+def cached(key, build):
+    """Return the value cached under key, building and storing it if missing."""
+    value = cache.get(key)
+    record_cache('movies', value is not None)
+    if value is None:
+        value = build()
+        cache.set(key, value, getattr(settings, 'MOVIES_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
+
+
+async def acached(key, build):
+    """Async counterpart of cached(); build() runs in a worker thread."""
+    value = await cache.aget(key)
+    record_cache('movies', value is not None)
+    if value is None:
+        value = await sync_to_async(build)()
+        await cache.aset(key, value, getattr(settings, 'MOVIES_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
@@ -0,0 +1,76 @@
+"""
+In-process price catalogue used to render and total carts.
+
+Maps movie id -> CatalogueEntry(id, name, price, image_url). Entries are
+loaded lazily, in one query per batch of unknown ids, and kept for the
+life of the process (ids of missing movies are not remembered, so movies
+created later are found). The whole catalogue is dropped whenever the
+catalogue version (see movies.cache) changes, i.e. whenever a movie is
+saved or deleted.
+"""
+import threading
+from collections import namedtuple
+
+from .cache import catalogue_version
+from .models import Movie
+
+
+CatalogueEntry = namedtuple('CatalogueEntry', ['id', 'name', 'price', 'image_url'])
+
+
+class PriceCatalogue:
+    """Lazily filled movie id -> CatalogueEntry mapping, invalidated by version."""
+
+    def __init__(self):
+        self._entries = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def lookup(self, movie_ids):
+        """
+        Return the catalogue entries of some movies.
+
+        Args:
+            movie_ids: Iterable of movie ids
+
+        Returns:
+            Dict of movie id -> CatalogueEntry, in the order of movie_ids;
+            ids of movies that do not exist are left out
+        """
+        movie_ids = list(movie_ids)
+        version = catalogue_version()
+        with self._lock:
+            if version != self._version:
+                self._entries = {}
+                self._version = version
+            missing = [movie_id for movie_id in movie_ids if movie_id not in self._entries]
+        if missing:
+            storage = Movie._meta.get_field('image').storage
+            loaded = {
+                movie_id: CatalogueEntry(movie_id, name, price,
+                                         storage.url(image) if image else '')
+                for movie_id, name, price, image in (
+                    Movie.objects.filter(id__in=missing)
+                    .values_list('id', 'name', 'price', 'image'))
+            }
+            with self._lock:
+                if version == self._version:
+                    self._entries.update(loaded)
+            entries = {**self._entries, **loaded}
+        else:
+            entries = self._entries
+        return {movie_id: entries[movie_id] for movie_id in movie_ids
+                if movie_id in entries}
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._version = None
+
+
+_catalogue = PriceCatalogue()
+
+
+def get_price_catalogue():
+    """Return the process-wide price catalogue."""
+    return _catalogue
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from movies.models import Movie
+from movies.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Create the missing resized and WebP derivatives of every movie poster.'
+
+    def handle(self, *args, **options):
+        created = failed = 0
+        for movie in Movie.objects.only('id', 'image').iterator():
+            try:
+                created += generate_thumbnails(movie.image)
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f'Movie {movie.id} ({movie.image.name}): {e}')
+        self.stdout.write(f'Created {created} thumbnails; {failed} posters could not be read.')
@@ -0,0 +1,253 @@
+"""
+Serialized data behind the rating map.
+
+The map is fed from the MoviePurchaseCount rollup in two parts:
+
+* a per-movie summary (purchase totals and the bounding box of the places
+  each movie was bought) for the sidebar, and
+* clusters for the current viewport, produced by grouping locations on a
+  geohash prefix whose length follows the zoom level. The number of clusters
+  depends on the viewport, not on how many locations exist.
+
+Each payload is serialized once and stored in the cache (plain and
+gzip-compressed) under the rollup's version, so repeat requests do no
+database work and no JSON encoding until the next order changes the counts.
+"""
+import gzip
+import hashlib
+import json
+import math
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import Substr
+
+from cart.geohash import cell_size
+from cart.models import MoviePurchaseCount
+from cart.rollup import aget_version, get_version
+from moviesstore.instrumentation import record_cache
+
+Payload = namedtuple('Payload', ['etag', 'body', 'gzip_etag', 'gzip_body'])
+
+DEFAULT_TIMEOUT = 60 * 60 * 24
+MAX_PRECISION = 7
+
+def precision_for_zoom(zoom):
+    """
+    Geohash length used to cluster at a map zoom level.
+
+    Two zoom levels per character keeps roughly 4-16 cells across a
+    typical viewport.
+    """
+    return max(1, min(MAX_PRECISION, zoom // 2))
+
+
+def snap_bbox(bbox, precision):
+    """
+    Grow a (west, south, east, north) box outwards to the cell grid.
+
+    Snapping lets nearby viewports share a cached payload, and keeps every
+    cell that touches the viewport whole.
+    """
+    height, width = cell_size(precision)
+    west, south, east, north = bbox
+    return (
+        max(-180.0, math.floor(west / width) * width),
+        max(-90.0, math.floor(south / height) * height),
+        min(180.0, math.ceil(east / width) * width),
+        min(90.0, math.ceil(north / height) * height),
+    )
+
+
+def located_counts():
+    return MoviePurchaseCount.objects.filter(
+        latitude__isnull=False, longitude__isnull=False).exclude(geohash='')
+
+
+def build_movie_summary():
+    """Purchase totals and location bounds for every movie on the map."""
+    rows = (
+        located_counts()
+        .values('movie_id', 'movie__name')
+        .annotate(
+            total_purchases=Sum('count'),
+            location_count=Count('geohash', distinct=True),
+            south=Min('latitude'),
+            north=Max('latitude'),
+            west=Min('longitude'),
+            east=Max('longitude'),
+        )
+        .order_by('-total_purchases', 'movie_id')
+    )
+    return {
+        'movies': [
+            {
+                'id': row['movie_id'],
+                'name': row['movie__name'],
+                'total_purchases': row['total_purchases'],
+                'location_count': row['location_count'],
+                'bounds': [[row['south'], row['west']],
+                           [row['north'], row['east']]],
+            }
+            for row in rows
+        ]
+    }
+
+
+def build_clusters(zoom, bbox):
+    """
+    Cluster the purchase locations inside a bounding box.
+
+    Args:
+        zoom: Map zoom level
+        bbox: (west, south, east, north) in degrees, already snapped
+
+    Returns:
+        Dict with a 'clusters' list. A cluster holding a single location
+        also carries that location's address (its most common spelling)
+        and per-movie counts.
+    """
+    precision = precision_for_zoom(zoom)
+    west, south, east, north = bbox
+    if west <= east:
+        longitude_filter = Q(longitude__gte=west, longitude__lte=east)
+    else:
+        # Viewport crosses the antimeridian
+        longitude_filter = Q(longitude__gte=west) | Q(longitude__lte=east)
+    in_view = (
+        located_counts()
+        .filter(longitude_filter, latitude__gte=south, latitude__lte=north)
+        .annotate(cell=Substr('geohash', 1, precision))
+    )
+
+    cells = (
+        in_view
+        .values('cell')
+        .annotate(
+            purchases=Sum('count'),
+            weighted_latitude=Sum(F('latitude') * F('count')),
+            weighted_longitude=Sum(F('longitude') * F('count')),
+            # Spellings of a place ("Atlanta, GA", "Atlanta, Georgia") are
+            # separate rows but share a point, hence a full-length geohash
+            locations=Count('geohash', distinct=True),
+        )
+        .order_by('cell')
+    )
+    clusters = {}
+    for cell in cells:
+        clusters[cell['cell']] = {
+            'latitude': cell['weighted_latitude'] / cell['purchases'],
+            'longitude': cell['weighted_longitude'] / cell['purchases'],
+            'count': cell['purchases'],
+            'locations': cell['locations'],
+        }
+
+    single = [key for key, cluster in clusters.items() if cluster['locations'] == 1]
+    if single:
+        rows = (
+            in_view
+            .filter(cell__in=single)
+            .values('cell', 'city', 'state', 'country', 'latitude', 'longitude',
+                    'count', 'movie_id', 'movie__name')
+            .order_by('-count', 'movie_id')
+        )
+        movies = {}
+        for row in rows:
+            cluster = clusters[row['cell']]
+            if 'movies' not in cluster:
+                cluster.update(
+                    latitude=row['latitude'],
+                    longitude=row['longitude'],
+                    city=row['city'],
+                    state=row['state'],
+                    country=row['country'],
+                    movies=[],
+                )
+            movie = movies.get((row['cell'], row['movie_id']))
+            if movie is None:
+                movie = movies[(row['cell'], row['movie_id'])] = {
+                    'id': row['movie_id'], 'name': row['movie__name'], 'count': 0}
+                cluster['movies'].append(movie)
+            movie['count'] += row['count']
+        for cluster in clusters.values():
+            if 'movies' in cluster:
+                cluster['movies'].sort(key=lambda movie: (-movie['count'], movie['id']))
+    return {'clusters': list(clusters.values())}
+
+
+def _cached_payload(key, build):
+    payload = cache.get(key)
+    record_cache('rating_map', payload is not None)
+    if payload is None:
+        body = json.dumps(build(), ensure_ascii=False).encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        payload = Payload(
+            etag=f'"{digest}"',
+            body=body,
+            gzip_etag=f'"{digest}-gzip"',
+            gzip_body=gzip.compress(body, mtime=0),
+        )
+        cache.set(key, payload,
+                  getattr(settings, 'RATING_MAP_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return payload
+
+
+async def _acached_payload(key, build):
+    payload = await cache.aget(key)
+    if payload is None:
+        # Building queries the database, which must happen off the event
+        # loop; _cached_payload reports the lookup
+        payload = await sync_to_async(_cached_payload)(key, build)
+    else:
+        record_cache('rating_map', True)
+    return payload
+
+
+def _cluster_key(version, zoom, bbox):
+    precision = precision_for_zoom(zoom)
+    bbox = snap_bbox(bbox, precision)
+    key = 'movies:rating_map:clusters:{}:{}:{}'.format(
+        version, precision, ':'.join(f'{value:.6f}' for value in bbox))
+    return key, bbox
+
+
+def get_rating_map_payload():
+    """
+    Return the serialized movie summary for the current rollup version.
+
+    Returns:
+        Payload with the JSON body, its gzip-compressed form and an ETag for
+        each representation
+    """
+    return _cached_payload(f'movies:rating_map:summary:{get_version()}',
+                           build_movie_summary)
+
+
+def get_cluster_payload(zoom, bbox):
+    """
+    Return the serialized clusters for a viewport.
+
+    Args:
+        zoom: Map zoom level
+        bbox: (west, south, east, north) in degrees
+
+    Returns:
+        Payload as for get_rating_map_payload()
+    """
+    key, bbox = _cluster_key(get_version(), zoom, bbox)
+    return _cached_payload(key, lambda: build_clusters(zoom, bbox))
+
+
+async def aget_rating_map_payload():
+    """Async counterpart of get_rating_map_payload()."""
+    return await _acached_payload(f'movies:rating_map:summary:{await aget_version()}',
+                                  build_movie_summary)
+
+
+async def aget_cluster_payload(zoom, bbox):
+    """Async counterpart of get_cluster_payload()."""
+    key, bbox = _cluster_key(await aget_version(), zoom, bbox)
+    return await _acached_payload(key, lambda: build_clusters(zoom, bbox))
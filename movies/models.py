@@ -7,6 +7,14 @@ class Movie(models.Model):
     price = models.IntegerField()
     description = models.TextField()
     image = models.ImageField(upload_to='movie_images/')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalogue (see movies.views.MOVIE_SORTS)
+            models.Index(fields=['name', 'id'], name='movie_name_idx'),
+            models.Index(fields=['price', 'id'], name='movie_price_idx'),
+        ]
+
     def __str__(self):
         return str(self.id) + ' - ' + self.name
 
@@ -18,5 +26,11 @@ class Review(models.Model):
         on_delete=models.CASCADE)
     user = models.ForeignKey(User,
         on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', 'date'], name='review_movie_date_idx'),
+        ]
+
     def __str__(self):
         return str(self.id) + ' - ' + self.movie.name
\ No newline at end of file
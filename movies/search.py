@@ -0,0 +1,121 @@
+"""
+Full-text search over the movie catalogue.
+
+On SQLite the catalogue is indexed by an FTS5 table (movies_movie_fts) over
+Movie.name and Movie.description. The table uses external content, so it only
+stores the inverted index, and triggers created by migration 0003 keep it in
+step with every insert, update and delete on movies_movie. Matches are
+ranked with BM25, weighting the name above the description, and every search
+term is matched as a prefix ("incep" finds "Inception").
+
+Other database backends fall back to a case-insensitive substring filter.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Q, When
+from django.db.models.expressions import RawSQL
+
+from .models import Movie
+
+FTS_TABLE = 'movies_movie_fts'
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+DEFAULT_LIMIT = 100
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+
+_fts_databases = set()
+
+def fts_available():
+    """Whether the FTS5 index exists on the default database."""
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_databases:
+        if FTS_TABLE not in connection.introspection.table_names():
+            return False
+        _fts_databases.add(name)
+    return True
+
+
+def build_match_query(term):
+    """
+    Turn user input into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix query and all words must match, so
+    FTS5 operators typed by the user are treated as plain text.
+
+    Returns:
+        MATCH expression, or None if the input has no searchable words
+    """
+    tokens = _token_re.findall(term)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_movie_ids(term, limit=None):
+    """
+    Ids of the movies matching a search term, best match first.
+
+    Args:
+        term: Search text as typed by the user
+        limit: Maximum number of ids to return
+
+    Returns:
+        List of Movie ids ordered by relevance
+    """
+    if limit is None:
+        limit = getattr(settings, 'MOVIES_SEARCH_LIMIT', DEFAULT_LIMIT)
+    match = build_match_query(term)
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s',
+            [match, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def matching_movies(term):
+    """
+    Every movie matching a search term, in no particular order.
+
+    Unlike search_movies() the matches are not capped, so the caller can
+    order and paginate all of them (e.g. by price).
+
+    Returns:
+        QuerySet of Movies
+    """
+    if not fts_available():
+        return Movie.objects.filter(
+            Q(name__icontains=term) | Q(description__icontains=term))
+    match = build_match_query(term)
+    if match is None:
+        return Movie.objects.none()
+    return Movie.objects.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+
+
+def search_movies(term):
+    """
+    Movies matching a search term.
+
+    Returns:
+        QuerySet of Movies, ordered by relevance (and capped at
+        MOVIES_SEARCH_LIMIT) when the FTS index is available
+    """
+    if not fts_available():
+        return matching_movies(term)
+
+    ids = search_movie_ids(term)
+    if not ids:
+        return Movie.objects.none()
+    ranking = Case(*[When(id=movie_id, then=position)
+                     for position, movie_id in enumerate(ids)])
+    return Movie.objects.filter(id__in=ids).order_by(ranking)
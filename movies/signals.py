@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_movie
+from .models import Movie
+from .thumbnails import generate_thumbnails
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def movie_changed(sender, instance, **kwargs):
+    # Catalogue pages, the movie page and the price catalogue all show it
+    invalidate_movie(instance.id)
+
+
+@receiver(post_save, sender=Movie)
+def create_thumbnails(sender, instance, raw=False, **kwargs):
+    # Resize new posters on upload rather than on the first page view
+    if not raw and instance.image:
+        try:
+            generate_thumbnails(instance.image)
+        except (OSError, ValueError):
+            # Retried lazily when the poster is first displayed
+            pass
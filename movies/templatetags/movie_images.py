@@ -0,0 +1,40 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from movies.thumbnails import thumbnail_heights, thumbnail_url
+
+register = template.Library()
+
+
+def _srcset(image, height, extension):
+    candidates = [(thumbnail_url(image, height, extension), '1x')]
+    if height * 2 in thumbnail_heights():
+        candidates.append((thumbnail_url(image, height * 2, extension), '2x'))
+    return ', '.join(f'{url} {density}' for url, density in candidates)
+
+
+@register.simple_tag
+def responsive_image(image, height, css_class='', alt=''):
+    """
+    Render a <picture> for a movie poster shown at most `height` pixels tall.
+
+    Browsers that support WebP get the WebP derivatives, the others JPEG;
+    high-density screens get the next size up when there is one.
+
+    Usage: {% responsive_image movie.image 200 'rounded img-card-200' movie.name %}
+    """
+    if not image:
+        return ''
+    if height not in thumbnail_heights():
+        return format_html('<img src="{}" class="{}" alt="{}" loading="lazy">',
+                           image.url, css_class, alt)
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" class="{}" alt="{}" loading="lazy"'
+        ' decoding="async"></picture>',
+        format_html_join('', '<source type="image/webp" srcset="{}">',
+                         [(_srcset(image, height, 'webp'),)]),
+        thumbnail_url(image, height, 'jpg'),
+        _srcset(image, height, 'jpg'),
+        css_class,
+        alt,
+    )
@@ -1,3 +1,467 @@
-from django.test import TestCase
+import gzip
+import shutil
+import tempfile
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from cart.geohash import cell_size, encode as encode_geohash
+from cart.models import MoviePurchaseCount
+from cart.rollup import set_coordinates
+from cart.utils import place_order
+from moviesstore.testing import INVALID_CURSORS, QueryPlanTestMixin
+
+from PIL import Image
+
+from . import map_data, search, thumbnails
+from .models import Movie, Review
+
+
+class MovieQueryPlanTests(QueryPlanTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reviewer', password='secret')
+        self.movies = [
+            Movie.objects.create(name=f'Movie {i}', price=i + 1,
+                                 description='A film', image='movie_images/test.jpg')
+            for i in range(30)
+        ]
+        for movie in self.movies[:3]:
+            Review.objects.create(movie=movie, user=self.user, comment='Great')
+
+    def test_catalogue(self):
+        for sort in ['name', 'price', '-price', 'newest']:
+            response = self.assertNoFullScans(
+                self.client.get, reverse('movies.index'), {'sort': sort})
+            next_cursor = response.context['template_data']['next_url']
+            self.assertNoFullScans(self.client.get, reverse('movies.index') + next_cursor)
+
+    def test_only_unfiltered_rowid_order_stops_at_the_limit(self):
+        newest = Movie.objects.order_by('-id')[:5]
+        self.assertEqual(self.full_scans(str(newest.query)), [])
+        for queryset in [Movie.objects.filter(price__gt=0).order_by('-id')[:5],
+                         Movie.objects.order_by('description')[:5]]:
+            with self.subTest(sql=str(queryset.query)):
+                self.assertEqual(self.full_scans(str(queryset.query)), ['movies_movie'])
+
+    def test_search(self):
+        self.assertNoFullScans(self.client.get, reverse('movies.index'), {'search': 'movie'})
+        self.assertNoFullScans(self.client.get, reverse('movies.index'),
+                               {'search': 'movie', 'sort': 'price'})
+
+    def test_show(self):
+        self.client.login(username='reviewer', password='secret')
+        self.assertNoFullScans(self.client.get, reverse('movies.show', args=[self.movies[0].id]))
+
+    def test_reviews_fragment(self):
+        Review.objects.bulk_create(
+            Review(movie=self.movies[0], user=self.user, comment='More') for _ in range(20))
+        response = self.client.get(reverse('movies.show', args=[self.movies[0].id]))
+        self.assertNoFullScans(self.client.get, reverse('movies.reviews', args=[self.movies[0].id]),
+                               {'after': response.context['template_data']['reviews'].next_cursor})
+
+    def test_rating_map_data(self):
+        place_order(self.user, {str(self.movies[0].id): '1'}, 'Atlanta', 'GA', 'USA')
+        set_coordinates('Atlanta', 'GA', 'USA', 33.75, -84.39)
+        # The movie summary aggregates the whole (bounded) rollup by design
+        self.assertNoFullScans(self.client.get, reverse('rating_map.data'),
+                               allowed=['cart_moviepurchasecount'])
+        self.assertNoFullScans(self.client.get, reverse('rating_map.data'),
+                               {'zoom': 10, 'bbox': '-84.5,33.7,-84.3,33.8'})
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        if not search.fts_available():
+            self.skipTest('needs the SQLite FTS5 index')
+        self.inception = self.movie('Inception', 'A thief steals secrets through dreams.')
+        self.matrix = self.movie('The Matrix', 'A hacker learns reality is a simulation.')
+        self.dune = self.movie('Dune', 'Spice, sand and a desert planet in deep space.')
+        self.space = self.movie('Space Jam', 'Basketball with cartoons.')
+
+    def movie(self, name, description):
+        return Movie.objects.create(name=name, price=5, description=description,
+                                    image='movie_images/test.jpg')
+
+    def test_prefix_matching(self):
+        self.assertEqual(search.search_movie_ids('incep'), [self.inception.id])
+        self.assertEqual(search.search_movie_ids('MATR'), [self.matrix.id])
+        # Every word must match
+        self.assertEqual(search.search_movie_ids('the matr'), [self.matrix.id])
+        self.assertEqual(search.search_movie_ids('incep matr'), [])
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(search.search_movie_ids('space'), [self.space.id, self.dune.id])
+        self.assertEqual(list(search.search_movies('space')), [self.space, self.dune])
+
+    def test_fts_syntax_is_plain_text(self):
+        for term in ['"', '*', '(', 'NEAR(', 'name:', '-', '^', 'AND', 'dune"', 'dune OR', '"dune']:
+            with self.subTest(term):
+                ids = search.search_movie_ids(term)
+                self.assertIn(ids, ([], [self.dune.id]))
+        self.assertEqual(search.search_movie_ids('dune"'), [self.dune.id])
+        self.assertEqual(search.search_movie_ids('name:dune'), [])
+        # OR is a word to find, not an operator
+        self.assertEqual(search.search_movie_ids('dune OR inception'), [])
+        self.assertEqual(search.build_match_query('a "b" c*'), '"a"* "b"* "c"*')
+        self.assertIsNone(search.build_match_query('"*()'))
+
+    @override_settings(MOVIES_SEARCH_LIMIT=3, MOVIES_PAGE_SIZE=2)
+    def test_sorted_search_pages_through_every_match(self):
+        cache.clear()
+        extra = [self.movie(f'Space Odyssey {i}', 'Stars.') for i in range(4)]
+        self.assertEqual(len(search.search_movie_ids('space')), 3)
+        url = reverse('movies.index') + '?search=space&sort=price'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            seen.extend(movie.id for movie in response.context['template_data']['movies'])
+            url = response.context['template_data']['next_url']
+            url = url and reverse('movies.index') + url
+        self.assertEqual(sorted(seen), sorted([self.dune.id, self.space.id]
+                                              + [movie.id for movie in extra]))
+
+    def test_index_follows_the_table(self):
+        amelie = self.movie('Amélie', 'Paris.')
+        self.assertEqual(search.search_movie_ids('amelie'), [amelie.id])
+        amelie.name = 'Le Fabuleux Destin'
+        amelie.save()
+        self.assertEqual(search.search_movie_ids('amelie'), [])
+        self.assertEqual(search.search_movie_ids('fabuleux'), [amelie.id])
+        Movie.objects.filter(id=amelie.id).update(description='Montmartre')
+        self.assertEqual(search.search_movie_ids('paris'), [])
+        self.assertEqual(search.search_movie_ids('montmartre'), [amelie.id])
+        amelie.delete()
+        self.assertEqual(search.search_movie_ids('fabuleux'), [])
+        self.assertEqual(search.search_movie_ids('montmartre'), [])
+
+
+class ClusterTests(TestCase):
+    def setUp(self):
+        self.movies = [Movie.objects.create(name=f'Movie {i}', price=5, description='',
+                                            image='movie_images/test.jpg')
+                       for i in range(2)]
+
+    def located(self, movie, key, latitude, longitude, count, city=None):
+        return MoviePurchaseCount.objects.create(
+            movie=movie, address_key=key, city=city or key.split('|')[0],
+            latitude=latitude, longitude=longitude,
+            geohash=encode_geohash(latitude, longitude), count=count)
+
+    def clusters(self, zoom, bbox):
+        bbox = map_data.snap_bbox(bbox, map_data.precision_for_zoom(zoom))
+        return map_data.build_clusters(zoom, bbox)['clusters']
+
+    def test_spellings_of_one_place_are_one_location(self):
+        first, second = self.movies
+        self.located(first, 'atlanta|ga|usa', 33.749, -84.388, 3, 'Atlanta')
+        self.located(first, 'atlanta|georgia|usa', 33.749, -84.388, 1, 'atlanta')
+        self.located(second, 'atlanta|georgia|usa', 33.749, -84.388, 2, 'atlanta')
+        for zoom in (4, 10, 18):
+            with self.subTest(zoom=zoom):
+                [cluster] = self.clusters(zoom, (-85, 33, -84, 34))
+                self.assertEqual((cluster['count'], cluster['locations']), (6, 1))
+                self.assertEqual(cluster['city'], 'Atlanta')
+                self.assertEqual(cluster['movies'], [
+                    {'id': first.id, 'name': 'Movie 0', 'count': 4},
+                    {'id': second.id, 'name': 'Movie 1', 'count': 2},
+                ])
+
+    def test_nearby_places_split_when_zooming_in(self):
+        movie = self.movies[0]
+        self.located(movie, 'atlanta|ga|usa', 33.749, -84.388, 3)
+        self.located(movie, 'decatur|ga|usa', 33.775, -84.296, 1)
+        [cluster] = self.clusters(2, (-85, 33, -84, 34))
+        self.assertEqual((cluster['count'], cluster['locations']), (4, 2))
+        self.assertNotIn('movies', cluster)
+        # Centroid weighted by purchases
+        self.assertAlmostEqual(cluster['latitude'], (33.749 * 3 + 33.775) / 4)
+        self.assertAlmostEqual(cluster['longitude'], (-84.388 * 3 - 84.296) / 4)
+        clusters = self.clusters(18, (-84.5, 33.7, -84.2, 33.8))
+        self.assertEqual(sorted(cluster['city'] for cluster in clusters), ['atlanta', 'decatur'])
+
+    def test_bbox_filtering_and_antimeridian(self):
+        movie = self.movies[0]
+        self.located(movie, 'suva||fiji', -18.14, 178.44, 1)
+        self.located(movie, 'apia||samoa', -13.83, -171.76, 1)
+        self.located(movie, 'accra||ghana', 5.6, -0.19, 1)
+        def cities(bbox):
+            return sorted(cluster.get('city') for cluster in self.clusters(12, bbox))
+        self.assertEqual(cities((170, -30, -165, 0)), ['apia', 'suva'])
+        self.assertEqual(cities((-5, 0, 5, 10)), ['accra'])
+        self.assertEqual(cities((170, -30, 180, 0)), ['suva'])
+        self.assertEqual(cities((10, 10, 20, 20)), [])
+
+    def test_snapping(self):
+        self.assertEqual(map_data.precision_for_zoom(0), 1)
+        self.assertEqual(map_data.precision_for_zoom(10), 5)
+        self.assertEqual(map_data.precision_for_zoom(30), map_data.MAX_PRECISION)
+        height, width = cell_size(2)
+        self.assertEqual((height, width), (5.625, 11.25))
+        snapped = map_data.snap_bbox((-84.5, 33.7, -84.3, 33.8), 2)
+        self.assertEqual(snapped, (-90.0, 28.125, -78.75, 39.375))
+        # Nearby viewports share one snapped box, hence one cached payload
+        self.assertEqual(map_data.snap_bbox((-84.4, 33.0, -84.2, 34.1), 2), snapped)
+        self.assertEqual(map_data.snap_bbox((-179.9, -89.9, 179.9, 89.9), 1),
+                         (-180.0, -90.0, 180.0, 90.0))
+
+
+class RatingMapDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer')
+        self.movie = Movie.objects.create(name='Mapped', price=5, description='A film',
+                                          image='movie_images/test.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.user, {self.movie.id: 1}, 'Atlanta', 'GA', 'USA')
+            set_coordinates('Atlanta', 'GA', 'USA', 33.75, -84.39)
+
+    def get(self, **headers):
+        return self.client.get(reverse('rating_map.data'), headers=headers)
+
+    def test_conditional_get(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('Mapped', response.content.decode())
+        response = self.get(if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_gzip_negotiation(self):
+        plain = self.get()
+        for accept_encoding, compressed in [('gzip, deflate', True), ('br;q=1.0, *;q=0.5', True),
+                                            ('gzip;q=0', False), ('br', False), ('', False)]:
+            with self.subTest(accept_encoding):
+                response = self.get(accept_encoding=accept_encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                if compressed:
+                    self.assertEqual(response['Content-Encoding'], 'gzip')
+                    self.assertEqual(gzip.decompress(response.content), plain.content)
+                    self.assertNotEqual(response['ETag'], plain['ETag'])
+                else:
+                    self.assertFalse(response.has_header('Content-Encoding'))
+                    self.assertEqual(response['ETag'], plain['ETag'])
+
+    def test_orders_change_the_etag(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.user, {self.movie.id: 1}, 'Atlanta', 'GA', 'USA')
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(MOVIES_PAGE_SIZE=5)
+class CataloguePaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = [
+            Movie.objects.create(name=f'Movie {i:02}', price=i + 1, description='A film',
+                                 image='movie_images/test.jpg')
+            for i in range(12)
+        ]
+
+    def names(self, params):
+        response = self.client.get(reverse('movies.index'), params)
+        self.assertEqual(response.status_code, 200)
+        return [movie.name for movie in response.context['template_data']['movies']]
+
+    def test_pages_walk_the_catalogue(self):
+        response = self.client.get(reverse('movies.index'), {'sort': 'price'})
+        seen = [movie.name for movie in response.context['template_data']['movies']]
+        while response.context['template_data']['next_url']:
+            response = self.client.get(reverse('movies.index')
+                                       + response.context['template_data']['next_url'])
+            seen.extend(movie.name for movie in response.context['template_data']['movies'])
+        self.assertEqual(seen, [movie.name for movie in self.movies])
+
+    def test_invalid_cursors_show_the_first_page(self):
+        first = self.names({'sort': 'price'})
+        for cursor in INVALID_CURSORS:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.names({'sort': 'price', 'after': cursor}), first)
+                self.assertEqual(self.names({'sort': 'price', 'before': cursor}), first)
+
+
+@override_settings(MOVIE_REVIEWS_PAGE_SIZE=10)
+class ReviewPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name='Popular', price=5, description='A film',
+                                          image='movie_images/test.jpg')
+        self.quiet = Movie.objects.create(name='Quiet', price=5, description='A film',
+                                          image='movie_images/test.jpg')
+        users = [User.objects.create_user(username=f'user{i}') for i in range(5)]
+        Review.objects.bulk_create(
+            Review(movie=self.movie, user=users[i % 5], comment=f'Review {i}')
+            for i in range(45))
+        Review.objects.bulk_create(
+            Review(movie=self.quiet, user=user, comment='Only one') for user in users)
+
+    def test_query_count_independent_of_review_count(self):
+        for movie in [self.movie, self.quiet]:
+            with self.assertNumQueries(2):
+                self.client.get(reverse('movies.show', args=[movie.id]))
+
+    def test_fragment_walks_all_reviews(self):
+        response = self.client.get(reverse('movies.show', args=[self.movie.id]))
+        page = response.context['template_data']['reviews']
+        seen = [review.id for review in page]
+        while page.has_next:
+            response = self.client.get(reverse('movies.reviews', args=[self.movie.id]),
+                                       {'after': page.next_cursor})
+            self.assertNotContains(response, '<html')
+            page = response.context['template_data']['reviews']
+            seen.extend(review.id for review in page)
+        expected = Review.objects.filter(movie=self.movie).order_by('-date', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+
+    def test_invalid_cursors_show_the_first_page(self):
+        response = self.client.get(reverse('movies.show', args=[self.movie.id]))
+        first = [review.id for review in response.context['template_data']['reviews']]
+        for cursor in INVALID_CURSORS:
+            for name in ['movies.show', 'movies.reviews']:
+                with self.subTest(view=name, cursor=cursor):
+                    response = self.client.get(reverse(name, args=[self.movie.id]),
+                                               {'after': cursor})
+                    self.assertEqual(response.status_code, 200)
+                    page = response.context['template_data']['reviews']
+                    self.assertEqual([review.id for review in page], first)
+
+    def test_owner_controls(self):
+        Review.objects.create(movie=self.quiet, user=User.objects.create_user(
+            username='owner', password='secret'), comment='Mine')
+        self.client.login(username='owner', password='secret')
+        response = self.client.get(reverse('movies.show', args=[self.quiet.id]))
+        self.assertContains(response, 'btn-danger', count=1)
+
+
+class MoviePageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='critic', password='secret')
+        self.admin = User.objects.create_superuser(username='admin', password='secret')
+        self.movie = Movie.objects.create(name='Cached', price=5, description='A film',
+                                          image='movie_images/test.jpg')
+        self.url = reverse('movies.show', args=[self.movie.id])
+
+    def test_anonymous_hits_skip_the_database(self):
+        self.client.get(self.url)
+        self.client.get(reverse('movies.index'))
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+            self.client.get(reverse('movies.index'))
+
+    @override_settings(MOVIES_PAGE_SIZE=1)
+    def test_unrelated_query_parameters_share_the_catalogue_cache(self):
+        Movie.objects.create(name='Second', price=6, description='A film',
+                             image='movie_images/test.jpg')
+        self.client.get(reverse('movies.index'), {'sort': 'price', 'search': 'film'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('movies.index'), {
+                'sort': 'price', 'search': '  film ', 'utm_source': 'mail', 'page': '7'})
+        self.assertRegex(response.context['template_data']['next_url'],
+                         r'^\?search=film&sort=price&after=[\w-]+$')
+
+    def test_review_changes_invalidate_the_movie(self):
+        self.client.get(self.url)
+        self.client.login(username='critic', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('movies.create_review', args=[self.movie.id]),
+                             {'comment': 'First!'})
+        self.assertContains(self.client.get(self.url), 'First!')
+        review = Review.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('movies.edit_review', args=[self.movie.id, review.id]),
+                             {'comment': 'Edited'})
+        self.assertContains(self.client.get(self.url), 'Edited')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('movies.delete_review', args=[self.movie.id, review.id]))
+        self.assertNotContains(self.client.get(self.url), 'Edited')
+
+    def test_own_controls_are_rendered_per_user(self):
+        Review.objects.create(movie=self.movie, user=self.user, comment='Mine')
+        self.client.get(self.url)
+        self.client.login(username='critic', password='secret')
+        self.assertContains(self.client.get(self.url), 'btn-danger')
+        self.client.logout()
+        self.assertNotContains(self.client.get(self.url), 'btn-danger')
+
+    def test_admin_save_invalidates_the_catalogue(self):
+        self.assertContains(self.client.get(reverse('movies.index')), 'Cached')
+        self.client.login(username='admin', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:movies_movie_change', args=[self.movie.id]), {
+                'name': 'Renamed', 'price': 5, 'description': 'A film',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.client.logout()
+        self.assertContains(self.client.get(reverse('movies.index')), 'Renamed')
+        self.assertContains(self.client.get(self.url), 'Renamed')
+
+
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.media_root)
+
+    def setUp(self):
+        cache.clear()
+        thumbnails._generated.clear()
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (600, 900), 'red').save(buffer, 'JPEG')
+        self.movie = Movie.objects.create(
+            name='Poster', price=5, description='A film',
+            image=SimpleUploadedFile('poster.jpg', buffer.getvalue(), 'image/jpeg'))
+
+    def thumbnail(self, height, extension):
+        name = thumbnails.thumbnail_name(self.movie.image.name, height, extension)
+        return Image.open(f'{self.media_root}/{name}')
+
+    def test_derivatives_are_created_on_upload(self):
+        for height in thumbnails.DEFAULT_HEIGHTS:
+            self.assertEqual(self.thumbnail(height, 'jpg').size, (round(height * 2 / 3), height))
+            self.assertEqual(self.thumbnail(height, 'webp').format, 'WEBP')
+
+    def test_pages_reference_the_right_size(self):
+        response = self.client.get(reverse('movies.index'))
+        self.assertContains(response, '<picture>')
+        self.assertContains(response, '-200.webp 1x, ')
+        self.assertContains(response, '-400.webp 2x')
+        self.assertNotContains(response, self.movie.image.url + '"')
+        response = self.client.get(reverse('movies.show', args=[self.movie.id]))
+        self.assertContains(response, '-400.jpg 1x, ')
+        self.assertContains(response, '-800.jpg 2x')
+
+    def test_missing_derivatives_are_created_lazily(self):
+        shutil.rmtree(f'{self.media_root}/thumbs')
+        thumbnails._generated.clear()
+        self.client.get(reverse('movies.index'))
+        self.assertEqual(self.thumbnail(200, 'webp').height, 200)
+        thumbnails._generated.clear()
+        call_command('generate_thumbnails', stdout=StringIO())
+        self.assertEqual(self.thumbnail(800, 'jpg').height, 800)
+
+    def test_missing_original_falls_back_quietly(self):
+        missing = Movie.objects.create(name='Lost', price=5, description='A film',
+                                       image='movie_images/lost.jpg')
+        thumbnails._failed.discard(missing.image.name)
+        with self.assertLogs('movies.thumbnails', 'INFO') as logs:
+            url = thumbnails.thumbnail_url(missing.image, 200, 'webp')
+        self.assertEqual(url, missing.image.url)
+        self.assertEqual(logs.output,
+                         ['INFO:movies.thumbnails:Original image movie_images/lost.jpg is missing'])
+        self.assertIsNone(logs.records[0].exc_info)
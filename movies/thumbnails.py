@@ -0,0 +1,128 @@
+"""
+Resized JPEG and WebP derivatives of Movie.image.
+
+Posters are uploaded at full resolution but shown as 200px cards in the
+catalogue and 400px on the movie page. Each poster gets a derivative per
+height in THUMBNAIL_HEIGHTS and per format, stored next to the uploads
+under MEDIA_ROOT/thumbs/. Derivatives are generated when a movie is saved
+(see movies.signals) and otherwise lazily the first time a page asks for
+them; `generate_thumbnails` precomputes them for existing movies.
+"""
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEIGHTS = (200, 400, 800)
+DEFAULT_QUALITY = 80
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+# Names of derivatives known to exist, so pages skip the filesystem check,
+# and of originals that could not be read, so they are not retried per page
+_generated = set()
+_failed = set()
+_lock = threading.Lock()
+
+
+def thumbnail_heights():
+    return tuple(getattr(settings, 'THUMBNAIL_HEIGHTS', DEFAULT_HEIGHTS))
+
+
+def thumbnail_name(name, height, extension):
+    """
+    Storage name of a derivative.
+
+    Args:
+        name: Storage name of the original image
+        height: Height in pixels of the derivative
+        extension: 'webp' or 'jpg'
+
+    Returns:
+        Name such as 'thumbs/inception-1a2b3c4d-200.webp'
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return f'thumbs/{stem}-{digest}-{height}.{extension}'
+
+
+def _render(source, height, extension):
+    image = source
+    if image.height > height:
+        width = max(1, round(image.width * height / image.height))
+        image = image.resize((width, height), Image.LANCZOS)
+    if extension == 'jpg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, FORMATS[extension],
+               quality=getattr(settings, 'THUMBNAIL_QUALITY', DEFAULT_QUALITY),
+               optimize=extension == 'jpg', progressive=extension == 'jpg')
+    return buffer.getvalue()
+
+
+def generate_thumbnails(image_field, storage=default_storage):
+    """
+    Create every missing derivative of an image.
+
+    Args:
+        image_field: FieldFile of the original (e.g. movie.image)
+        storage: Storage the derivatives are written to
+
+    Returns:
+        Number of derivatives created
+    """
+    if not image_field:
+        return 0
+    wanted = [(height, extension) for height in thumbnail_heights() for extension in FORMATS
+              if not storage.exists(thumbnail_name(image_field.name, height, extension))]
+    if not wanted:
+        return 0
+    with image_field.storage.open(image_field.name, 'rb') as original:
+        source = ImageOps.exif_transpose(Image.open(original))
+        source.load()
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+    for height, extension in wanted:
+        name = thumbnail_name(image_field.name, height, extension)
+        storage.save(name, ContentFile(_render(source, height, extension)))
+        with _lock:
+            _generated.add(name)
+    return len(wanted)
+
+
+def thumbnail_url(image_field, height, extension, storage=default_storage):
+    """
+    URL of a derivative, generating the derivatives on first use.
+
+    Falls back to the original image if it cannot be read or decoded; such
+    images are not retried until the process restarts.
+    """
+    name = thumbnail_name(image_field.name, height, extension)
+    if name not in _generated:
+        if image_field.name in _failed:
+            return image_field.url
+        try:
+            generate_thumbnails(image_field, storage)
+        except FileNotFoundError:
+            # Nothing to resize; the page links the original, whose URL
+            # 404s where it will be noticed
+            logger.info('Original image %s is missing', image_field.name)
+            with _lock:
+                _failed.add(image_field.name)
+            return image_field.url
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.warning('Could not create thumbnails of %s', image_field.name, exc_info=True)
+            with _lock:
+                _failed.add(image_field.name)
+            return image_field.url
+        with _lock:
+            _generated.add(name)
+    return storage.url(name)
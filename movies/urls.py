@@ -4,8 +4,10 @@ from . import views
 urlpatterns = [
     path('', views.index, name='movies.index'),
     path('<int:id>/', views.show, name='movies.show'),
+    path('<int:id>/reviews/', views.reviews, name='movies.reviews'),
     path('<int:id>/review/create/', views.create_review, name='movies.create_review'),
     path('<int:id>/review/<int:review_id>/edit/', views.edit_review, name='movies.edit_review'),
     path('<int:id>/review/<int:review_id>/delete/', views.delete_review, name='movies.delete_review'),
     path('rating-map/', views.rating_map, name='rating_map'),
+    path('rating-map/data/', views.rating_map_data, name='rating_map.data'),
 ]
@@ -1,34 +1,163 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.core.paginator import Paginator
+from moviesstore.assets import accepts_encoding
+from moviesstore.pagination import keyset_paginate
 from .models import Movie, Review
-from django.db.models import Count
-from cart.models import Order, Item 
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, urlencode
 from django.contrib.auth.decorators import login_required
-import json
+from .cache import (acached, acatalogue_version, cache_key, cached, invalidate_reviews,
+                    movie_version)
+from .search import matching_movies, search_movies
+from .map_data import aget_cluster_payload, aget_rating_map_payload
+import math
 
-# Defining the movie function
-def index(request):
-    search_term = request.GET.get('search')
-    if search_term:
-        movies = Movie.objects.filter(name__icontains=search_term)
+# Catalogue sort options: label and keyset ordering (backed by Movie indexes)
+MOVIE_SORTS = {
+    'name': ('Name', ['name', 'id']),
+    'price': ('Price: low to high', ['price', 'id']),
+    '-price': ('Price: high to low', ['-price', '-id']),
+    'newest': ('Newest', ['-id']),
+}
+
+def catalogue_params(request):
+    """
+    The query parameters that select a catalogue page, normalized.
+
+    Anything else in the query string is ignored, so it neither splits the
+    page cache nor leaks into the next/previous links.
+    """
+    params = {
+        'search': ' '.join(request.GET.get('search', '').split()),
+        'sort': request.GET.get('sort', ''),
+        'after': request.GET.get('after', ''),
+        'before': request.GET.get('before', ''),
+        'page': request.GET.get('page', ''),
+    }
+    if params['sort'] not in MOVIE_SORTS:
+        params['sort'] = ''
+    if params['search'] and not params['sort']:
+        # Relevance order pages by number instead of by cursor
+        params['after'] = params['before'] = ''
+        params['page'] = params['page'] if params['page'].isdigit() else ''
+    else:
+        params['page'] = ''
+    return params
+
+def page_url(params, **changes):
+    query = {key: value for key, value in params.items()
+             if value and key not in ('after', 'before', 'page')}
+    query.update(changes)
+    return '?' + urlencode(query)
+
+def catalogue_page(params):
+    """
+    Movies and navigation links of one catalogue page.
+
+    Args:
+        params: Normalized query parameters, from catalogue_params()
+
+    Returns:
+        Dict with the effective sort, the movies and the next/previous URLs
+    """
+    search_term = params['search']
+    sort = params['sort']
+    page_size = getattr(settings, 'MOVIES_PAGE_SIZE', 24)
+    next_url = previous_url = None
+    if search_term and not sort:
+        # Relevance order; the results are capped at MOVIES_SEARCH_LIMIT so
+        # numbered pages stay cheap
+        page = Paginator(search_movies(search_term), page_size).get_page(params['page'])
+        if page.has_next():
+            next_url = page_url(params, page=page.next_page_number())
+        if page.has_previous():
+            previous_url = page_url(params, page=page.previous_page_number())
     else:
-        movies = Movie.objects.all()
+        sort = sort or 'name'
+        movies = matching_movies(search_term) if search_term else Movie.objects.all()
+        page = keyset_paginate(movies, MOVIE_SORTS[sort][1],
+                               after=params['after'], before=params['before'],
+                               page_size=page_size)
+        if page.has_next:
+            next_url = page_url(params, after=page.next_cursor)
+        if page.has_previous:
+            previous_url = page_url(params, before=page.previous_cursor)
+    return {'sort': sort, 'movies': list(page.object_list),
+            'next_url': next_url, 'previous_url': previous_url}
+
+# Defining the movie function
+async def index(request):
+    params = catalogue_params(request)
+    key = cache_key('movies:catalogue', await acatalogue_version(),
+                    *(params[name] for name in ('search', 'sort', 'after', 'before', 'page')))
+    page = await acached(key, lambda: catalogue_page(params))
     template_data = {}
     template_data['title'] = 'Movies'
-    template_data['movies'] = movies
-    return render(request, 'movies/index.html',
-                  {'template_data': template_data})
+    template_data['movies'] = page['movies']
+    template_data['search'] = request.GET.get('search', '')
+    template_data['sort'] = page['sort']
+    template_data['sorts'] = [(key, label) for key, (label, _) in MOVIE_SORTS.items()]
+    template_data['next_url'] = page['next_url']
+    template_data['previous_url'] = page['previous_url']
+    # Rendering may load the session user and create poster thumbnails
+    return await sync_to_async(render)(request, 'movies/index.html',
+                                       {'template_data': template_data})
 # Create your views here.
 
+def review_page(movie, after=None):
+    """
+    One page of a movie's reviews, newest first.
+
+    Args:
+        movie: Movie whose reviews are listed
+        after: Cursor of the last review already shown, if any
+
+    Returns:
+        KeysetPage of reviews with their users loaded
+    """
+    reviews = Review.objects.filter(movie=movie).select_related('user').only(
+        'id', 'comment', 'date', 'movie_id', 'user__id', 'user__username')
+    return keyset_paginate(reviews, ['-date', '-id'], after=after,
+                           page_size=getattr(settings, 'MOVIE_REVIEWS_PAGE_SIZE', 10))
+
+def cached_movie_page(id, after=None):
+    """
+    A movie and one page of its reviews, cached until either changes.
+
+    Args:
+        id: Movie id
+        after: Review cursor, as for review_page()
+
+    Returns:
+        (movie, KeysetPage of reviews); raises Http404 for unknown movies
+    """
+    version = movie_version(id)
+    movie = cached(f'movies:show:{id}:{version}',
+                   lambda: get_object_or_404(Movie, id=id))
+    reviews = cached(cache_key(f'movies:reviews:{id}', version, after or ''),
+                     lambda: review_page(movie, after))
+    return movie, reviews
+
 # Defining the views show function
-def show(request, id): 
-    movie = Movie.objects.get(id=id)
-    reviews = Review.objects.filter(movie=movie)
+def show(request, id):
+    movie, reviews = cached_movie_page(id, request.GET.get('after'))
     template_data = {}
     template_data['title'] = movie.name
     template_data['movie'] = movie
     template_data['reviews'] = reviews
     return render(request, 'movies/show.html', {'template_data': template_data})
 
+def reviews(request, id):
+    """Next page of reviews as an HTML fragment, appended by show.html."""
+    movie, reviews = cached_movie_page(id, request.GET.get('after'))
+    template_data = {}
+    template_data['movie'] = movie
+    template_data['reviews'] = reviews
+    return render(request, 'movies/reviews.html', {'template_data': template_data})
+
 @login_required
 def create_review(request, id):
     if request.method == 'POST' and request.POST['comment']!= '':
@@ -38,6 +167,7 @@ def create_review(request, id):
         review.movie = movie
         review.user = request.user
         review.save()
+        invalidate_reviews(movie.id)
         return redirect('movies.show', id=id)
     else:
         return redirect('movies.show', id=id)
@@ -56,6 +186,7 @@ def edit_review(request, id, review_id):
         review = Review.objects.get(id=review_id)
         review.comment = request.POST['comment']
         review.save()
+        invalidate_reviews(review.movie_id)
         return redirect('movies.show', id=id)
     else:
         return redirect('movies.show', id=id)
@@ -65,83 +196,41 @@ def delete_review(request, id, review_id):
     review = get_object_or_404(Review, id=review_id,
         user=request.user)
     review.delete()
+    invalidate_reviews(review.movie_id)
     return redirect('movies.show', id=id)
 
 def rating_map(request):
-    # Aggregate purchases per movie per city
-    movie_counts = list(
-        Item.objects
-        .values(
-            'movie__id',
-            'movie__name',
-            'order__city',
-            'order__state',
-            'order__country',
-            'order__latitude',
-            'order__longitude'
-        )
-        .annotate(count=Count('id'))
-    )
-    
-    # Group by location to combine multiple movies at same location
-    locations = {}
-    movies_summary = {}  # Track all movies and their total purchases
-    
-    for item in movie_counts:
-        if item['order__latitude'] and item['order__longitude']:
-            # Create a location key
-            loc_key = f"{item['order__latitude']},{item['order__longitude']}"
-            
-            if loc_key not in locations:
-                locations[loc_key] = {
-                    'latitude': item['order__latitude'],
-                    'longitude': item['order__longitude'],
-                    'city': item['order__city'],
-                    'state': item['order__state'],
-                    'country': item['order__country'],
-                    'movies': [],
-                    'total_purchases': 0
-                }
-            
-            locations[loc_key]['movies'].append({
-                'id': item['movie__id'],
-                'name': item['movie__name'],
-                'count': item['count']
-            })
-            locations[loc_key]['total_purchases'] += item['count']
-            
-            # Track movie summary
-            movie_id = item['movie__id']
-            if movie_id not in movies_summary:
-                movies_summary[movie_id] = {
-                    'id': movie_id,
-                    'name': item['movie__name'],
-                    'total_purchases': 0,
-                    'locations': []
-                }
-            movies_summary[movie_id]['total_purchases'] += item['count']
-            movies_summary[movie_id]['locations'].append({
-                'city': item['order__city'],
-                'state': item['order__state'],
-                'country': item['order__country'],
-                'latitude': item['order__latitude'],
-                'longitude': item['order__longitude'],
-                'count': item['count']
-            })
-    
-    # Convert to lists for JSON serialization
-    locations_list = list(locations.values())
-    movies_list = sorted(movies_summary.values(), key=lambda x: x['total_purchases'], reverse=True)
-    
-    locations_json = json.dumps(locations_list, ensure_ascii=False)
-    movies_json = json.dumps(movies_list, ensure_ascii=False)
-
-    return render(
-        request,
-        'movies/rating_map.html',
-        {
-            'locations_json': locations_json,
-            'movies_json': movies_json
-        }
-    )
+    template_data = {}
+    template_data['title'] = 'Rating Map'
+    return render(request, 'movies/rating_map.html',
+                  {'template_data': template_data})
+
+async def rating_map_data(request):
+    if 'zoom' in request.GET:
+        try:
+            zoom = int(request.GET['zoom'])
+            bbox = tuple(float(value) for value in request.GET['bbox'].split(','))
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest('zoom and bbox=west,south,east,north are required')
+        if len(bbox) != 4 or not all(math.isfinite(value) for value in bbox):
+            return HttpResponseBadRequest('zoom and bbox=west,south,east,north are required')
+        payload = await aget_cluster_payload(zoom, bbox)
+    else:
+        payload = await aget_rating_map_payload()
+
+    etag = payload.etag
+    body = payload.body
+    if accepts_encoding(request, 'gzip'):
+        etag = payload.gzip_etag
+        body = payload.gzip_body
 
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+        if body is payload.gzip_body:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,215 @@
+"""
+In-process serving of static files and uploads with HTTP caching.
+
+Production mode (DEBUG = False) stores static files under content-hashed
+names via CompressedManifestStaticFilesStorage, which also writes gzip
+(and, if the brotli package is installed, brotli) copies next to each
+text asset during collectstatic. `serve_asset` then serves them, and the
+uploaded media, straight from disk:
+
+- the precompressed copy matching Accept-Encoding, if there is one;
+- ETag and Last-Modified validators, answered with 304 when unchanged;
+- Cache-Control with a long max-age (plus "immutable" for hashed static
+  files, whose name changes whenever their content does), so browsers do
+  not ask again on repeat visits;
+- single byte-range requests (206/416), e.g. for resumable downloads.
+"""
+import gzip
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt',
+                           '.html', '.xml', '.ico', '.webmanifest'}
+MIN_COMPRESS_SIZE = 256
+DEFAULT_STATIC_MAX_AGE = 60 * 60 * 24 * 365     # hashed names never change
+DEFAULT_MEDIA_MAX_AGE = 60 * 60 * 24 * 30       # upload names are unique too
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also precompresses the hashed text assets.
+
+    Files missing from the manifest are served under their plain name
+    rather than failing the template that refers to them, and CSS
+    references to missing files are left as they are instead of failing
+    collectstatic.
+    """
+    manifest_strict = False
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def convert(matchobj):
+            try:
+                return converter(matchobj)
+            except ValueError:
+                return matchobj.group(0)
+        return convert
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if Path(name).suffix.lower() in COMPRESSIBLE_EXTENSIONS:
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(content):
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+
+
+def accepts_encoding(request, coding):
+    """
+    Whether Accept-Encoding allows a content coding.
+
+    The coding must be listed, or covered by '*', with a q-value above 0,
+    so "gzip;q=0" refuses gzip.
+    """
+    qualities = {}
+    for value in request.headers.get('Accept-Encoding', '').split(','):
+        name, *params = [part.strip() for part in value.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, number = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities.get(coding, qualities.get('*', 0)) > 0
+
+
+def _byte_range(header, size):
+    """
+    Parse a Range header for a file of `size` bytes.
+
+    Returns:
+        (start, end) inclusive, None to serve the whole file (absent or
+        unsupported header), or False if the range cannot be satisfied
+    """
+    match = _range_re.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # "bytes=-500": the last 500 bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def serve_asset(request, path, document_root, max_age, immutable=False):
+    """
+    Serve a file below document_root with caching headers.
+
+    Args:
+        request: Current request
+        path: Path of the file relative to document_root
+        document_root: Directory the files are served from
+        max_age: Seconds browsers may reuse the file without asking again
+        immutable: Whether the file name changes whenever its content does
+            (hashed static files)
+
+    Returns:
+        FileResponse (200), HttpResponse (206/304/416); raises Http404 for
+        missing files
+    """
+    try:
+        fullpath = Path(safe_join(document_root, path))
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    if not fullpath.is_file():
+        raise Http404('Not found')
+
+    served, encoding = fullpath, None
+    if 'Range' not in request.headers:
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            candidate = fullpath.with_name(fullpath.name + suffix)
+            if accepts_encoding(request, name) and candidate.is_file():
+                served, encoding = candidate, name
+                break
+
+    stat = served.stat()
+    etag = '"{:x}-{:x}{}"'.format(stat.st_mtime_ns, stat.st_size,
+                                  f'-{encoding}' if encoding else '')
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(fullpath.name)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if_range = request.headers.get('If-Range')
+        byte_range = None
+        if if_range is None or if_range in (etag, http_date(last_modified)):
+            byte_range = _byte_range(request.headers.get('Range'), stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif byte_range is not None:
+            start, end = byte_range
+            with served.open('rb') as f:
+                f.seek(start)
+                response = HttpResponse(f.read(end - start + 1), status=206,
+                                        content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(served.open('rb'), content_type=content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+
+    response['Cache-Control'] = f'public, max-age={max_age}' + (', immutable' if immutable else '')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def serve_static(request, path):
+    """Serve a collected static file; hashed names are cached forever."""
+    if path in getattr(staticfiles_storage, 'hashed_files', {}).values():
+        return serve_asset(request, path, settings.STATIC_ROOT, immutable=True,
+                           max_age=getattr(settings, 'STATIC_MAX_AGE', DEFAULT_STATIC_MAX_AGE))
+    # Unhashed names may change content: revalidate every time
+    return serve_asset(request, path, settings.STATIC_ROOT, max_age=0)
+
+
+def serve_media(request, path):
+    """Serve an uploaded file (posters and their thumbnails)."""
+    return serve_asset(request, path, settings.MEDIA_ROOT,
+                       max_age=getattr(settings, 'MEDIA_MAX_AGE', DEFAULT_MEDIA_MAX_AGE))
@@ -0,0 +1,251 @@
+"""
+Per-request performance instrumentation.
+
+`instrumentation_middleware` times every request and attributes to the
+view that served it (its URL name, e.g. 'movies.index' or 'cart.purchase'):
+
+- wall time;
+- number and total time of database queries, counted by a wrapper that is
+  installed on every database connection;
+- application cache hits and misses, reported by the caching helpers
+  through `record_cache`;
+- time spent waiting on external services, reported through
+  `record_external` (the geocoding providers).
+
+The figures are exported as histograms on /metrics (see
+moviesstore.metrics). Requests slower than INSTRUMENTATION_SLOW_THRESHOLD
+seconds are logged to the 'moviesstore.performance' logger with their
+slowest SQL statements, and the INSTRUMENTATION_SLOW_REQUESTS slowest of
+them are kept for /metrics/slow. Setting INSTRUMENTATION_SLOW_REQUESTS to 0
+turns SQL capture off.
+
+The statistics of the current request live in a context variable, which
+asgiref carries into sync_to_async threads, so async views are measured
+the same way as sync ones.
+"""
+import heapq
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import counter, histogram, scraper_allowed
+
+logger = logging.getLogger('moviesstore.performance')
+
+DEFAULT_SLOW_THRESHOLD = 1.0
+DEFAULT_SLOW_REQUESTS = 10
+MAX_CAPTURED_SQL = 200       # statements kept per request
+MAX_LOGGED_SQL = 10          # slowest statements shown per slow request
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+request_duration = histogram(
+    'http_request_duration_seconds', 'Wall time of requests by view', ['view', 'method'])
+request_queries = histogram(
+    'http_request_db_queries', 'Database queries per request by view', ['view'],
+    buckets=QUERY_BUCKETS)
+request_db_time = histogram(
+    'http_request_db_seconds', 'Time per request spent in database queries', ['view'])
+request_external_time = histogram(
+    'http_request_external_seconds', 'Time per request spent waiting on external services',
+    ['view'])
+requests_total = counter(
+    'http_requests_total', 'Requests by view, method and status', ['view', 'method', 'status'])
+request_cache_lookups = counter(
+    'http_request_cache_lookups_total', 'Application cache lookups made by each view',
+    ['view', 'result'])
+cache_lookups = counter(
+    'cache_lookups_total', 'Application cache lookups by cache', ['cache', 'result'])
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    def __init__(self, capture_sql):
+        self.queries = 0
+        self.query_time = 0.0
+        self.sql = [] if capture_sql else None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.external_calls = 0
+        self.external_time = 0.0
+
+
+_current = ContextVar('request_stats', default=None)
+
+
+def current_stats():
+    """Statistics of the request being served, or None outside a request."""
+    return _current.get()
+
+
+def record_cache(name, hit):
+    """
+    Report an application cache lookup.
+
+    Args:
+        name: Which cache (e.g. 'movies', 'rating_map', 'geocode')
+        hit: Whether the value was found
+    """
+    cache_lookups.inc(cache=name, result='hit' if hit else 'miss')
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def record_external(seconds):
+    """Report a call to an external service that took `seconds`."""
+    stats = _current.get()
+    if stats is not None:
+        stats.external_calls += 1
+        stats.external_time += seconds
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.queries += 1
+        stats.query_time += duration
+        if stats.sql is not None and len(stats.sql) < MAX_CAPTURED_SQL:
+            stats.sql.append((duration, sql))
+
+
+def install_query_hook(connection, **kwargs):
+    """Count the queries of a database connection (idempotent)."""
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_wrapper)
+
+
+connection_created.connect(install_query_hook, dispatch_uid='moviesstore.instrumentation')
+
+
+# The slowest requests seen, as a min-heap of (seconds, sequence, summary)
+_slowest = []
+_slowest_lock = threading.Lock()
+_sequence = 0
+
+
+def slow_requests():
+    """The slowest requests recorded so far, slowest first."""
+    with _slowest_lock:
+        return [summary for _, _, summary in sorted(_slowest, reverse=True)]
+
+
+def reset_slow_requests():
+    with _slowest_lock:
+        _slowest.clear()
+
+
+def _keep_slow_request(elapsed, summary, limit):
+    global _sequence
+    with _slowest_lock:
+        _sequence += 1
+        entry = (elapsed, _sequence, summary)
+        if len(_slowest) < limit:
+            heapq.heappush(_slowest, entry)
+        elif elapsed > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+
+
+def _start():
+    limit = getattr(settings, 'INSTRUMENTATION_SLOW_REQUESTS', DEFAULT_SLOW_REQUESTS)
+    stats = RequestStats(capture_sql=limit > 0)
+    return stats, _current.set(stats), time.perf_counter()
+
+
+def _finish(request, response, stats, started):
+    elapsed = time.perf_counter() - started
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unresolved'
+    request_duration.observe(elapsed, view=view, method=request.method)
+    request_queries.observe(stats.queries, view=view)
+    request_db_time.observe(stats.query_time, view=view)
+    request_external_time.observe(stats.external_time, view=view)
+    requests_total.inc(view=view, method=request.method, status=response.status_code)
+    if stats.cache_hits:
+        request_cache_lookups.inc(stats.cache_hits, view=view, result='hit')
+    if stats.cache_misses:
+        request_cache_lookups.inc(stats.cache_misses, view=view, result='miss')
+
+    limit = getattr(settings, 'INSTRUMENTATION_SLOW_REQUESTS', DEFAULT_SLOW_REQUESTS)
+    threshold = getattr(settings, 'INSTRUMENTATION_SLOW_THRESHOLD', DEFAULT_SLOW_THRESHOLD)
+    if elapsed < threshold:
+        return
+    sql = sorted(stats.sql or [], reverse=True)[:MAX_LOGGED_SQL]
+    summary = {
+        'view': view,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'seconds': elapsed,
+        'queries': stats.queries,
+        'query_seconds': stats.query_time,
+        'cache_hits': stats.cache_hits,
+        'cache_misses': stats.cache_misses,
+        'external_calls': stats.external_calls,
+        'external_seconds': stats.external_time,
+        'sql': sql,
+    }
+    if limit > 0:
+        _keep_slow_request(elapsed, summary, limit)
+    logger.warning('Slow request: %s', format_summary(summary))
+
+
+def format_summary(summary):
+    """Render a slow request summary as text, one SQL statement per line."""
+    lines = ['{method} {path} ({view}) {status} in {seconds:.3f}s: {queries} queries in '
+             '{query_seconds:.3f}s, {cache_hits} cache hits, {cache_misses} misses, '
+             '{external_calls} external calls in {external_seconds:.3f}s'.format(**summary)]
+    lines += [f'    {duration * 1000:8.2f} ms  {sql}' for duration, sql in summary['sql']]
+    return '\n'.join(lines)
+
+
+@sync_and_async_middleware
+def instrumentation_middleware(get_response):
+    """Measure each request; should be the first entry of MIDDLEWARE."""
+    for connection in connections.all(initialized_only=True):
+        install_query_hook(connection)
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats, token, started = _start()
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            _finish(request, response, stats, started)
+            return response
+    else:
+        def middleware(request):
+            stats, token, started = _start()
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            _finish(request, response, stats, started)
+            return response
+    return middleware
+
+
+def slow_requests_view(request):
+    """List the slowest requests recorded by this process, with their SQL."""
+    if not scraper_allowed(request):
+        return HttpResponseForbidden()
+    body = '\n\n'.join(format_summary(summary) for summary in slow_requests())
+    return HttpResponse(body + '\n', content_type='text/plain; charset=utf-8')
@@ -0,0 +1,171 @@
+"""
+Keyset (cursor) pagination shared by the list views.
+
+Instead of OFFSET, each page is fetched with a WHERE clause that starts
+right after the last row of the previous page, e.g. for ordering
+('name', 'id'):
+
+    WHERE name > :name OR (name = :name AND id > :id)
+    ORDER BY name, id LIMIT :page_size + 1
+
+With an index on the ordering columns every page costs the same, however
+deep it is. The ordering must end with a unique column (normally the
+primary key) and its columns must not be nullable.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder, but keeping the microseconds of datetimes.
+
+    DjangoJSONEncoder rounds datetimes down to milliseconds, which would
+    skip rows created within the same millisecond as the cursor row.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Serialize the ordering values of a row into an opaque URL-safe token."""
+    data = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverse encode_cursor().
+
+    Returns:
+        List of ordering values, or None if the token is missing or invalid
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class KeysetPage:
+    """One page of results plus the cursors of its neighbours."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _keyset_filter(fields, values, backwards):
+    condition = Q()
+    for position, (name, descending) in enumerate(fields):
+        lookup = 'gt' if descending == backwards else 'lt'
+        clause = Q(**{f'{name}__{lookup}': values[position]})
+        for previous, (previous_name, _) in enumerate(fields[:position]):
+            clause &= Q(**{previous_name: values[previous]})
+        condition |= clause
+    return condition
+
+
+def _cursor_values(queryset, fields, values):
+    """
+    Convert decoded cursor values to the Python types of the ordering fields.
+
+    Returns:
+        List of values, or None if the cursor does not fit the ordering
+    """
+    if not isinstance(values, list) or len(values) != len(fields):
+        return None
+    converted = []
+    for (name, _), value in zip(fields, values):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = queryset.query.annotations[name].output_field
+        try:
+            value = field.to_python(value)
+        except (ValueError, TypeError, ValidationError):
+            return None
+        if value is None:
+            return None
+        converted.append(value)
+    return converted
+
+
+def _row_values(row, fields):
+    if isinstance(row, dict):
+        return [row[name] for name, _ in fields]
+    return [getattr(row, name) for name, _ in fields]
+
+
+def keyset_paginate(queryset, ordering, after=None, before=None, page_size=25):
+    """
+    Fetch one page of a queryset using keyset pagination.
+
+    Args:
+        queryset: QuerySet to paginate (any existing ordering is replaced)
+        ordering: Field names, optionally prefixed with '-', ending with a
+            unique field
+        after: Cursor of the row the page should start after
+        before: Cursor of the row the page should end before (used for
+            "previous" links)
+        page_size: Maximum number of rows on the page
+
+    Returns:
+        KeysetPage with the rows and the cursors for the next and previous
+        pages (None when there is no such page)
+    """
+    fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+    backwards = False
+    # A tampered or stale cursor shows the first page
+    cursor = _cursor_values(queryset, fields, decode_cursor(after))
+    if cursor is None and before:
+        cursor = _cursor_values(queryset, fields, decode_cursor(before))
+        backwards = cursor is not None
+    if cursor is not None:
+        queryset = queryset.filter(_keyset_filter(fields, cursor, backwards))
+
+    if backwards:
+        ordering = [field[1:] if field.startswith('-') else '-' + field
+                    for field in ordering]
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    has_next = has_more if not backwards else True
+    has_previous = has_more if backwards else cursor is not None
+    next_cursor = None
+    previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(_row_values(rows[-1], fields))
+    if rows and has_previous:
+        previous_cursor = encode_cursor(_row_values(rows[0], fields))
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the time spent in the other middleware is measured too
+    'moviesstore.instrumentation.instrumentation_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +85,24 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds to wait for the write lock before "database is locked"
+            'timeout': 20,
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Versioned data (e.g. the rating map payload) is invalidated through this
+# cache, so deployments with several processes should point it at a shared
+# backend such as Redis or Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'moviesstore',
     }
 }
 
@@ -132,4 +152,24 @@ STATICFILES_DIRS = [
 ]
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-MEDIA_URL = '/media/'
\ No newline at end of file
+MEDIA_URL = '/media/'
+
+# collectstatic target, served by moviesstore.assets when DEBUG is off
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Offline geocoding (cart.gazetteer). The default file, cart/data/gazetteer.bin,
+# is built from the bundled CSV on first use; on a read-only install, or to
+# use a larger CSV, run "python manage.py build_gazetteer [source.csv]" as
+# part of the deployment. Workers pick up a rebuilt file without a restart.
+# GEOCODING_GAZETTEER_PATH = BASE_DIR / 'cart/data/gazetteer.bin'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        # Production: content-hashed names plus precompressed copies
+        'BACKEND': ('django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+                    else 'moviesstore.assets.CompressedManifestStaticFilesStorage'),
+    },
+}
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Test helpers shared by the apps.
+
+QueryPlanTestMixin runs EXPLAIN QUERY PLAN on every query a block of code
+executes and fails if SQLite has to read a whole table to answer one of them,
+so a view that loses its index shows up as a test failure instead of a slow
+page in production.
+"""
+import re
+import unittest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .pagination import encode_cursor
+
+_full_scan_re = re.compile(r'^SCAN (\S+)(.*)$')
+_rowid_order_re = re.compile(r' ORDER BY "(\w+)"\."(\w+)"(?: ASC| DESC)? LIMIT \d+')
+
+# Cursors a client could send that keyset_paginate() must treat as no cursor
+INVALID_CURSORS = [
+    'not base64!',
+    encode_cursor({'id': 1}),
+    encode_cursor([{}, []]),
+    encode_cursor(['x', 'y']),
+    encode_cursor(['not-a-date', 1]),
+    encode_cursor([None, None]),
+    encode_cursor([1]),
+    encode_cursor([1, 2, 3]),
+]
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+class QueryPlanTestMixin:
+
+    # SQLite's own catalog, read by schema introspection
+    always_allowed = ('sqlite_master', 'sqlite_schema')
+
+    def rowid_ordered_table(self, sql, details):
+        """
+        Table whose plain SCAN stops at the LIMIT, if the statement has one.
+
+        An unfiltered "ORDER BY pk LIMIT n" walks the table in rowid order
+        and reads only n rows, e.g. the first page of "ORDER BY id DESC
+        LIMIT 25". Any WHERE clause or temporary sort disqualifies it.
+        """
+        match = _rowid_order_re.search(sql)
+        if (not match or ' WHERE ' in sql
+                or any('TEMP B-TREE' in detail for detail in details)):
+            return None
+        table, column = match.groups()
+        with connection.cursor() as cursor:
+            primary_key = connection.introspection.get_primary_key_columns(cursor, table)
+        return table if primary_key == [column] else None
+
+    def full_scans(self, sql):
+        """Tables that a statement reads in full, according to SQLite."""
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[-1] for row in cursor.fetchall()]
+        sorted_scan = self.rowid_ordered_table(sql, details)
+        scans = []
+        for detail in details:
+            match = _full_scan_re.match(detail)
+            # "SCAN t USING [COVERING] INDEX i" walks an index; FTS5 tables
+            # are searched through their own index
+            if (match and match.group(1) != sorted_scan
+                    and 'USING' not in match.group(2)
+                    and 'VIRTUAL TABLE' not in match.group(2)
+                    and match.group(1) not in self.always_allowed):
+                scans.append(match.group(1))
+        return scans
+
+    def assertNoFullScans(self, func, *args, allowed=(), **kwargs):
+        """
+        Call func and check the plan of every query it ran.
+
+        Args:
+            func: Callable to run (usually a test client request)
+            allowed: Tables that may legitimately be read in full (e.g. a
+                bounded rollup that is aggregated as a whole)
+
+        Returns:
+            Whatever func returned
+        """
+        with CaptureQueriesContext(connection) as captured:
+            result = func(*args, **kwargs)
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            scans = [table for table in self.full_scans(sql) if table not in allowed]
+            if scans:
+                self.fail(f'Full scan of {", ".join(scans)} in:\n{sql}')
+        return result
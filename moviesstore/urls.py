@@ -15,9 +15,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, include, re_path
 from django.conf import settings
+from moviesstore.assets import serve_media, serve_static
+from moviesstore.instrumentation import slow_requests_view
+from moviesstore.metrics import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('home.urls')),
@@ -25,5 +27,14 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('cart/', include('cart.urls')),
     path('petitions/', include('petitions.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('metrics/slow', slow_requests_view, name='metrics.slow'),
 ]
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+urlpatterns += [
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media),
+]
+if not settings.DEBUG:
+    # With DEBUG on, runserver serves the static files itself
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), serve_static),
+    ]
\ No newline at end of file
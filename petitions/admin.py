@@ -1,10 +1,16 @@
 
 from django.contrib import admin
 from .models import Petition
+from .voting import reconcile
 
 @admin.register(Petition)
 class PetitionAdmin(admin.ModelAdmin):
     list_display = ['id', 'movie_name', 'created_by', 'created_at', 'vote_count']
     list_filter = ['created_at']
     search_fields = ['movie_name', 'created_by__username']
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'votes_count', 'dislikes_count', 'net_votes', 'hot_score']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Voters may have been edited directly; bring the counters back in line
+        reconcile(Petition.objects.filter(id=form.instance.id))
@@ -0,0 +1,96 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import OuterRef
+
+from petitions.models import Petition
+from petitions.voting import Dislikers, Voters, find_drift, toggle
+
+
+class Command(BaseCommand):
+    help = ('Fire concurrent like/dislike toggles at a set of throwaway '
+            'petitions and check that the vote tables and counters stay '
+            'consistent. Users and petitions are deleted afterwards unless '
+            '--keep is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--petitions', type=int, default=5)
+        parser.add_argument('--toggles', type=int, default=5000,
+            help='Total number of vote/dislike toggles to perform.')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true',
+            help='Keep the generated users and petitions.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'loadtest-{int(time.time())}'
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}') for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith=prefix))
+        Petition.objects.bulk_create([
+            Petition(movie_name=f'{prefix} movie {i}', created_by=users[0])
+            for i in range(options['petitions'])])
+        petitions = list(Petition.objects.filter(movie_name__startswith=prefix))
+
+        # Few users and petitions relative to toggles means many collisions,
+        # including the same user toggling the same petition concurrently
+        work = [(rng.choice(petitions), rng.choice(users), rng.random() < 0.6)
+                for _ in range(options['toggles'])]
+        chunks = [work[i::options['threads']] for i in range(options['threads'])]
+
+        def run(chunk):
+            latencies = []
+            errors = 0
+            try:
+                for petition, user, like in chunk:
+                    start = time.perf_counter()
+                    try:
+                        toggle(petition, user, like=like)
+                    except OperationalError:
+                        errors += 1
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            return latencies, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(run, chunks))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for chunk, _ in results for latency in chunk)
+        errors = sum(chunk_errors for _, chunk_errors in results)
+        petition_ids = [petition.id for petition in petitions]
+        both = Voters.objects.filter(
+            petition_id__in=petition_ids,
+            user_id__in=Dislikers.objects.filter(
+                petition_id=OuterRef('petition_id')).values('user_id'),
+        ).count()
+        drift = find_drift(Petition.objects.filter(id__in=petition_ids))
+
+        self.stdout.write(
+            f"{len(work)} toggles on {len(petitions)} petitions by {len(users)} users "
+            f"with {options['threads']} threads")
+        self.stdout.write(f'  elapsed     {elapsed:.2f}s ({len(work) / elapsed:.0f} toggles/s)')
+        if latencies:
+            self.stdout.write(
+                f'  latency     p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+                f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms')
+        self.stdout.write(f'  errors      {errors}')
+        self.stdout.write(f'  liked and disliked by the same user: {both}')
+        self.stdout.write(f'  petitions with drifted counters:     {len(drift)}')
+
+        if not options['keep']:
+            Petition.objects.filter(id__in=petition_ids).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+        if errors or both or drift:
+            self.stderr.write(self.style.ERROR('FAILED'))
+            raise SystemExit(1)
+        self.stdout.write(self.style.SUCCESS('OK'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from petitions.voting import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Repair petition like/dislike counters that drifted from the voter tables.'
+
+    def handle(self, *args, **options):
+        repaired = reconcile()
+        self.stdout.write(f'Repaired {repaired} petition(s).')
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Petition = apps.get_model('petitions', 'Petition')
+
+    def count(through):
+        return Coalesce(Subquery(
+            through.objects.filter(petition_id=OuterRef('pk')).order_by()
+            .values('petition_id').annotate(count=Count('*')).values('count')
+        ), 0)
+
+    Petition.objects.update(
+        votes_count=count(Petition.voters.through),
+        dislikes_count=count(Petition.dislikers.through),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('petitions', '0002_petition_dislikers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='petition',
+            name='dislikes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='petition',
+            name='votes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
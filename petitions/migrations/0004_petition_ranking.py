@@ -0,0 +1,54 @@
+# Generated by Django 5.0.14 on 2026-10-17 17:25
+
+from django.conf import settings
+import math
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+
+def fill_scores(apps, schema_editor):
+    Petition = apps.get_model('petitions', 'Petition')
+    epoch = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    petitions = list(Petition.objects.all())
+    for petition in petitions:
+        net = petition.votes_count - petition.dislikes_count
+        sign = (net > 0) - (net < 0)
+        petition.net_votes = net
+        petition.hot_score = (sign * math.log10(max(abs(net), 1))
+                              + (petition.created_at - epoch).total_seconds() / 45000)
+    Petition.objects.bulk_update(petitions, ['net_votes', 'hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('petitions', '0003_petition_vote_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='petition',
+            name='hot_score',
+            field=models.FloatField(default=0, help_text='Time-decayed popularity used for the trending feed'),
+        ),
+        migrations.AddField(
+            model_name='petition',
+            name='net_votes',
+            field=models.IntegerField(default=0, help_text='Likes minus dislikes'),
+        ),
+        migrations.AddIndex(
+            model_name='petition',
+            index=models.Index(fields=['created_at', 'id'], name='petition_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='petition',
+            index=models.Index(fields=['net_votes', 'id'], name='petition_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='petition',
+            index=models.Index(fields=['hot_score', 'id'], name='petition_trending_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
@@ -8,15 +8,36 @@ class Petition(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     voters = models.ManyToManyField(User, related_name='petitions_voted', blank=True)
     dislikers = models.ManyToManyField(User, related_name='petitions_disliked', blank=True)
+    # Denormalized sizes of voters/dislikers, maintained by petitions.voting
+    votes_count = models.IntegerField(default=0)
+    dislikes_count = models.IntegerField(default=0)
+    # Ranking columns, also maintained by petitions.voting
+    net_votes = models.IntegerField(default=0, help_text="Likes minus dislikes")
+    hot_score = models.FloatField(default=0, help_text="Time-decayed popularity used for the trending feed")
 
     def vote_count(self):
-        return self.voters.count()
+        return self.votes_count
     
     def dislike_count(self):
-        return self.dislikers.count()
+        return self.dislikes_count
     
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            # created_at is only known once saved; seed the trending score
+            from .voting import hot_score
+            self.hot_score = hot_score(self.net_votes, self.created_at)
+            Petition.objects.filter(pk=self.pk).update(hot_score=self.hot_score)
+
     def __str__(self):
         return str(self.id) + ' - ' + self.movie_name
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            # One index per feed in petitions.views.PETITION_FEEDS
+            models.Index(fields=['created_at', 'id'], name='petition_new_idx'),
+            models.Index(fields=['net_votes', 'id'], name='petition_top_idx'),
+            models.Index(fields=['hot_score', 'id'], name='petition_trending_idx'),
+        ]
\ No newline at end of file
@@ -1,3 +1,160 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from moviesstore.testing import INVALID_CURSORS, QueryPlanTestMixin
+
+from .models import Petition
+from .voting import hot_score, reconcile, toggle
+
+
+class PetitionIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='secret')
+        self.voters = [User.objects.create_user(username=f'voter{i}') for i in range(5)]
+
+    def create_petitions(self, count):
+        for i in range(count):
+            petition = Petition.objects.create(
+                movie_name=f'Movie {i}', created_by=self.voters[i % 5])
+            for voter in self.voters[:3]:
+                toggle(petition, voter, like=True)
+            for voter in self.voters[3:]:
+                toggle(petition, voter, like=False)
+            if i % 2:
+                toggle(petition, self.user, like=True)
+
+    def index_queries(self):
+        with self.assertNumQueries(3):  # session, user, petitions
+            response = self.client.get(reverse('petitions.index'))
+        return response
+
+    def test_query_count_does_not_grow_with_petitions(self):
+        self.client.login(username='viewer', password='secret')
+        self.create_petitions(1)
+        self.index_queries()
+        self.create_petitions(20)
+        self.index_queries()
+
+    def test_counts_and_vote_state(self):
+        self.client.login(username='viewer', password='secret')
+        self.create_petitions(2)
+        petitions = {p.movie_name: p for p in self.index_queries().context['template_data']['petitions']}
+        self.assertEqual(petitions['Movie 0'].votes_count, 3)
+        self.assertEqual(petitions['Movie 0'].dislikes_count, 2)
+        self.assertFalse(petitions['Movie 0'].user_voted)
+        self.assertEqual(petitions['Movie 1'].votes_count, 4)
+        self.assertTrue(petitions['Movie 1'].user_voted)
+        self.assertFalse(petitions['Movie 1'].user_disliked)
+
+
+class VotingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter')
+        self.petition = Petition.objects.create(movie_name='Movie', created_by=self.user)
+
+    def assertCounts(self, votes, dislikes):
+        self.petition.refresh_from_db()
+        self.assertEqual((self.petition.votes_count, self.petition.dislikes_count),
+                         (votes, dislikes))
+        self.assertEqual((self.petition.voters.count(), self.petition.dislikers.count()),
+                         (votes, dislikes))
+
+    def test_toggle_moves_and_withdraws_vote(self):
+        toggle(self.petition, self.user, like=True)
+        self.assertCounts(1, 0)
+        toggle(self.petition, self.user, like=False)
+        self.assertCounts(0, 1)
+        toggle(self.petition, self.user, like=False)
+        self.assertCounts(0, 0)
+
+    def test_toggle_updates_ranking(self):
+        other = User.objects.create_user(username='other')
+        toggle(self.petition, self.user, like=True)
+        toggle(self.petition, other, like=True)
+        self.petition.refresh_from_db()
+        self.assertEqual(self.petition.net_votes, 2)
+        self.assertAlmostEqual(self.petition.hot_score,
+                               hot_score(2, self.petition.created_at))
+        toggle(self.petition, self.user, like=False)
+        toggle(self.petition, other, like=False)
+        self.petition.refresh_from_db()
+        self.assertEqual(self.petition.net_votes, -2)
+        self.assertAlmostEqual(self.petition.hot_score,
+                               hot_score(-2, self.petition.created_at))
+
+    def test_reconcile_repairs_drift(self):
+        self.petition.voters.add(self.user)
+        self.assertEqual(reconcile(), 1)
+        self.assertCounts(1, 0)
+        self.assertEqual(reconcile(), 0)
+
+
+class PetitionFeedTests(TestCase):
+    def test_feeds_order_by_votes_and_score(self):
+        users = [User.objects.create_user(username=f'user{i}') for i in range(3)]
+        quiet = Petition.objects.create(movie_name='Quiet', created_by=users[0])
+        popular = Petition.objects.create(movie_name='Popular', created_by=users[0])
+        disliked = Petition.objects.create(movie_name='Disliked', created_by=users[0])
+        for user in users:
+            toggle(popular, user, like=True)
+        toggle(disliked, users[0], like=False)
+        toggle(disliked, users[1], like=False)
+
+        def feed(sort):
+            response = self.client.get(reverse('petitions.index'), {'sort': sort})
+            return [p.movie_name for p in response.context['template_data']['petitions']]
+
+        self.assertEqual(feed('new'), ['Disliked', 'Popular', 'Quiet'])
+        self.assertEqual(feed('top'), ['Popular', 'Quiet', 'Disliked'])
+        self.assertEqual(feed('trending')[0], 'Popular')
+        self.assertEqual(feed('trending')[-1], 'Disliked')
+
+    def test_admin_cannot_edit_scores(self):
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        petition = Petition.objects.create(movie_name='Edited', created_by=admin)
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(reverse('admin:petitions_petition_change', args=[petition.id]))
+        self.assertContains(response, 'name="movie_name"')
+        self.assertNotContains(response, 'name="net_votes"')
+        self.assertNotContains(response, 'name="hot_score"')
+
+    @override_settings(PETITIONS_PAGE_SIZE=2)
+    def test_invalid_cursors_show_the_first_page(self):
+        user = User.objects.create_user(username='author')
+        for i in range(5):
+            Petition.objects.create(movie_name=f'Movie {i}', created_by=user)
+        for sort in ['new', 'top', 'trending']:
+            first = self.client.get(reverse('petitions.index'), {'sort': sort})
+            first = [p.id for p in first.context['template_data']['petitions']]
+            for cursor in INVALID_CURSORS:
+                with self.subTest(sort=sort, cursor=cursor):
+                    response = self.client.get(reverse('petitions.index'),
+                                               {'sort': sort, 'after': cursor})
+                    self.assertEqual(response.status_code, 200)
+                    page = response.context['template_data']['petitions']
+                    self.assertEqual([p.id for p in page], first)
+
+
+class PetitionQueryPlanTests(QueryPlanTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='secret')
+        self.petitions = [
+            Petition.objects.create(movie_name=f'Movie {i}', created_by=self.user)
+            for i in range(25)
+        ]
+        self.client.login(username='voter', password='secret')
+
+    def test_feeds(self):
+        for sort in ['new', 'top', 'trending']:
+            response = self.assertNoFullScans(
+                self.client.get, reverse('petitions.index'), {'sort': sort})
+            page = response.context['template_data']['petitions']
+            self.assertNoFullScans(self.client.get, reverse('petitions.index'),
+                                   {'sort': sort, 'after': page.next_cursor})
+
+    def test_vote(self):
+        self.assertNoFullScans(self.client.post,
+                               reverse('petitions.vote', args=[self.petitions[0].id]))
+        self.assertNoFullScans(self.client.post,
+                               reverse('petitions.dislike', args=[self.petitions[0].id]))
@@ -1,13 +1,49 @@
 
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db.models import Exists, OuterRef
 from .models import Petition
 from .forms import PetitionForm
+from .voting import toggle
+from moviesstore.pagination import keyset_paginate
+
+def annotated_petitions(user):
+    """
+    Petitions with the user's own vote computed in SQL, so the listing costs
+    one query however many petitions and voters exist.
+    """
+    petitions = Petition.objects.select_related('created_by')
+    if user.is_authenticated:
+        petitions = petitions.annotate(
+            user_voted=Exists(Petition.voters.through.objects.filter(
+                petition_id=OuterRef('pk'), user_id=user.id)),
+            user_disliked=Exists(Petition.dislikers.through.objects.filter(
+                petition_id=OuterRef('pk'), user_id=user.id)),
+        )
+    return petitions
+
+# Feed name: label and keyset ordering (each backed by a Petition index)
+PETITION_FEEDS = {
+    'new': ('New', ['-created_at', '-id']),
+    'top': ('Top', ['-net_votes', '-id']),
+    'trending': ('Trending', ['-hot_score', '-id']),
+}
 
 def index(request):
+    feed = request.GET.get('sort')
+    if feed not in PETITION_FEEDS:
+        feed = 'new'
+    page = keyset_paginate(annotated_petitions(request.user),
+                           PETITION_FEEDS[feed][1],
+                           after=request.GET.get('after'),
+                           before=request.GET.get('before'),
+                           page_size=getattr(settings, 'PETITIONS_PAGE_SIZE', 20))
     template_data = {}
     template_data['title'] = 'Petitions'
-    template_data['petitions'] = Petition.objects.all()
+    template_data['petitions'] = page
+    template_data['sort'] = feed
+    template_data['feeds'] = [(key, label) for key, (label, _) in PETITION_FEEDS.items()]
     template_data['form'] = PetitionForm()
     return render(request, 'petitions/index.html', {'template_data': template_data})
 
@@ -25,33 +61,13 @@ def create(request):
 @login_required
 def vote(request, id):
     petition = get_object_or_404(Petition, id=id)
-    
-     # Remove dislike if user previously disliked
-    if request.user in petition.dislikers.all():
-        petition.dislikers.remove(request.user)
-
-    if request.user in petition.voters.all():
-        # User already voted, remove their vote
-        petition.voters.remove(request.user)
-    else:
-        # User hasn't voted, add their vote
-        petition.voters.add(request.user)
-    
+    # Adds the like (removing any dislike), or withdraws an existing like
+    toggle(petition, request.user, like=True)
     return redirect('petitions.index')
 
 @login_required
 def dislike(request, id):
     petition = get_object_or_404(Petition, id=id)
-    
-    # Remove vote if user previously voted
-    if request.user in petition.voters.all():
-        petition.voters.remove(request.user)
-    
-    if request.user in petition.dislikers.all():
-        # User already disliked, remove their dislike
-        petition.dislikers.remove(request.user)
-    else:
-        # User hasn't disliked, add their dislike
-        petition.dislikers.add(request.user)
-    
+    # Adds the dislike (removing any like), or withdraws an existing dislike
+    toggle(petition, request.user, like=False)
     return redirect('petitions.index')
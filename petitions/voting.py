@@ -0,0 +1,148 @@
+"""
+Vote bookkeeping for petitions.
+
+Petition.votes_count and Petition.dislikes_count mirror the size of the
+voters and dislikers join tables so that reading a count never scans them.
+Every toggle updates the join table and the counters in one transaction,
+using F() expressions so concurrent toggles never overwrite each other's
+counts. `reconcile` recomputes the counters from the join tables to repair
+any drift (for example after voters were edited in the admin).
+
+Toggles on the same petition are serialized: where the backend supports
+SELECT ... FOR UPDATE the petition row is locked first; on SQLite the first
+statement of the transaction is a write, which takes the database write
+lock up front (a read first would risk SQLITE_BUSY when upgrading the lock).
+The decision to add or withdraw a vote is then taken from the number of
+rows DELETE actually removed, so a user can never end up in both sets and
+the counters always move by what really changed.
+
+Each toggle also refreshes the ranking columns. net_votes is likes minus
+dislikes and backs the "top" feed. hot_score backs the "trending" feed:
+
+    sign(net) * log10(max(|net|, 1)) + (created_at - SCORE_EPOCH) / TRENDING_TIMESCALE
+
+Decay is built into the creation-time term, so a petition's score only
+changes when its votes do, and the feed is a plain index scan. With a 12.5
+hour timescale, a petition needs ten times the net votes to stay level with
+one created 12.5 hours later.
+"""
+import math
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Abs, Coalesce, Greatest, Log, Sign
+
+from .models import Petition
+
+Voters = Petition.voters.through
+Dislikers = Petition.dislikers.through
+
+SCORE_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TRENDING_TIMESCALE = 45000  # seconds
+
+
+def time_score(created_at):
+    return (created_at - SCORE_EPOCH).total_seconds() / TRENDING_TIMESCALE
+
+
+def hot_score(net_votes, created_at):
+    """Trending score of a petition (see the module docstring)."""
+    sign = (net_votes > 0) - (net_votes < 0)
+    return sign * math.log10(max(abs(net_votes), 1)) + time_score(created_at)
+
+
+def hot_score_expression(net_votes, created_at):
+    """hot_score() as a database expression of a net votes expression."""
+    return (Sign(net_votes) * Log(Value(10.0), Greatest(Abs(net_votes), Value(1)))
+            + Value(time_score(created_at), output_field=FloatField()))
+
+
+def toggle(petition, user, like=True):
+    """
+    Like or dislike a petition on behalf of a user.
+
+    Choosing the same option twice withdraws it; choosing the other option
+    moves the user's vote.
+
+    Args:
+        petition: Petition being voted on
+        user: Voting user
+        like: True to toggle a like, False to toggle a dislike
+    """
+    chosen, other = (Voters, Dislikers) if like else (Dislikers, Voters)
+    membership = {'petition_id': petition.id, 'user_id': user.id}
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            list(Petition.objects.select_for_update()
+                 .filter(id=petition.id).values_list('id'))
+        removed_other = other.objects.filter(**membership).delete()[0]
+        removed_chosen = chosen.objects.filter(**membership).delete()[0]
+        if removed_chosen:
+            chosen_delta = -removed_chosen
+        else:
+            chosen.objects.create(**membership)
+            chosen_delta = 1
+
+        votes_delta, dislikes_delta = (
+            (chosen_delta, -removed_other) if like
+            else (-removed_other, chosen_delta))
+        # All expressions see the row as it was before this UPDATE
+        net_votes = F('net_votes') + (votes_delta - dislikes_delta)
+        Petition.objects.filter(id=petition.id).update(
+            votes_count=F('votes_count') + votes_delta,
+            dislikes_count=F('dislikes_count') + dislikes_delta,
+            net_votes=net_votes,
+            hot_score=hot_score_expression(net_votes, petition.created_at),
+        )
+
+
+def count_subquery(through):
+    """COUNT of a petition's rows in the voters or dislikers join table."""
+    return Coalesce(Subquery(
+        through.objects
+        .filter(petition_id=OuterRef('pk'))
+        .order_by()
+        .values('petition_id')
+        .annotate(count=Count('*'))
+        .values('count')
+    ), 0)
+
+
+def find_drift(petitions=None):
+    """Ids of petitions whose counters disagree with the join tables."""
+    if petitions is None:
+        petitions = Petition.objects.all()
+    return list(
+        petitions
+        .annotate(actual_votes=count_subquery(Voters),
+                  actual_dislikes=count_subquery(Dislikers))
+        .filter(~Q(votes_count=F('actual_votes'))
+                | ~Q(dislikes_count=F('actual_dislikes'))
+                | ~Q(net_votes=F('actual_votes') - F('actual_dislikes')))
+        .values_list('id', flat=True)
+    )
+
+
+def reconcile(petitions=None):
+    """
+    Recompute the stored counters from the join tables.
+
+    Args:
+        petitions: QuerySet of petitions to check (all petitions by default)
+
+    Returns:
+        Number of petitions whose counters had drifted and were repaired
+    """
+    ids = find_drift(petitions)
+    if ids:
+        Petition.objects.filter(id__in=ids).update(
+            votes_count=count_subquery(Voters),
+            dislikes_count=count_subquery(Dislikers),
+        )
+        repaired = list(Petition.objects.filter(id__in=ids))
+        for petition in repaired:
+            petition.net_votes = petition.votes_count - petition.dislikes_count
+            petition.hot_score = hot_score(petition.net_votes, petition.created_at)
+        Petition.objects.bulk_update(repaired, ['net_votes', 'hot_score'])
+    return len(ids)